@@ -10,6 +10,55 @@ T_ZONE = os.getenv("T_ZONE", "UTC")
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 MASTER_TAG_DB = os.getenv("MASTER_TAG_DB")
 MASTER_TASKS_DB_ID = os.getenv("MASTER_TASKS_DB_ID")
+NOTION_SCHEMA_CACHE_TTL = int(os.getenv("NOTION_SCHEMA_CACHE_TTL", "300"))  # seconds
+NOTION_WRITE_CONCURRENCY = int(os.getenv("NOTION_WRITE_CONCURRENCY", "1"))  # >1 runs writes through asyncio
+NOTION_FILTER_BATCH_SIZE = int(os.getenv("NOTION_FILTER_BATCH_SIZE", "100"))  # conditions of one batched OR query
+NOTION_QUERY_CONCURRENCY = int(os.getenv("NOTION_QUERY_CONCURRENCY", "3"))
 
 # Todoist configuration
 TODOIST_TOKEN = os.getenv("TODOIST_TOKEN")
+TODOIST_COMMENT_WORKERS = int(os.getenv("TODOIST_COMMENT_WORKERS", "4"))
+TODOIST_COMMENT_CACHE_SIZE = int(os.getenv("TODOIST_COMMENT_CACHE_SIZE", "5000"))  # tasks whose comments are kept
+# Activity-log pages fetched concurrently during a full scan
+TODOIST_ACTIVITY_WORKERS = int(os.getenv("TODOIST_ACTIVITY_WORKERS", "4"))
+
+# HTTP transport
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"  # needs optional `h2` package
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))  # seconds
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))  # seconds
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))  # seconds
+# Rate limits (requests per second, burst size). Notion allows ~3 req/s, Todoist 1000 requests per 15 minutes
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))
+NOTION_RATE_BURST = int(os.getenv("NOTION_RATE_BURST", "3"))
+TODOIST_RATE_LIMIT = float(os.getenv("TODOIST_RATE_LIMIT", str(1000 / 900)))
+TODOIST_RATE_BURST = int(os.getenv("TODOIST_RATE_BURST", "50"))
+
+# Sync loop. With a webhook port set, changes are synced as webhooks arrive
+# and the full sync only runs every SYNC_RECONCILE_INTERVAL seconds to catch missed deliveries.
+# Without webhooks every sync phase is polled on its own interval, starting at SYNC_INTERVAL:
+# it drops toward SYNC_MIN_INTERVAL while polls find changes (straight to it after SYNC_BURST_THRESHOLD changes)
+# and grows toward SYNC_MAX_INTERVAL while idle. Phases due at the same time share one read of the activity log.
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "60"))  # seconds
+SYNC_MIN_INTERVAL = float(os.getenv("SYNC_MIN_INTERVAL", "10"))  # seconds
+SYNC_MAX_INTERVAL = float(os.getenv("SYNC_MAX_INTERVAL", "600"))  # seconds
+SYNC_BURST_THRESHOLD = int(os.getenv("SYNC_BURST_THRESHOLD", "20"))  # changes of one poll
+SYNC_RECONCILE_INTERVAL = float(os.getenv("SYNC_RECONCILE_INTERVAL", "900"))  # seconds
+# Other hosts than loopback ones (e.g. 0.0.0.0 to receive deliveries directly) require TODOIST_WEBHOOK_SECRET
+TODOIST_WEBHOOK_HOST = os.getenv("TODOIST_WEBHOOK_HOST", "127.0.0.1")
+TODOIST_WEBHOOK_PORT = int(os.getenv("TODOIST_WEBHOOK_PORT") or "0")  # 0 disables the webhook receiver
+TODOIST_WEBHOOK_SECRET = os.getenv("TODOIST_WEBHOOK_SECRET")  # client secret of the Todoist app, verifies deliveries
+TODOIST_WEBHOOK_DEBOUNCE = float(os.getenv("TODOIST_WEBHOOK_DEBOUNCE", "2"))  # seconds to collect a burst of events
+
+# Local state
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "sync_state.db")
+TASK_INDEX_FULL_REFRESH_HOURS = int(os.getenv("TASK_INDEX_FULL_REFRESH_HOURS", "24"))
+# Completed tasks are read from the end of the previous fetch, this much earlier to allow for clock skew
+COMPLETED_TASKS_OVERLAP = float(os.getenv("COMPLETED_TASKS_OVERLAP", "300"))  # seconds
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))  # replays of a failing Notion/Todoist write
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", "72"))  # how long finished writes are kept
+
+# Request and sync phase metrics, logged as JSON after every cycle and optionally written to METRICS_PATH
+METRICS_PATH = os.getenv("METRICS_PATH")  # e.g. a node_exporter textfile collector *.prom file
+METRICS_FORMAT = os.getenv("METRICS_FORMAT", "prometheus")  # of METRICS_PATH: prometheus or json
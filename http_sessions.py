@@ -0,0 +1,86 @@
+import importlib.util
+import logging
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from metrics import sync_metrics
+from rate_limit import RequestScheduler, ScheduledSession, ScheduledClient
+
+_LOG = logging.getLogger(__name__)
+_lock = threading.Lock()
+_sessions: dict[str, requests.Session] = {}
+_clients: dict[str, httpx.Client] = {}
+
+# One scheduler per service: Todoist REST and Sync API calls count against the same per-user limit
+schedulers = {
+    'notion': RequestScheduler('notion', config.NOTION_RATE_LIMIT, config.NOTION_RATE_BURST,
+                               config.HTTP_MAX_RETRIES, config.HTTP_BACKOFF_BASE, config.HTTP_BACKOFF_MAX),
+    'todoist': RequestScheduler('todoist', config.TODOIST_RATE_LIMIT, config.TODOIST_RATE_BURST,
+                                config.HTTP_MAX_RETRIES, config.HTTP_BACKOFF_BASE, config.HTTP_BACKOFF_MAX),
+}
+for _scheduler in schedulers.values():
+    _scheduler.hooks.append(sync_metrics.record)
+
+
+def _pooled_session(scheduler: RequestScheduler) -> requests.Session:
+    session = ScheduledSession(scheduler, timeout=config.HTTP_TIMEOUT)
+    adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_SIZE, pool_maxsize=config.HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _get_session(name: str, scheduler: RequestScheduler) -> requests.Session:
+    with _lock:
+        if name not in _sessions:
+            _sessions[name] = _pooled_session(scheduler)
+        return _sessions[name]
+
+
+def notion_session() -> requests.Session:
+    """Keep-alive, rate-limited session shared by all Notion REST calls"""
+    return _get_session('notion', schedulers['notion'])
+
+
+def todoist_session() -> requests.Session:
+    """Keep-alive, rate-limited session shared by all TodoistAPI (REST) instances"""
+    return _get_session('todoist', schedulers['todoist'])
+
+
+def http2_available() -> bool:
+    return config.HTTP2_ENABLED and importlib.util.find_spec('h2') is not None
+
+
+def httpx_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=config.HTTP_POOL_SIZE, max_keepalive_connections=config.HTTP_POOL_SIZE)
+
+
+def todoist_sync_client() -> httpx.Client:
+    """Keep-alive client for Todoist Sync API endpoints. Uses HTTP/2 if the optional `h2` package is installed."""
+    with _lock:
+        if 'todoist_sync' not in _clients:
+            http2 = http2_available()
+            limits = httpx_limits()
+            _clients['todoist_sync'] = ScheduledClient(schedulers['todoist'], http2=http2, limits=limits,
+                                                       timeout=config.HTTP_TIMEOUT)
+            _LOG.debug(f"Created Todoist Sync API client ({http2=})")
+        return _clients['todoist_sync']
+
+
+def scheduler_stats() -> dict[str, dict[str, float]]:
+    """Queue depth, throttle time and retry counters per service"""
+    return {name: scheduler.stats() for name, scheduler in schedulers.items()}
+
+
+def close_all():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        for client in _clients.values():
+            client.close()
+        _sessions.clear()
+        _clients.clear()
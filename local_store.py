@@ -0,0 +1,291 @@
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from typing import Iterable
+
+import config
+
+_LOG = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_links (
+    task_id TEXT PRIMARY KEY,
+    page_id TEXT NOT NULL,
+    url TEXT,
+    synced TEXT,
+    fingerprint TEXT,
+    property_fingerprints TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, kind, key);
+CREATE TABLE IF NOT EXISTS todoist_items (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+# Columns added after the first release, created on stores of older versions
+_MIGRATIONS = {
+    'task_links': {'fingerprint': 'TEXT', 'property_fingerprints': 'TEXT'},
+}
+_LINK_COLUMNS = "task_id, page_id, url, synced, fingerprint, property_fingerprints"
+OP_PENDING = 'pending'
+OP_DONE = 'done'
+OP_FAILED = 'failed'  # gave up after OUTBOX_MAX_ATTEMPTS
+OP_SUPERSEDED = 'superseded'  # replaced by a later operation of the same kind and key
+ITEMS_SYNC_TOKEN_STATE = 'todoist_items.sync_token'
+
+
+@dataclass
+class TaskLink:
+    task_id: str
+    page_id: str
+    url: str | None = None
+    synced: str | None = None
+    fingerprint: str | None = None  # hash of the Notion payload last written for the task
+    property_fingerprints: dict[str, str] | None = None  # the same per mapped property
+
+
+@dataclass
+class OutboxOp:
+    id: int
+    kind: str
+    key: str
+    payload: dict = field(default_factory=dict)
+    attempts: int = 0
+
+
+class LocalStore:
+    """
+    SQLite-backed state kept between sync cycles.
+    Holds the Todoist task id -> Notion page index with payload fingerprints,
+    a small key/value table for sync watermarks,
+    the outbox of Notion/Todoist mutations planned but not confirmed yet
+    and the Todoist items (tasks) kept up to date by incremental Sync API syncs.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or config.LOCAL_STORE_PATH
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Every outbox operation is a commit, WAL keeps them cheap and still survives a crash of the process
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        for table, columns in _MIGRATIONS.items():
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                    _LOG.info(f"Added column {table}.{column} to {self.path}")
+
+    def close(self):
+        self._conn.close()
+
+    """
+    Task links
+    """
+
+    def get_link(self, task_id: str) -> TaskLink | None:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_LINK_COLUMNS} FROM task_links WHERE task_id = ?",
+                                     (str(task_id),)).fetchone()
+        return _link_from_row(row) if row else None
+
+    def get_links(self, task_ids: Iterable[str]) -> dict[str, TaskLink]:
+        """Links of the given tasks by task id, unlinked tasks are left out"""
+        ids = json.dumps([str(task_id) for task_id in task_ids])
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {_LINK_COLUMNS} FROM task_links "
+                                      f"WHERE task_id IN (SELECT value FROM json_each(?))", (ids,)).fetchall()
+        return {row[0]: _link_from_row(row) for row in rows}
+
+    def is_linked(self, task_id: str) -> bool:
+        return self.get_link(task_id) is not None
+
+    def linked_task_ids(self) -> set[str]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT task_id FROM task_links")}
+
+    def upsert_link(self, link: TaskLink):
+        self.upsert_links([link])
+
+    def upsert_links(self, links: Iterable[TaskLink]):
+        """Insert or update links. Synced time and fingerprints not given are kept while the page stays the same."""
+        rows = [_link_to_row(link) for link in links]
+        with self._lock, self._conn:
+            self._upsert_rows(rows)
+        _LOG.debug(f"Upserted {len(rows)} task links")
+
+    def _upsert_rows(self, rows: list[tuple]):
+        self._conn.executemany(
+            f"INSERT INTO task_links ({_LINK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(task_id) DO UPDATE SET page_id = excluded.page_id, url = excluded.url, "
+            "synced = COALESCE(excluded.synced, task_links.synced), "
+            "fingerprint = CASE WHEN excluded.page_id = task_links.page_id "
+            "THEN COALESCE(excluded.fingerprint, task_links.fingerprint) ELSE excluded.fingerprint END, "
+            "property_fingerprints = CASE WHEN excluded.page_id = task_links.page_id "
+            "THEN COALESCE(excluded.property_fingerprints, task_links.property_fingerprints) "
+            "ELSE excluded.property_fingerprints END", rows)
+
+    def replace_links(self, links: Iterable[TaskLink]):
+        """
+        Make the given links the whole index (used by full refreshes).
+        Fingerprints of tasks still linked to the same page are kept.
+        """
+        rows = [_link_to_row(link) for link in links]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM task_links WHERE task_id NOT IN (SELECT value FROM json_each(?))",
+                               (json.dumps([row[0] for row in rows]),))
+            self._upsert_rows(rows)
+        _LOG.debug(f"Rebuilt task index with {len(rows)} links")
+
+    def set_fingerprints(self, task_id: str, fingerprint: str, property_fingerprints: dict[str, str]):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE task_links SET fingerprint = ?, property_fingerprints = ? WHERE task_id = ?",
+                               (fingerprint, json.dumps(property_fingerprints), str(task_id)))
+
+    def remove_link(self, task_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM task_links WHERE task_id = ?", (str(task_id),))
+
+    """
+    Sync state
+    """
+
+    def get_state(self, key: str, default: str = None) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key: str, value: str | None):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+    """
+    Outbox
+    """
+
+    def append_op(self, kind: str, key: str, payload: dict) -> int:
+        return self.append_ops([(kind, key, payload)])[0]
+
+    def append_ops(self, ops: Iterable[tuple[str, str, dict]]) -> list[int]:
+        """
+        Record planned mutations as (kind, key, payload) before running them, in one transaction.
+        Pending operations of the same kind and key are superseded, so a resume never replays stale payloads.
+        @return: operation ids, in the given order
+        """
+        now = _now()
+        ids = []
+        with self._lock, self._conn:
+            for kind, key, payload in ops:
+                self._conn.execute("UPDATE outbox SET status = ?, updated = ? "
+                                   "WHERE status = ? AND kind = ? AND key = ?",
+                                   (OP_SUPERSEDED, now, OP_PENDING, kind, str(key)))
+                cursor = self._conn.execute("INSERT INTO outbox (kind, key, payload, updated) VALUES (?, ?, ?, ?)",
+                                            (kind, str(key), json.dumps(payload), now))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def pending_ops(self, kinds: Iterable[str] = None) -> list[OutboxOp]:
+        """Operations not confirmed yet, oldest first"""
+        query = "SELECT id, kind, key, payload, attempts FROM outbox WHERE status = ?"
+        params: tuple = (OP_PENDING,)
+        if kinds is not None:
+            query += " AND kind IN (SELECT value FROM json_each(?))"
+            params += (json.dumps(list(kinds)),)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+        return [OutboxOp(op_id, kind, key, json.loads(payload), attempts)
+                for op_id, kind, key, payload, attempts in rows]
+
+    def complete_ops(self, op_ids: Iterable[int]):
+        rows = [(OP_DONE, _now(), op_id, OP_PENDING) for op_id in op_ids]
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE outbox SET status = ?, updated = ? WHERE id = ? AND status = ?", rows)
+
+    def fail_op(self, op_id: int, error: str, max_attempts: int = None):
+        """Count a failed attempt, the operation stays pending until it failed `max_attempts` times"""
+        max_attempts = max_attempts or config.OUTBOX_MAX_ATTEMPTS
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE outbox SET attempts = attempts + 1, error = ?, updated = ?, "
+                               "status = CASE WHEN attempts + 1 >= ? THEN ? ELSE status END "
+                               "WHERE id = ? AND status = ?",
+                               (error, _now(), max_attempts, OP_FAILED, op_id, OP_PENDING))
+
+    def prune_ops(self, before: str) -> int:
+        """Delete finished operations last updated before the given ISO time. Returns the number deleted."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM outbox WHERE status != ? AND updated < ?", (OP_PENDING, before))
+        return cursor.rowcount
+
+    """
+    Todoist items
+    """
+
+    def get_items(self, item_ids: Iterable[str]) -> dict[str, dict]:
+        """Sync API items of the given ids by id, unknown ids are left out"""
+        ids = json.dumps([str(item_id) for item_id in item_ids])
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM todoist_items "
+                                      "WHERE id IN (SELECT value FROM json_each(?))", (ids,)).fetchall()
+        return {item_id: json.loads(data) for item_id, data in rows}
+
+    def item_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM todoist_items").fetchone()[0]
+
+    def apply_item_sync(self, items: Iterable[dict], full_sync: bool, sync_token: str):
+        """
+        Apply the items of a Sync API response together with its sync_token, in one transaction.
+        A full sync replaces all items, an incremental one upserts them and removes deleted ones.
+        Items are stored by their `id`.
+        """
+        upserts, deletes = [], []
+        for item in items:
+            if item.get('is_deleted'):
+                deletes.append((str(item['id']),))
+            else:
+                upserts.append((str(item['id']), json.dumps(item)))
+        with self._lock, self._conn:
+            if full_sync:
+                self._conn.execute("DELETE FROM todoist_items")
+            self._conn.executemany("DELETE FROM todoist_items WHERE id = ?", deletes)
+            self._conn.executemany("INSERT OR REPLACE INTO todoist_items (id, data) VALUES (?, ?)", upserts)
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                               (ITEMS_SYNC_TOKEN_STATE, sync_token))
+        _LOG.debug(f"Applied {'full' if full_sync else 'incremental'} item sync: "
+                   f"{len(upserts)} items updated, {len(deletes)} deleted")
+
+
+def _now() -> str:
+    return datetime.now(UTC).isoformat()
+
+
+def _link_to_row(link: TaskLink) -> tuple:
+    property_fingerprints = json.dumps(link.property_fingerprints) if link.property_fingerprints else None
+    return str(link.task_id), link.page_id, link.url, link.synced, link.fingerprint, property_fingerprints
+
+
+def _link_from_row(row: tuple) -> TaskLink:
+    *columns, property_fingerprints = row
+    return TaskLink(*columns, json.loads(property_fingerprints) if property_fingerprints else None)
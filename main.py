@@ -1,20 +1,89 @@
+import asyncio
+import functools
 import logging
 import time
 
+import config
+from http_sessions import scheduler_stats
+from metrics import sync_metrics
+from notion import schema_cache
+from polling import PollScheduler
 from todoist_sync_manager import TodoistSyncManager
+from todoist_utils import SharedEventSnapshot
+from webhooks import WebhookReceiver
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(funcName)s - %(levelname)s - %(message)s', level=logging.DEBUG)
 logging.getLogger('urllib3').setLevel(logging.INFO)
 
+
+def _phase(sync, sync_async, **kwargs):
+    if config.NOTION_WRITE_CONCURRENCY > 1:
+        return lambda **more: asyncio.run(sync_async(**kwargs, **more))
+    return functools.partial(sync, **kwargs)
+
+
+def _shared_snapshot_phase(shared: SharedEventSnapshot, name: str, run):
+    def run_phase():
+        changes = run(snapshot=shared.get(name))
+        shared.processed(name)
+        return changes
+    return run_phase
+
+
+def poll(scenarios: TodoistSyncManager):
+    """
+    Poll every sync phase on its own adaptive interval.
+    Phases due in the same tick share one read of the activity log.
+    """
+    poller = PollScheduler()
+    phases = (('deleted', _phase(scenarios.sync_deleted_tasks, scenarios.sync_deleted_tasks_async)),
+              ('updated', _phase(scenarios.sync_updated_tasks, scenarios.sync_updated_tasks_async)),
+              ('created', _phase(scenarios.sync_created_tasks, scenarios.sync_created_tasks_async,
+                                 sync_completed=True)))
+    shared = SharedEventSnapshot(scenarios.todoist_fetcher, [name for name, _ in phases])
+    for name, run in (('outbox', scenarios.resume_outbox),
+                      *((name, _shared_snapshot_phase(shared, name, run)) for name, run in phases)):
+        poller.add(name, run, config.SYNC_MIN_INTERVAL, config.SYNC_MAX_INTERVAL, initial=config.SYNC_INTERVAL,
+                   burst_threshold=config.SYNC_BURST_THRESHOLD)
+    while True:
+        if poller.run_pending():
+            shared.expire()
+            logging.info(f"Request scheduler stats: {scheduler_stats()}")
+            logging.info(f"Notion schema cache stats: {schema_cache.stats()}")
+            logging.info(f"Poll job stats: {poller.stats()}")
+            sync_metrics.export()
+        poller.wait()
+
+
+def sync_webhooks(scenarios: TodoistSyncManager, receiver: WebhookReceiver):
+    """Sync webhook events as they come, reconcile with a full sync every SYNC_RECONCILE_INTERVAL"""
+    while True:
+        if config.NOTION_WRITE_CONCURRENCY > 1:
+            asyncio.run(scenarios.sync_cycle_async())
+        else:
+            scenarios.sync_cycle()
+        logging.info(f"Request scheduler stats: {scheduler_stats()}")
+        logging.info(f"Notion schema cache stats: {schema_cache.stats()}")
+        sync_metrics.export()
+        reconcile_at = time.monotonic() + config.SYNC_RECONCILE_INTERVAL
+        while receiver.queue.wait(timeout=max(0.0, reconcile_at - time.monotonic())):
+            events = receiver.queue.drain(debounce=config.TODOIST_WEBHOOK_DEBOUNCE)
+            logging.info(f"Syncing {len(events)} webhook events")
+            if config.NOTION_WRITE_CONCURRENCY > 1:
+                asyncio.run(scenarios.sync_events_async(events))
+            else:
+                scenarios.sync_events(events)
+            sync_metrics.export()
+
+
 if __name__ == '__main__':
     scenarios = TodoistSyncManager()
     print('Started scenarios...')
     # gather_metadata(todoist_api)
+    scenarios.resume_outbox()  # Writes left pending by a previous run
     scenarios.sync_created_tasks(all_tasks=True, sync_completed=False, overwrite_existing_backlinks=True)  # One time migration of all tasks to Notion
-    while True:
-        scenarios.sync_deleted_tasks()
-        scenarios.sync_updated_tasks()
-        scenarios.sync_created_tasks(sync_completed=True)
     #     # sync_periodic_actions()
-        print("Waiting for 60 seconds before next sync...")
-        time.sleep(60)
+    if config.TODOIST_WEBHOOK_PORT:
+        sync_webhooks(scenarios, WebhookReceiver().start())
+    else:
+        poll(scenarios)
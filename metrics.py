@@ -0,0 +1,249 @@
+"""
+Request and sync phase metrics.
+Every Notion and Todoist request finished by a RequestScheduler is recorded by endpoint, status and sync phase
+(the phase running when it was sent, see `phase`), with its latency, retries and bytes.
+At the end of a cycle `export` logs a JSON summary of the cycle and/or writes it, or the Prometheus text format
+(totals since the start), to a file.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import config
+from polling import DURATION_BUCKETS, Histogram
+from rate_limit import RequestRecord
+
+_LOG = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+NO_PHASE = 'other'
+# Path segments that are object ids (Notion UUIDs, Todoist ids), replaced to group requests by endpoint
+_ID_SEGMENT = re.compile(r'^(?=[^/]*\d)[0-9A-Za-z-]{8,}$')
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0  # failed last attempts and responses with status >= 400
+    retries: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    latency: Histogram = field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+
+
+class SyncMetrics:
+    """Request stats per (phase, service, method, endpoint, status) and durations per phase"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: dict[tuple[str, str, str, str, str], EndpointStats] = defaultdict(EndpointStats)
+        self._phases: dict[str, Histogram] = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self._phase = NO_PHASE
+        self._exported: dict = {}  # summary at the previous export
+
+    @property
+    def current_phase(self) -> str:
+        return self._phase
+
+    def record(self, record: RequestRecord):
+        """RequestScheduler hook"""
+        status = str(record.status) if record.status is not None else record.error or 'error'
+        key = (self._phase, record.service, record.method, endpoint(record.url), status)
+        with self._lock:
+            stats = self._endpoints[key]
+            stats.requests += 1
+            stats.errors += 1 if record.status is None or record.status >= 400 else 0
+            stats.retries += record.retries
+            stats.bytes_sent += record.bytes_sent
+            stats.bytes_received += record.bytes_received
+        stats.latency.observe(record.latency)
+
+    def phase(self, name: str) -> '_Phase':
+        """
+        Attribute requests to the sync phase `name` while the returned context manager is entered.
+        Phases run one at a time, so requests from worker threads of the phase are attributed to it as well.
+        """
+        return _Phase(self, name)
+
+    def observe_phase(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self._phases[name]
+        histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._phases.clear()
+            self._exported = {}
+
+    def summary(self) -> dict:
+        """Per phase: runs, seconds and totals of its requests (since the start), plus the same per endpoint"""
+        with self._lock:
+            endpoints = list(self._endpoints.items())
+            histograms = list(self._phases.items())
+        phases = {name: _phase_totals(histogram.snapshot()) for name, histogram in histograms}
+        for (phase, service, method, path, status), stats in endpoints:
+            totals = phases.setdefault(phase, _phase_totals(None))
+            latency = stats.latency.snapshot()
+            for total in (totals, totals['endpoints'].setdefault(f"{service} {method} {path}", _request_totals())):
+                total['requests'] += stats.requests
+                total['errors'] += stats.errors
+                total['retries'] += stats.retries
+                total['request_seconds'] = round(total['request_seconds'] + latency['sum'], 3)
+                total['bytes_sent'] += stats.bytes_sent
+                total['bytes_received'] += stats.bytes_received
+                total['statuses'][status] = total['statuses'].get(status, 0) + stats.requests
+        return phases
+
+    def prometheus(self, prefix: str = 'notion_todoist') -> str:
+        """Prometheus text exposition format of all metrics"""
+        with self._lock:
+            endpoints = [(key, stats, stats.latency.snapshot()) for key, stats in self._endpoints.items()]
+            histograms = list(self._phases.items())
+        phases = [(name, histogram.snapshot()) for name, histogram in histograms]
+        lines = []
+        counters = (('requests_total', "Finished requests", lambda s: s.requests),
+                    ('request_errors_total', "Requests failed or answered with status >= 400", lambda s: s.errors),
+                    ('request_retries_total', "Retried attempts of requests", lambda s: s.retries),
+                    ('request_sent_bytes_total', "Request body bytes", lambda s: s.bytes_sent),
+                    ('request_received_bytes_total', "Response body bytes", lambda s: s.bytes_received))
+        for name, help_text, value in counters:
+            lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} counter"]
+            lines += [f"{prefix}_{name}{_labels(_endpoint_labels(key))} {value(stats)}"
+                      for key, stats, _ in endpoints]
+        name = f"{prefix}_request_duration_seconds"
+        lines += [f"# HELP {name} Time spent sending requests, retries included", f"# TYPE {name} histogram"]
+        for key, _, latency in endpoints:
+            lines += _histogram_lines(name, _endpoint_labels(key), latency)
+        name = f"{prefix}_phase_duration_seconds"
+        lines += [f"# HELP {name} Wall time of sync phase runs", f"# TYPE {name} histogram"]
+        for phase, durations in phases:
+            lines += _histogram_lines(name, {'phase': phase}, durations)
+        return '\n'.join(lines) + '\n'
+
+    def export(self, fmt: str = None, path: str = None):
+        """
+        Log the JSON summary of the requests since the previous export (the cycle) and, with a path,
+        write it or the Prometheus metrics (cumulative counters) to it, depending on `fmt` ('json' or 'prometheus').
+        The file is replaced atomically, so it can be read by e.g. the node_exporter textfile collector.
+        """
+        fmt = fmt or config.METRICS_FORMAT
+        path = path if path is not None else config.METRICS_PATH
+        totals = self.summary()
+        summary = _summary_difference(totals, self._exported)
+        self._exported = totals
+        _LOG.info(f"Sync metrics: {json.dumps(summary)}")
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus() if fmt == 'prometheus' else json.dumps(summary, indent=2))
+        os.replace(tmp_path, path)
+
+
+class _Phase:
+    """Context manager and (sync or async) function decorator setting the current phase"""
+
+    def __init__(self, metrics: SyncMetrics, name: str):
+        self.metrics = metrics
+        self.name = name
+        self._outer: list[tuple[str, float]] = []
+
+    def __enter__(self):
+        self._outer.append((self.metrics._phase, time.monotonic()))
+        self.metrics._phase = self.name
+        return self
+
+    def __exit__(self, *exc_info):
+        outer, started = self._outer.pop()
+        self.metrics._phase = outer
+        self.metrics.observe_phase(self.name, time.monotonic() - started)
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self:
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self:
+                    return func(*args, **kwargs)
+        return wrapper
+
+
+def endpoint(url: str) -> str:
+    """URL path with object ids replaced by {id}, e.g. /v1/pages/{id}"""
+    path = urlsplit(url).path.rstrip('/') or '/'
+    return '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+
+def _request_totals() -> dict:
+    return {'requests': 0, 'errors': 0, 'retries': 0, 'request_seconds': 0.0, 'bytes_sent': 0,
+            'bytes_received': 0, 'statuses': {}}
+
+
+def _phase_totals(durations: dict | None) -> dict:
+    return {'runs': durations['count'] if durations else 0,
+            'seconds': round(durations['sum'], 3) if durations else 0.0,
+            **_request_totals(), 'endpoints': {}}
+
+
+def _summary_difference(summary: dict, previous: dict) -> dict:
+    """Phases and endpoints of `summary` with the totals of an earlier `previous` summary subtracted"""
+    phases = {}
+    for name, totals in summary.items():
+        before = previous.get(name, {})
+        phase = _totals_difference(totals, before)
+        if not phase['runs'] and not phase['requests']:
+            continue
+        endpoints_before = before.get('endpoints', {})
+        phase['endpoints'] = {}
+        for key, endpoint_totals in totals['endpoints'].items():
+            difference = _totals_difference(endpoint_totals, endpoints_before.get(key, {}))
+            if difference['requests']:
+                phase['endpoints'][key] = difference
+        phases[name] = phase
+    return phases
+
+
+def _totals_difference(totals: dict, before: dict) -> dict:
+    difference = {key: round(value - before.get(key, 0), 3) if isinstance(value, float) else value - before.get(key, 0)
+                  for key, value in totals.items() if isinstance(value, int | float)}
+    statuses = before.get('statuses', {})
+    difference['statuses'] = {status: count - statuses.get(status, 0) for status, count in totals['statuses'].items()
+                              if count - statuses.get(status, 0)}
+    return difference
+
+
+def _endpoint_labels(key: tuple[str, str, str, str, str]) -> dict[str, str]:
+    return dict(zip(('phase', 'service', 'method', 'endpoint', 'status'), key))
+
+
+def _labels(labels: dict[str, str]) -> str:
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name: str, labels: dict[str, str], snapshot: dict) -> list[str]:
+    lines = [f"{name}_bucket{_labels({**labels, 'le': bound})} {count}"
+             for bound, count in snapshot['buckets'].items()]
+    return lines + [f"{name}_sum{_labels(labels)} {snapshot['sum']}",
+                    f"{name}_count{_labels(labels)} {snapshot['count']}"]
+
+
+# Shared by both request schedulers (see http_sessions) and the sync phases
+sync_metrics = SyncMetrics()
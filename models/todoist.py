@@ -8,3 +8,4 @@ class TodoistTask:
     task: Task
     comments: list[Comment] = field(default_factory=list)
     notion_url: str | None = None
+    notion_page_id: str | None = None
@@ -1,18 +1,24 @@
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from functools import reduce
+from typing import Generator, Iterator
 
 import pytz
 import requests
 
 import config
+from http_sessions import notion_session
 from models import TodoistTask
 from notion_filters import Filter, AndFilter, OrFilter
 from notion_filters.base import FilterBase
 
 _LOG = logging.getLogger(__name__)
 LOCAL_TIMEZONE = pytz.timezone(config.T_ZONE)
+API_URL = "https://api.notion.com/v1"
 
 headers = {
     "Authorization": "Bearer " + config.NOTION_TOKEN,
@@ -21,67 +27,216 @@ headers = {
 }
 
 
-def read_database_metadata(database_id):
-    url = f"https://api.notion.com/v1/databases/{database_id}"
+class SchemaCache:
+    """
+    Time-based cache of database metadata shared by all read_database_metadata callers.
+    Hit/miss counters are kept for monitoring.
+    """
 
-    res = requests.get(url, headers=headers)
-    process_response(res)
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, tuple[float, dict]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, database_id: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(database_id)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, database_id: str, metadata: dict):
+        with self._lock:
+            self._entries[database_id] = (time.monotonic(), metadata)
+
+    def invalidate(self, database_id: str = None):
+        """Drop cached metadata of one database or of all databases if no id is given."""
+        with self._lock:
+            if database_id:
+                self._entries.pop(database_id, None)
+            else:
+                self._entries.clear()
+        _LOG.debug(f"Invalidated schema cache for {database_id or 'all databases'}")
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+schema_cache = SchemaCache(config.NOTION_SCHEMA_CACHE_TTL)
+
+
+def read_database_metadata(database_id, use_cache=True):
+    if use_cache and (metadata := schema_cache.get(database_id)):
+        return metadata
+    url = f"{API_URL}/databases/{database_id}"
+
+    res = notion_session().get(url, headers=headers)
+    if process_response(res):
+        schema_cache.put(database_id, res.json())
     return res.json()
 
 
 def read_databases_list(**kwargs):
-    url = "https://api.notion.com/v1/search"
+    url = f"{API_URL}/search"
     params = {"filter": {"object": "database"}}
     params.update(kwargs)
-    res = requests.post(url, headers=headers, json=params)
+    res = notion_session().post(url, headers=headers, json=params)
     process_response(res)
     return res.json()
 
 
 def read_database(database_id, raw_query=None, log_to_file=False, all_batch=True) -> list[dict]:
+    data, _ = _read_database(database_id, raw_query, all_batch)
+    if log_to_file:
+        with open('test/db.json', 'w', encoding='utf8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    return data
+
+
+def iter_database(database_id, raw_query=None, filter_properties: list[str] = None,
+                  all_batch=True) -> Iterator[dict]:
+    """
+    Stream the pages of a database query, yielding each batch of up to 100 pages as soon as Notion returns it.
+    `filter_properties` limits the returned page properties to the given names, to shrink the payloads.
+    Reading stops at the first failed request, like read_database.
+    """
+    for batch in _query_batches(database_id, raw_query, filter_properties, all_batch):
+        yield from batch
+
+
+def _read_database(database_id, raw_query=None, all_batch=True, filter_properties: list[str] = None
+                   ) -> tuple[list[dict], requests.Response | None]:
+    """Pages read so far and the failed response, if reading stopped on an error"""
     data = []
-    query = raw_query.__dict__() if isinstance(raw_query, FilterBase | AndFilter | OrFilter) else raw_query
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
+    batches = _query_batches(database_id, raw_query, filter_properties, all_batch)
+    try:
+        while True:
+            data.extend(next(batches))
+    except StopIteration as stop:
+        failed = stop.value
+    _LOG.debug(f"Received {len(data)} records for {database_id=}")
+    return data, failed
+
+
+def _query_batches(database_id, raw_query=None, filter_properties: list[str] = None, all_batch=True
+                   ) -> Generator[list[dict], None, requests.Response | None]:
+    """Result batches of a database query as Notion pages through them. Returns the failed response, if any."""
+    query = build_query(raw_query)
+    url = f"{API_URL}/databases/{database_id}/query"
+    kwargs = {'params': _projection_params(database_id, filter_properties)} if filter_properties else {}
     has_more = True
     while has_more:
         if not query:
-            res = requests.post(url, headers=headers)
+            res = notion_session().post(url, headers=headers, **kwargs)
         else:
-            res = requests.post(url, headers=headers, data=json.dumps(query))
+            res = notion_session().post(url, headers=headers, data=json.dumps(query), **kwargs)
         if not process_response(res):
-            return data
-        data.extend(res.json()['results'])
-        has_more = all_batch and res.json()['has_more']
+            return res
+        body = res.json()
+        yield body['results']
+        has_more = all_batch and body['has_more']
         if has_more:
             if not query:
                 query = {}
-            query.update({'start_cursor': res.json()['next_cursor']})
+            query.update({'start_cursor': body['next_cursor']})
+    return None
 
-    _LOG.debug(f"Received {len(data)} records for {database_id=}")
-    if log_to_file:
-        with open('test/db.json', 'w', encoding='utf8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
 
-    return data
+def _projection_params(database_id: str, names: list[str]) -> dict:
+    """Query string of `filter_properties`, which Notion expects as property ids"""
+    properties = read_database_metadata(database_id).get('properties', {})
+    return {'filter_properties': [properties[name]['id'] if name in properties else name for name in names]}
+
+
+# database id -> largest OR batch Notion accepted after rejecting a bigger one
+_filter_batch_limits: dict[str, int] = {}
+_filter_batch_lock = threading.Lock()
+
+
+def read_database_by_filters(database_id: str, filters: list, batch_size: int = None,
+                             filter_properties: list[str] = None) -> list[dict]:
+    """
+    Read pages matching any of `filters`, e.g. one filter per task id.
+    Filters are OR-ed in batches of up to NOTION_FILTER_BATCH_SIZE conditions, batches are queried concurrently
+    and pages matched by several batches are returned once.
+    A batch Notion rejects as invalid (too large or too complex) is split in halves and retried,
+    and the smaller size is kept for later batches of the database.
+    """
+    return list(iter_database_by_filters(database_id, filters, batch_size, filter_properties))
+
+
+def iter_database_by_filters(database_id: str, filters: list, batch_size: int = None,
+                             filter_properties: list[str] = None) -> Iterator[dict]:
+    """Streaming read_database_by_filters, yielding the pages of every batch as soon as it completes"""
+    if not filters:
+        return
+    batch_size = min(batch_size or config.NOTION_FILTER_BATCH_SIZE,
+                     _filter_batch_limits.get(database_id, config.NOTION_FILTER_BATCH_SIZE))
+    batches = list(chunks(filters, batch_size))
+    seen = set()
+    with ThreadPoolExecutor(max_workers=config.NOTION_QUERY_CONCURRENCY) as pool:
+        futures = [pool.submit(_read_filter_batch, database_id, batch, filter_properties) for batch in batches]
+        for future in as_completed(futures):
+            for page in future.result():
+                if page['id'] not in seen:
+                    seen.add(page['id'])
+                    yield page
+    _LOG.debug(f"Read {len(seen)} pages in {len(batches)} batches of {batch_size} filters for {database_id=}")
+
+
+def _read_filter_batch(database_id: str, filters: list, filter_properties: list[str] = None) -> list[dict]:
+    data, failed = _read_database(database_id, Filter.Or(*filters) if len(filters) > 1 else filters[0],
+                                  filter_properties=filter_properties)
+    if failed is None or len(filters) == 1 or not _is_filter_rejected(failed):
+        return data
+    half = len(filters) // 2
+    with _filter_batch_lock:
+        _filter_batch_limits[database_id] = min(_filter_batch_limits.get(database_id, half), half)
+    _LOG.warning(f"Notion rejected a filter of {len(filters)} conditions, retrying in batches of {half}")
+    return (_read_filter_batch(database_id, filters[:half], filter_properties)
+            + _read_filter_batch(database_id, filters[half:], filter_properties))
+
+
+def _is_filter_rejected(res: requests.Response) -> bool:
+    try:
+        return res.status_code == 400 and res.json().get('code') == 'validation_error'
+    except ValueError:
+        return False
+
 
+def build_query(raw_query) -> dict | None:
+    """Turn a filter object into a database query body; raw dict queries are passed as is"""
+    return raw_query.__dict__() if isinstance(raw_query, FilterBase | AndFilter | OrFilter) else raw_query
 
-def get_synced_notion_tasks(database_id: str, todoist_id_prop: str) -> list[dict]:
-    """Fetch tasks already linked in Notion"""
+
+def get_synced_notion_tasks(database_id: str, todoist_id_prop: str, edited_since: str = None,
+                            properties: list[str] = None) -> list[dict] | None:
+    """
+    Fetch tasks already linked in Notion, optionally only those edited on or after `edited_since` (ISO 8601)
+    and with only the given `properties`.
+    Returns None if any page of the query failed, so a partial read is never taken for the whole set.
+    """
     query = Filter.RichText(todoist_id_prop).is_not_empty()
-    return read_database(database_id, query)
+    if edited_since:
+        query = Filter.And(query, Filter.Timestamp('last_edited_time').last_edited_time(
+            Filter.Date('last_edited_time').on_or_after(edited_since)))
+    data, failed = _read_database(database_id, query, filter_properties=properties)
+    return data if failed is None else None
 
 
 def get_notion_tasks_before_time(db_id: str, todoist_id_text_prop: str, last_synced_date_prop: str,
                                  updated_tasks: list[TodoistTask], updated_events: dict[str, str]) -> list[dict]:
-    entries_to_update = []
-    for upd_tasks_chunk in chunks(updated_tasks, 100):
-        by_task_id_and_after_sync_filter = [Filter.And(
-            Filter.RichText(todoist_id_text_prop).equals(upd_id.task.id),
-            Filter.Date(last_synced_date_prop).on_or_before(updated_events[upd_id.task.id])
-        ) for upd_id in upd_tasks_chunk]
-        query = Filter.Or(*by_task_id_and_after_sync_filter)
-        entries_to_update.extend(read_database(db_id, query))
-    return entries_to_update
+    by_task_id_and_after_sync_filter = [Filter.And(
+        Filter.RichText(todoist_id_text_prop).equals(upd_id.task.id),
+        Filter.Date(last_synced_date_prop).on_or_before(updated_events[upd_id.task.id])
+    ) for upd_id in updated_tasks]
+    return read_database_by_filters(db_id, by_task_id_and_after_sync_filter)
 
 
 def chunks(lst, n):
@@ -98,23 +253,42 @@ def fetch_task_by_todoist_id(database_id: str, todoist_id_prop: str, todoist_id:
 
 
 def create_page(parent_id, *args, **kwargs):
-    url = f"https://api.notion.com/v1/pages/"
+    url = f"{API_URL}/pages/"
 
-    params = {"parent": {"database_id": parent_id}, "properties": kwargs}
-    if args:
-        params.update({"children": args})
-    res = requests.post(url, headers=headers, json=params)
+    params = page_create_body(parent_id, *args, **kwargs)
+    # Not retried after timeouts or 5xx, the page may have been created: the outbox looks it up before recreating it
+    res = notion_session().post(url, headers=headers, json=params, idempotent=False)
+    invalidate_schema_on_missing_property(res, parent_id)
     return process_response(res), res.json()
 
 
 def update_page(page_id, archive=False, **kwargs):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
+    url = f"{API_URL}/pages/{page_id}"
+
+    properties = page_update_body(archive, **kwargs)
+    res = notion_session().patch(url, headers=headers, json=properties)
+    invalidate_schema_on_missing_property(res)
+    return process_response(res), res.json()
+
+
+def page_create_body(parent_id, *args, **kwargs) -> dict:
+    params = {"parent": {"database_id": parent_id}, "properties": kwargs}
+    if args:
+        params.update({"children": args})
+    return params
+
 
+def page_update_body(archive=False, **kwargs) -> dict:
     properties = {"properties": kwargs}
     if archive:
         properties['archived'] = True
-    res = requests.patch(url, headers=headers, json=properties)
-    return process_response(res), res.json()
+    return properties
+
+
+def invalidate_schema_on_missing_property(res, database_id=None):
+    """Notion answers 400 "<name> is not a property that exists." when the cached schema got stale"""
+    if res.status_code == 400 and 'is not a property that exists' in res.json().get('message', ''):
+        schema_cache.invalidate(database_id)
 
 
 def process_response(res, log=False):
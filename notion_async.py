@@ -0,0 +1,67 @@
+import json
+import logging
+
+import httpx
+
+import config
+import notion
+from http_sessions import schedulers, http2_available, httpx_limits
+from notion import API_URL
+
+_LOG = logging.getLogger(__name__)
+
+
+class AsyncNotionClient:
+    """
+    Async counterpart of notion.read_database, notion.create_page and notion.update_page.
+    Shares the Notion request scheduler with the sync functions, so both are paced by the same rate limit.
+    Usage example:
+        async with AsyncNotionClient() as client:
+            success, page = await client.create_page(database_id, **properties)
+    """
+
+    def __init__(self):
+        self.scheduler = schedulers['notion']
+        self._client: httpx.AsyncClient | None = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(headers=notion.headers, http2=http2_available(), limits=httpx_limits(),
+                                         timeout=config.HTTP_TIMEOUT)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+        self._client = None
+
+    async def _request(self, method: str, url: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        return await self.scheduler.send_async(lambda: self._client.request(method, url, **kwargs), idempotent)
+
+    async def read_database(self, database_id, raw_query=None, all_batch=True) -> list[dict]:
+        data = []
+        query = notion.build_query(raw_query) or {}
+        url = f"{API_URL}/databases/{database_id}/query"
+        has_more = True
+        while has_more:
+            res = await self._request("POST", url, content=json.dumps(query))
+            if not notion.process_response(res):
+                return data
+            data.extend(res.json()['results'])
+            has_more = all_batch and res.json()['has_more']
+            if has_more:
+                query.update({'start_cursor': res.json()['next_cursor']})
+
+        _LOG.debug(f"Received {len(data)} records for {database_id=}")
+        return data
+
+    async def create_page(self, parent_id, *args, **kwargs) -> tuple[bool, dict]:
+        # Not retried after timeouts or 5xx, see notion.create_page
+        res = await self._request("POST", f"{API_URL}/pages/", idempotent=False,
+                                  json=notion.page_create_body(parent_id, *args, **kwargs))
+        notion.invalidate_schema_on_missing_property(res, parent_id)
+        return notion.process_response(res), res.json()
+
+    async def update_page(self, page_id, archive=False, **kwargs) -> tuple[bool, dict]:
+        res = await self._request("PATCH", f"{API_URL}/pages/{page_id}",
+                                  json=notion.page_update_body(archive, **kwargs))
+        notion.invalidate_schema_on_missing_property(res)
+        return notion.process_response(res), res.json()
@@ -3,9 +3,22 @@ from .base import FilterBase
 
 
 class TimestampFilter(FilterBase):
+    """
+    Filter by page timestamps. Property name is ignored by Notion for this filter type.
+    Usage example: Filter.Timestamp("last_edited_time").last_edited_time(Filter.Date("").on_or_after("2021-01-01"))
+    """
     def _get_property_type(self) -> str:
         return "timestamp"
 
+    def to_dict(self):
+        timestamp_type, condition = next(iter(self.condition.items()))
+        return {
+            "filter": {
+                "timestamp": timestamp_type,
+                timestamp_type: condition
+            }
+        }
+
     def created_time(self, filter_condition: DateFilter):
         self.condition = {"created_time": filter_condition.condition}
         return self
@@ -0,0 +1,161 @@
+"""
+Adaptive polling of the sync phases for setups without webhooks.
+Every phase is an independently scheduled job whose interval follows the amount of changes it found:
+bursts of changes shrink it toward `min_interval`, idle polls grow it back toward `max_interval`.
+"""
+import bisect
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+_LOG = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class AdaptiveInterval:
+    """
+    Poll interval driven by the number of changes the last poll found.
+    Idle polls multiply it by `backoff` up to `max_interval`, polls with changes divide it by `backoff`
+    and polls with at least `burst_threshold` changes drop it straight to `min_interval` (burst mode).
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, initial: float = None,
+                 backoff: float = 2.0, burst_threshold: int = 20):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.burst_threshold = burst_threshold
+        self.current = self._clamp(initial if initial is not None else min_interval)
+
+    def update(self, changes: int) -> float:
+        """Adjust the interval to the changes found by the last poll. Returns the new interval."""
+        if changes >= self.burst_threshold:
+            self.current = self.min_interval
+        elif changes:
+            self.current = self._clamp(self.current / self.backoff)
+        else:
+            self.current = self._clamp(self.current * self.backoff)
+        return self.current
+
+    @property
+    def bursting(self) -> bool:
+        return self.current == self.min_interval
+
+    def _clamp(self, interval: float) -> float:
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+class Histogram:
+    """Cumulative histogram (Prometheus style buckets) of observed durations"""
+
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last one counts values above every bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def snapshot(self) -> dict:
+        """Count, sum and max of the observations, plus the cumulative count per bucket upper bound"""
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets + (float('inf'),), self._counts):
+                cumulative += count
+                buckets['+Inf' if bound == float('inf') else f"{bound:g}"] = cumulative
+            return {'count': self.count, 'sum': self.sum, 'max': self.max, 'buckets': buckets}
+
+
+@dataclass
+class PollJob:
+    """
+    One scheduled sync phase. `run` returns the number of changes it synced, which drives the interval.
+    """
+    name: str
+    run: Callable[[], int]
+    interval: AdaptiveInterval
+    durations: Histogram = field(default_factory=Histogram)
+    next_run: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    last_changes: int = 0
+
+    def stats(self) -> dict:
+        return {'interval': self.interval.current, 'runs': self.runs, 'failures': self.failures,
+                'last_changes': self.last_changes, 'duration': self.durations.snapshot()}
+
+
+class PollScheduler:
+    """
+    Runs PollJobs one at a time, each when its own interval is up.
+    Jobs share one thread, so phases never touch the local store or the same Notion pages concurrently.
+    Usage example:
+        poller = PollScheduler()
+        poller.add('deleted', manager.sync_deleted_tasks, min_interval=10, max_interval=600)
+        while True:
+            poller.run_pending()
+            poller.wait()
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.jobs: list[PollJob] = []
+        self._clock = clock
+        self._sleep = sleep
+
+    def add(self, name: str, run: Callable[[], int], min_interval: float, max_interval: float,
+            initial: float = None, backoff: float = 2.0, burst_threshold: int = 20) -> PollJob:
+        """Schedule `run`, first due right away"""
+        job = PollJob(name, run, AdaptiveInterval(min_interval, max_interval, initial, backoff, burst_threshold),
+                      next_run=self._clock())
+        self.jobs.append(job)
+        return job
+
+    def run_pending(self) -> list[PollJob]:
+        """Run every due job, in the order they were added. Returns the jobs that ran."""
+        due = [job for job in self.jobs if job.next_run <= self._clock()]
+        for job in due:
+            self._run(job)
+        return due
+
+    def wait(self) -> float:
+        """Sleep until the next job is due. Returns the time slept."""
+        if not self.jobs:
+            return 0.0
+        delay = max(0.0, min(job.next_run for job in self.jobs) - self._clock())
+        if delay:
+            _LOG.debug(f"Next poll in {delay:.1f} seconds")
+            self._sleep(delay)
+        return delay
+
+    def stats(self) -> dict[str, dict]:
+        """Interval, run counters and duration histogram per job"""
+        return {job.name: job.stats() for job in self.jobs}
+
+    def _run(self, job: PollJob):
+        started = self._clock()
+        try:
+            changes = job.run() or 0
+        except Exception:
+            # A failing phase must not stop the others, retry it like an idle poll
+            _LOG.exception(f"Poll job {job.name} failed")
+            job.failures += 1
+            changes = 0
+        finished = self._clock()
+        job.runs += 1
+        job.last_changes = changes
+        job.durations.observe(finished - started)
+        interval = job.interval.update(changes)
+        job.next_run = finished + interval
+        _LOG.info(f"Poll job {job.name} synced {changes} changes in {finished - started:.2f}s, "
+                  f"next run in {interval:.0f}s")
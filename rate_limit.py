@@ -0,0 +1,303 @@
+import asyncio
+import email.utils
+import itertools
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+import requests
+import urllib3
+
+_LOG = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+RETRY_EXCEPTIONS = (requests.Timeout, requests.ConnectionError, httpx.TimeoutException, httpx.TransportError)
+# Failures to connect, raised before any byte of the request reached the server
+NOT_SENT_EXCEPTIONS = (requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+ResponseT = TypeVar('ResponseT', requests.Response, httpx.Response)
+
+
+@dataclass
+class RequestRecord:
+    """Outcome of one scheduled request, after its last attempt"""
+    service: str
+    method: str
+    url: str
+    status: int | None  # None if the last attempt raised
+    latency: float  # seconds spent in the attempts, without throttling and backoff waits
+    retries: int
+    bytes_sent: int
+    bytes_received: int
+    error: str | None = None  # exception type of a failed last attempt
+
+
+class TokenBucket:
+    """
+    Token bucket (in its GCRA form): `rate` requests per second on average, bursts of up to `capacity`.
+    Callers reserve a slot under the lock and sleep outside of it, so concurrent callers queue in order.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self._interval = 1.0 / rate
+        self._tolerance = self._interval * (max(capacity, 1) - 1)
+        self._clock = clock
+        self._sleep = sleep
+        self._tat = 0.0  # theoretical arrival time of the next request
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Wait for a free slot. Returns the time spent waiting in seconds."""
+        wait = self.reserve()
+        if wait:
+            self._sleep(wait)
+        return wait
+
+    def reserve(self) -> float:
+        """Reserve the next free slot without waiting for it. Returns how long the caller has to wait."""
+        with self._lock:
+            now = self._clock()
+            tat = max(self._tat, now)
+            allowed_at = max(tat - self._tolerance, self._blocked_until)
+            self._tat = max(tat, allowed_at) + self._interval
+            return max(0.0, allowed_at - now)
+
+    def block_for(self, seconds: float):
+        """Hold back every caller for `seconds` (e.g. after the server asked to slow down)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+class RequestScheduler:
+    """
+    Paces requests of one service through a TokenBucket and retries rate-limited (429),
+    failed (5xx) and timed-out requests. 429 responses pause the whole service for Retry-After seconds,
+    other failures are retried after a jittered exponential backoff.
+    Requests sent as not idempotent (e.g. creating a page) are only retried when the server can't have acted on
+    them: after a 429 or a failure to connect. Read timeouts and 5xx are returned or raised to the caller instead.
+    Every finished request is reported to the `hooks` as a RequestRecord.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst, clock, sleep)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.hooks: list[Callable[[RequestRecord], None]] = []
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.throttle_time = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    def send(self, send: Callable[[], ResponseT], idempotent: bool = True) -> ResponseT:
+        """Run `send` once a slot is free, retrying it while the service asks for it."""
+        latency = 0.0
+        for attempt in itertools.count():
+            waited = self._enter_queue()
+            try:
+                if waited:
+                    self._sleep(waited)
+            finally:
+                self._leave_queue(waited)
+            started = self._clock()
+            try:
+                res, exc = send(), None
+            except RETRY_EXCEPTIONS as e:
+                res, exc = None, e
+            latency += self._clock() - started
+            delay = self._final_attempt(attempt, res, exc, latency, idempotent)
+            if delay is None:
+                return res
+            if delay:
+                self._sleep(delay)
+
+    async def send_async(self, send: Callable[[], Awaitable[httpx.Response]],
+                         idempotent: bool = True) -> httpx.Response:
+        """Async variant of `send` sharing the same bucket, so sync and async callers are paced together."""
+        latency = 0.0
+        for attempt in itertools.count():
+            waited = self._enter_queue()
+            try:
+                if waited:
+                    await asyncio.sleep(waited)
+            finally:
+                self._leave_queue(waited)
+            started = self._clock()
+            try:
+                res, exc = await send(), None
+            except RETRY_EXCEPTIONS as e:
+                res, exc = None, e
+            latency += self._clock() - started
+            delay = self._final_attempt(attempt, res, exc, latency, idempotent)
+            if delay is None:
+                return res
+            if delay:
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return {'requests': self.requests, 'retries': self.retries, 'rate_limited': self.rate_limited,
+                    'queue_depth': self.queue_depth, 'max_queue_depth': self.max_queue_depth,
+                    'throttle_time': round(self.throttle_time, 3)}
+
+    def _enter_queue(self) -> float:
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return self.bucket.reserve()
+
+    def _leave_queue(self, waited: float):
+        with self._lock:
+            self.queue_depth -= 1
+            self.requests += 1
+            self.throttle_time += waited
+
+    def _final_attempt(self, attempt: int, res: ResponseT | None, exc: Exception | None,
+                       latency: float, idempotent: bool = True) -> float | None:
+        """_retry_delay that reports the request to the hooks once it is done, successfully or not"""
+        try:
+            delay = self._retry_delay(attempt, res, exc, idempotent)
+        except RETRY_EXCEPTIONS:
+            self._notify(_record(self.name, attempt, None, exc, latency))
+            raise
+        if delay is None:
+            self._notify(_record(self.name, attempt, res, None, latency))
+        return delay
+
+    def _notify(self, record: RequestRecord):
+        for hook in self.hooks:
+            try:
+                hook(record)
+            except Exception as e:
+                _LOG.error(f"{self.name}: request hook {hook} failed: {e}")
+
+    def _retry_delay(self, attempt: int, res: ResponseT | None, exc: Exception | None,
+                     idempotent: bool = True) -> float | None:
+        """
+        Decide whether the attempt has to be repeated.
+        :return: None if `res` is final, otherwise seconds to sleep before the next attempt.
+        """
+        if exc:
+            if attempt >= self.max_retries or not (idempotent or _not_sent(exc)):
+                raise exc
+            delay = self._backoff(attempt)
+            _LOG.warning(f"{self.name}: {type(exc).__name__} ({exc}), retrying in {delay:.1f}s")
+        else:
+            if res.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries \
+                    or not (idempotent or res.status_code == 429):
+                return None
+            if res.status_code == 429:
+                retry_after = parse_retry_after(res.headers.get('Retry-After'))
+                # The bucket holds back this and every other caller of the service
+                self.bucket.block_for(retry_after if retry_after is not None else self._backoff(attempt))
+                delay = 0.0
+            else:
+                delay = self._backoff(attempt)
+            _LOG.warning(f"{self.name}: got {res.status_code} for {res.request.method} {res.request.url}, "
+                         f"retry {attempt + 1}/{self.max_retries}")
+        with self._lock:
+            self.retries += 1
+            self.rate_limited += 1 if res is not None and res.status_code == 429 else 0
+            self.throttle_time += delay
+        return delay
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class ScheduledSession(requests.Session):
+    """requests.Session that sends every request through a RequestScheduler"""
+
+    def __init__(self, scheduler: RequestScheduler, timeout: float = None):
+        super().__init__()
+        self.scheduler = scheduler
+        self.timeout = timeout
+
+    def request(self, method, url, *args, idempotent: bool = True, **kwargs):
+        """requests.Session.request, `idempotent=False` limits retries to those that can't repeat its effect"""
+        if self.timeout:
+            kwargs.setdefault('timeout', self.timeout)
+        return self.scheduler.send(lambda: requests.Session.request(self, method, url, *args, **kwargs), idempotent)
+
+
+class ScheduledClient(httpx.Client):
+    """httpx.Client that sends every request through a RequestScheduler"""
+
+    def __init__(self, scheduler: RequestScheduler, **kwargs):
+        super().__init__(**kwargs)
+        self.scheduler = scheduler
+
+    def send(self, request, **kwargs):
+        return self.scheduler.send(lambda: httpx.Client.send(self, request, **kwargs))
+
+
+def _not_sent(exc: Exception) -> bool:
+    """Whether the request failed before reaching the server, so repeating it can't duplicate its effect"""
+    if isinstance(exc, NOT_SENT_EXCEPTIONS):
+        return True
+    # requests reports refused connections and failed DNS lookups as a ConnectionError wrapping urllib3's error
+    reason = getattr(exc.args[0], 'reason', None) if isinstance(exc, requests.ConnectionError) and exc.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def _record(service: str, attempt: int, res: ResponseT | None, exc: Exception | None,
+            latency: float) -> RequestRecord:
+    request = res.request if res is not None else _exception_request(exc)
+    return RequestRecord(service, request.method if request else '', str(request.url) if request else '',
+                         res.status_code if res is not None else None, latency, attempt,
+                         _content_length(request), _response_size(res) if res is not None else 0,
+                         type(exc).__name__ if exc else None)
+
+
+def _exception_request(exc: Exception) -> requests.PreparedRequest | httpx.Request | None:
+    try:
+        return getattr(exc, 'request', None)
+    except RuntimeError:  # httpx raises when the exception has no request
+        return None
+
+
+def _content_length(message) -> int:
+    try:
+        return int(message.headers.get('Content-Length') or 0) if message is not None else 0
+    except ValueError:
+        return 0
+
+
+def _response_size(res: ResponseT) -> int:
+    """Body size on the wire if known, otherwise of the (decoded) content"""
+    if size := _content_length(res):
+        return size
+    try:
+        return len(res.content or b'')
+    except (httpx.ResponseNotRead, RuntimeError):  # streamed responses that were not read
+        return 0
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-After is either a number of seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (email.utils.parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,97 @@
+"""
+Keep-alive transport tests and a small latency benchmark against a local stub server.
+"""
+
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_sessions
+from rate_limit import RequestScheduler
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections open between requests
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.connections.add(self.client_address)
+        body = json.dumps({"results": [], "has_more": False}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.connections = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_sessions(monkeypatch):
+    # Measure the transport only, not the rate limiter
+    monkeypatch.setitem(http_sessions.schedulers, 'notion', RequestScheduler('notion', rate=1e6, burst=1000))
+    http_sessions.close_all()
+    yield
+    http_sessions.close_all()
+
+
+def _url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/v1/databases/db/query"
+
+
+def _timed_requests(send, n):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        send().raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def test_sessions_are_shared():
+    assert http_sessions.notion_session() is http_sessions.notion_session()
+    assert http_sessions.todoist_session() is http_sessions.todoist_session()
+    assert http_sessions.notion_session() is not http_sessions.todoist_session()
+    assert http_sessions.todoist_sync_client() is http_sessions.todoist_sync_client()
+
+
+def test_pooled_session_reuses_connection(stub_server):
+    for _ in range(20):
+        http_sessions.notion_session().post(_url(stub_server), json={}).raise_for_status()
+
+    assert len(stub_server.connections) == 1
+
+
+@pytest.mark.performance
+def test_pooled_session_latency_benchmark(stub_server):
+    n = 200
+    url = _url(stub_server)
+
+    fresh = _timed_requests(lambda: requests.post(url, json={}), n)
+    fresh_connections = len(stub_server.connections)
+    stub_server.connections.clear()
+    pooled = _timed_requests(lambda: http_sessions.notion_session().post(url, json={}), n)
+
+    assert fresh_connections == n
+    assert len(stub_server.connections) == 1
+    assert statistics.median(pooled) < statistics.median(fresh), \
+        f"per-request latency, fresh connection: {statistics.mean(fresh) * 1000:.3f} ms, " \
+        f"pooled: {statistics.mean(pooled) * 1000:.3f} ms"
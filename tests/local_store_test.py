@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from local_store import LocalStore, OutboxOp, TaskLink
+
+
+class TestLocalStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = LocalStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_get_link_missing(self):
+        self.assertIsNone(self.store.get_link("123"))
+        self.assertFalse(self.store.is_linked("123"))
+
+    def test_upsert_and_get_link(self):
+        self.store.upsert_link(TaskLink("123", "page-1", "https://notion.so/page-1", "2024-01-01T10:00:00+00:00"))
+
+        self.assertEqual(self.store.get_link("123"),
+                         TaskLink("123", "page-1", "https://notion.so/page-1", "2024-01-01T10:00:00+00:00"))
+        self.assertTrue(self.store.is_linked("123"))
+
+    def test_upsert_keeps_synced_when_not_provided(self):
+        self.store.upsert_link(TaskLink("123", "page-1", "url-1", "2024-01-01T10:00:00+00:00"))
+        self.store.upsert_link(TaskLink("123", "page-2", "url-2"))
+
+        self.assertEqual(self.store.get_link("123"), TaskLink("123", "page-2", "url-2", "2024-01-01T10:00:00+00:00"))
+
+    def test_linked_task_ids(self):
+        self.store.upsert_links([TaskLink("1", "p1"), TaskLink("2", "p2")])
+
+        self.assertEqual(self.store.linked_task_ids(), {"1", "2"})
+
+    def test_remove_link(self):
+        self.store.upsert_links([TaskLink("1", "p1"), TaskLink("2", "p2")])
+        self.store.remove_link("1")
+
+        self.assertEqual(self.store.linked_task_ids(), {"2"})
+
+    def test_replace_links(self):
+        self.store.upsert_links([TaskLink("1", "p1"), TaskLink("2", "p2")])
+        self.store.replace_links([TaskLink("3", "p3")])
+
+        self.assertEqual(self.store.linked_task_ids(), {"3"})
+
+    def test_get_links(self):
+        self.store.upsert_links([TaskLink("1", "p1"), TaskLink("2", "p2")])
+
+        self.assertEqual(self.store.get_links(["1", "3"]), {"1": TaskLink("1", "p1")})
+
+    def test_fingerprints_are_kept_while_page_is_the_same(self):
+        self.store.upsert_link(TaskLink("1", "p1"))
+        self.store.set_fingerprints("1", "abc", {"content": "a1"})
+
+        self.store.upsert_link(TaskLink("1", "p1", "url"))
+        self.assertEqual(self.store.get_link("1"), TaskLink("1", "p1", "url", None, "abc", {"content": "a1"}))
+
+        self.store.upsert_link(TaskLink("1", "p2"))
+        self.assertIsNone(self.store.get_link("1").fingerprint)
+
+    def test_replace_links_keeps_fingerprints(self):
+        self.store.upsert_links([TaskLink("1", "p1"), TaskLink("2", "p2")])
+        self.store.set_fingerprints("1", "abc", {"content": "a1"})
+
+        self.store.replace_links([TaskLink("1", "p1"), TaskLink("3", "p3")])
+
+        self.assertEqual(self.store.linked_task_ids(), {"1", "3"})
+        self.assertEqual(self.store.get_link("1").fingerprint, "abc")
+
+    def test_store_of_older_version_is_migrated(self):
+        path = os.path.join(tempfile.mkdtemp(), "state.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE task_links "
+                         "(task_id TEXT PRIMARY KEY, page_id TEXT NOT NULL, url TEXT, synced TEXT)")
+            conn.execute("INSERT INTO task_links VALUES ('1', 'p1', 'url', NULL)")
+        conn.close()
+
+        store = LocalStore(path)
+        store.set_fingerprints("1", "abc", {})
+
+        self.assertEqual(store.get_link("1"), TaskLink("1", "p1", "url", None, "abc", {}))
+        store.close()
+
+    def test_state(self):
+        self.assertEqual(self.store.get_state("key", "default"), "default")
+        self.store.set_state("key", "value")
+        self.assertEqual(self.store.get_state("key"), "value")
+
+    def test_outbox_ops_stay_pending_until_completed(self):
+        first, second = self.store.append_ops([("create", "1", {"a": 1}), ("create", "2", {"a": 2})])
+
+        self.store.complete_ops([first])
+
+        self.assertEqual(self.store.pending_ops(), [OutboxOp(second, "create", "2", {"a": 2})])
+        self.assertEqual(self.store.pending_ops(kinds=["update"]), [])
+
+    def test_outbox_op_of_same_kind_and_key_supersedes_pending_one(self):
+        self.store.append_op("update", "p1", {"v": 1})
+        latest = self.store.append_op("update", "p1", {"v": 2})
+        other = self.store.append_op("archive", "p1", {})
+
+        self.assertEqual([op.id for op in self.store.pending_ops()], [latest, other])
+
+    def test_failed_outbox_op_is_retried_up_to_max_attempts(self):
+        op_id = self.store.append_op("update", "p1", {})
+
+        self.store.fail_op(op_id, "502", max_attempts=2)
+        self.assertEqual(self.store.pending_ops()[0].attempts, 1)
+        self.store.fail_op(op_id, "502", max_attempts=2)
+        self.assertEqual(self.store.pending_ops(), [])
+
+    def test_prune_ops_keeps_pending(self):
+        done, pending = self.store.append_ops([("update", "p1", {}), ("update", "p2", {})])
+        self.store.complete_ops([done])
+
+        self.assertEqual(self.store.prune_ops("2999-01-01T00:00:00+00:00"), 1)
+        self.assertEqual([op.id for op in self.store.pending_ops()], [pending])
+
+    def test_incremental_item_sync_upserts_and_deletes(self):
+        self.store.apply_item_sync([{'id': '1', 'content': "a"}, {'id': '2', 'content': "b"}], True, 'token-1')
+
+        self.store.apply_item_sync([{'id': '1', 'content': "a2"}, {'id': '2', 'is_deleted': True}], False, 'token-2')
+
+        self.assertEqual(self.store.get_items(['1', '2', '3']), {'1': {'id': '1', 'content': "a2"}})
+        self.assertEqual(self.store.get_state('todoist_items.sync_token'), 'token-2')
+
+    def test_full_item_sync_replaces_items(self):
+        self.store.apply_item_sync([{'id': '1'}, {'id': '2'}], True, 'token-1')
+
+        self.store.apply_item_sync([{'id': '3'}], True, 'token-2')
+
+        self.assertEqual(self.store.item_count(), 1)
+        self.assertEqual(list(self.store.get_items(['1', '2', '3'])), ['3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+import unittest
+
+from metrics import SyncMetrics, endpoint
+from rate_limit import RequestRecord
+
+
+def _record(url='https://api.notion.com/v1/pages', method='POST', status=200, latency=0.2, retries=0,
+            service='notion'):
+    return RequestRecord(service, method, url, status, latency, retries, bytes_sent=100, bytes_received=1000,
+                         error=None if status else 'ConnectTimeout')
+
+
+class TestEndpoint(unittest.TestCase):
+
+    def test_ids_are_replaced(self):
+        self.assertEqual(endpoint('https://api.notion.com/v1/pages/4b8a3c1e-6f2d-4e0a-9c7b-2d1f5e8a9b30'),
+                         '/v1/pages/{id}')
+        self.assertEqual(endpoint('https://api.todoist.com/api/v1/tasks/6CrfgrrqJPcqjp8g?x=1'),
+                         '/api/v1/tasks/{id}')
+        self.assertEqual(endpoint('https://api.todoist.com/sync/v9/activity/get'), '/sync/v9/activity/get')
+
+
+class TestSyncMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = SyncMetrics()
+
+    def test_requests_are_aggregated_per_phase(self):
+        with self.metrics.phase('created'):
+            self.metrics.record(_record())
+            self.metrics.record(_record(retries=2))
+            self.metrics.record(_record(url='https://api.todoist.com/sync/v9/sync', service='todoist', status=None))
+        self.metrics.record(_record(url='https://api.notion.com/v1/pages/4b8a3c1e', method='PATCH'))
+
+        summary = self.metrics.summary()
+
+        created = summary['created']
+        self.assertEqual((created['runs'], created['requests'], created['errors'], created['retries']), (1, 3, 1, 2))
+        self.assertEqual(created['statuses'], {'200': 2, 'ConnectTimeout': 1})
+        pages = created['endpoints']['notion POST /v1/pages']
+        self.assertEqual((pages['requests'], pages['bytes_sent'], pages['bytes_received']), (2, 200, 2000))
+        self.assertEqual(pages['request_seconds'], 0.4)
+        self.assertEqual(list(summary['other']['endpoints']), ['notion PATCH /v1/pages/{id}'])
+
+    def test_phase_decorator_restores_outer_phase(self):
+        @self.metrics.phase('updated')
+        def updated():
+            self.metrics.record(_record())
+
+        with self.metrics.phase('cycle'):
+            updated()
+            self.metrics.record(_record())
+
+        summary = self.metrics.summary()
+        self.assertEqual((summary['updated']['requests'], summary['cycle']['requests']), (1, 1))
+        self.assertEqual(self.metrics.current_phase, 'other')
+
+    def test_prometheus_text(self):
+        with self.metrics.phase('deleted'):
+            self.metrics.record(_record(latency=0.07))
+
+        text = self.metrics.prometheus()
+
+        labels = 'phase="deleted",service="notion",method="POST",endpoint="/v1/pages",status="200"'
+        self.assertIn(f'notion_todoist_requests_total{{{labels}}} 1', text)
+        self.assertIn(f'notion_todoist_request_duration_seconds_bucket{{{labels},le="0.05"}} 0', text)
+        self.assertIn(f'notion_todoist_request_duration_seconds_bucket{{{labels},le="0.1"}} 1', text)
+        self.assertIn('# TYPE notion_todoist_phase_duration_seconds histogram', text)
+        self.assertIn('notion_todoist_phase_duration_seconds_count{phase="deleted"} 1', text)
+
+    def test_export_writes_file(self):
+        self.metrics.record(_record())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.json')
+
+            with self.assertLogs('metrics', level='INFO'):
+                self.metrics.export('json', path)
+
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['other']['requests'], 1)
+            self.assertEqual(os.listdir(tmp), ['metrics.json'])
+
+    def test_json_summary_covers_the_cycle_and_prometheus_the_totals(self):
+        with self.metrics.phase('updated'):
+            self.metrics.record(_record())
+        with self.metrics.phase('created'):
+            self.metrics.record(_record(latency=0.5))
+        with self.assertLogs('metrics', level='INFO'):
+            self.metrics.export('json', '')
+        with self.metrics.phase('created'):
+            self.metrics.record(_record(latency=0.25, status=502))
+
+        with self.assertLogs('metrics', level='INFO') as logs:
+            self.metrics.export('json', '')
+
+        summary = json.loads(logs.records[0].getMessage().removeprefix("Sync metrics: "))
+        self.assertEqual(list(summary), ['created'])
+        created = summary['created']
+        self.assertEqual((created['runs'], created['requests'], created['errors']), (1, 1, 1))
+        self.assertEqual((created['request_seconds'], created['statuses']), (0.25, {'502': 1}))
+        self.assertEqual(created['endpoints']['notion POST /v1/pages']['requests'], 1)
+        self.assertEqual(self.metrics.summary()['created']['requests'], 2)
+        self.assertIn('notion_todoist_phase_duration_seconds_count{phase="created"} 2', self.metrics.prometheus())
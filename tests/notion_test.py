@@ -0,0 +1,185 @@
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+import notion
+from notion import SchemaCache
+from notion_filters import Filter
+
+
+def _response(status_code=200, body=None):
+    res = MagicMock(status_code=status_code)
+    res.json.return_value = body if body is not None else {}
+    return res
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def test_miss_then_hit(self):
+        cache = SchemaCache(ttl=60)
+        self.assertIsNone(cache.get("db"))
+        cache.put("db", {"properties": {}})
+
+        self.assertEqual(cache.get("db"), {"properties": {}})
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_expired_entry_is_a_miss(self):
+        cache = SchemaCache(ttl=0)
+        cache.put("db", {"properties": {}})
+
+        self.assertIsNone(cache.get("db"))
+
+    def test_invalidate(self):
+        cache = SchemaCache(ttl=60)
+        cache.put("db1", {})
+        cache.put("db2", {})
+        cache.invalidate("db1")
+        self.assertEqual(cache.stats()['size'], 1)
+        cache.invalidate()
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class TestReadDatabaseMetadata(unittest.TestCase):
+
+    def setUp(self):
+        notion.schema_cache.invalidate()
+
+    @patch('notion.notion_session')
+    def test_metadata_is_read_once(self, mock_session):
+        mock_session.return_value.get.return_value = _response(body={"properties": {"Name": {"type": "title"}}})
+
+        first = notion.read_database_metadata("db")
+        second = notion.read_database_metadata("db")
+
+        self.assertEqual(first, second)
+        mock_session.return_value.get.assert_called_once()
+
+    @patch('notion.notion_session')
+    def test_failed_metadata_read_is_not_cached(self, mock_session):
+        mock_session.return_value.get.return_value = _response(404, {"message": "not found"})
+
+        notion.read_database_metadata("db")
+        notion.read_database_metadata("db")
+
+        self.assertEqual(mock_session.return_value.get.call_count, 2)
+
+    @patch('notion.notion_session')
+    def test_missing_property_invalidates_cache(self, mock_session):
+        notion.schema_cache.put("db", {"properties": {}})
+        mock_session.return_value.post.return_value = _response(400, {"message": "Foo is not a property that exists."})
+
+        success, _ = notion.create_page("db", Foo={})
+
+        self.assertFalse(success)
+        self.assertIsNone(notion.schema_cache.get("db"))
+
+
+class TestIterDatabase(unittest.TestCase):
+
+    def setUp(self):
+        notion.schema_cache.invalidate()
+        notion.schema_cache.put("db", {"properties": {"TodoistTaskId": {"id": "a%3Db", "type": "rich_text"}}})
+        patcher = patch('notion.notion_session')
+        self.mock_session = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pages_are_yielded_batch_by_batch(self):
+        self.mock_session.return_value.post.side_effect = [
+            _response(body={'results': [{'id': '1'}, {'id': '2'}], 'has_more': True, 'next_cursor': 'c1'}),
+            _response(body={'results': [{'id': '3'}], 'has_more': False})]
+
+        pages = notion.iter_database("db")
+
+        self.assertEqual(next(pages), {'id': '1'})
+        self.assertEqual(next(pages), {'id': '2'})
+        self.mock_session.return_value.post.assert_called_once()
+        self.assertEqual(list(pages), [{'id': '3'}])
+        self.assertEqual(json.loads(self.mock_session.return_value.post.call_args.kwargs['data']),
+                         {'start_cursor': 'c1'})
+
+    def test_filter_properties_are_sent_as_property_ids(self):
+        self.mock_session.return_value.post.return_value = _response(body={'results': [], 'has_more': False})
+
+        list(notion.iter_database("db", filter_properties=["TodoistTaskId", "title"]))
+
+        self.assertEqual(self.mock_session.return_value.post.call_args.kwargs['params'],
+                         {'filter_properties': ["a%3Db", "title"]})
+
+    def test_stops_on_failed_request(self):
+        self.mock_session.return_value.post.side_effect = [
+            _response(body={'results': [{'id': '1'}], 'has_more': True, 'next_cursor': 'c1'}),
+            _response(500, {'message': "error"})]
+
+        self.assertEqual(list(notion.iter_database("db")), [{'id': '1'}])
+
+    def test_synced_tasks_are_none_if_a_page_failed(self):
+        self.mock_session.return_value.post.side_effect = [
+            _response(body={'results': [{'id': '1'}], 'has_more': True, 'next_cursor': 'c1'}),
+            _response(502, {'message': "error"})]
+
+        self.assertIsNone(notion.get_synced_notion_tasks("db", "TodoistTaskId"))
+
+
+class TestReadDatabaseByFilters(unittest.TestCase):
+    """Fake database: every id condition matches one page, page 'shared' matches every query"""
+
+    def setUp(self):
+        notion._filter_batch_limits.clear()
+        self.max_conditions = 100
+        self.batch_sizes = []
+        patcher = patch('notion.notion_session')
+        self.mock_session = patcher.start()
+        self.mock_session.return_value.post.side_effect = self._query
+        self.addCleanup(patcher.stop)
+
+    def _query(self, url, headers=None, data=None):
+        query = json.loads(data)['filter']
+        conditions = query.get('or', [query])
+        self.batch_sizes.append(len(conditions))
+        if len(conditions) > self.max_conditions:
+            return _response(400, {"code": "validation_error", "message": "body.filter.or should have ≤ 40 items"})
+        pages = [{'id': x['rich_text']['equals']} for x in conditions] + [{'id': 'shared'}]
+        return _response(body={'results': pages, 'has_more': False})
+
+    @staticmethod
+    def _filters(n):
+        return [Filter.RichText("TodoistTaskId").equals(str(i)) for i in range(n)]
+
+    def test_filters_are_split_into_batches(self):
+        pages = notion.read_database_by_filters("db", self._filters(250))
+
+        self.assertEqual(sorted(self.batch_sizes), [50, 100, 100])
+        self.assertEqual(len(pages), 251)
+        self.assertEqual(len({page['id'] for page in pages}), 251)
+
+    def test_rejected_batches_are_halved(self):
+        self.max_conditions = 40
+
+        with self.assertLogs('notion', level='WARNING'):
+            pages = notion.read_database_by_filters("db", self._filters(100))
+
+        self.assertEqual(len(pages), 101)
+        self.assertEqual(sorted(self.batch_sizes), [25, 25, 25, 25, 50, 50, 100])
+        self.assertEqual(notion._filter_batch_limits["db"], 25)
+
+    def test_reduced_batch_size_is_kept(self):
+        notion._filter_batch_limits["db"] = 25
+
+        notion.read_database_by_filters("db", self._filters(100))
+
+        self.assertEqual(self.batch_sizes, [25, 25, 25, 25])
+
+    def test_other_errors_are_not_retried(self):
+        self.mock_session.return_value.post.side_effect = None
+        self.mock_session.return_value.post.return_value = _response(401, {"code": "unauthorized"})
+
+        self.assertEqual(notion.read_database_by_filters("db", self._filters(10)), [])
+        self.mock_session.return_value.post.assert_called_once()
+
+    def test_no_filters(self):
+        self.assertEqual(notion.read_database_by_filters("db", []), [])
+        self.mock_session.return_value.post.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
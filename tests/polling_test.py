@@ -0,0 +1,98 @@
+import unittest
+
+from polling import AdaptiveInterval, Histogram, PollScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestAdaptiveInterval(unittest.TestCase):
+
+    def test_idle_polls_grow_interval_up_to_max(self):
+        interval = AdaptiveInterval(min_interval=10, max_interval=100, initial=30)
+
+        self.assertEqual([interval.update(0) for _ in range(3)], [60, 100, 100])
+
+    def test_polls_with_changes_shrink_interval_down_to_min(self):
+        interval = AdaptiveInterval(min_interval=10, max_interval=100, initial=60, burst_threshold=20)
+
+        self.assertEqual([interval.update(1) for _ in range(3)], [30, 15, 10])
+
+    def test_burst_drops_to_min_interval(self):
+        interval = AdaptiveInterval(min_interval=10, max_interval=600, initial=600, burst_threshold=20)
+
+        self.assertEqual(interval.update(25), 10)
+        self.assertTrue(interval.bursting)
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_snapshot_counts_cumulative_buckets(self):
+        histogram = Histogram(buckets=(1, 5))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+
+        self.assertEqual(snapshot['buckets'], {'1': 2, '5': 3, '+Inf': 4})
+        self.assertEqual((snapshot['count'], snapshot['sum'], snapshot['max']), (4, 11.5, 7))
+
+
+class TestPollScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.poller = PollScheduler(clock=self.clock, sleep=self.clock.sleep)
+
+    def test_jobs_are_scheduled_independently(self):
+        runs = []
+        self.poller.add('busy', lambda: runs.append('busy') or 5, min_interval=10, max_interval=100, initial=20)
+        self.poller.add('idle', lambda: runs.append('idle') or 0, min_interval=10, max_interval=100, initial=20)
+
+        for _ in range(4):
+            self.poller.run_pending()
+            self.poller.wait()
+
+        # busy: due at 0, 10, 20, 30... idle: due at 0, 40
+        self.assertEqual(runs, ['busy', 'idle', 'busy', 'busy', 'busy'])
+        self.assertEqual(self.clock.sleeps, [10, 10, 10, 10])
+
+    def test_failing_job_backs_off_without_stopping_others(self):
+        def fail():
+            raise RuntimeError("Notion is down")
+
+        failing = self.poller.add('failing', fail, min_interval=10, max_interval=100, initial=10)
+        ok = self.poller.add('ok', lambda: 1, min_interval=10, max_interval=100, initial=10)
+
+        with self.assertLogs('polling', level='ERROR'):
+            ran = self.poller.run_pending()
+
+        self.assertEqual(ran, [failing, ok])
+        self.assertEqual(failing.failures, 1)
+        self.assertEqual(failing.next_run, 20)
+        self.assertEqual(ok.next_run, 10)
+
+    def test_stats_record_durations(self):
+        def slow():
+            self.clock.now += 2
+            return 3
+
+        self.poller.add('slow', slow, min_interval=10, max_interval=100)
+        self.poller.run_pending()
+
+        stats = self.poller.stats()['slow']
+
+        self.assertEqual((stats['runs'], stats['last_changes'], stats['interval']), (1, 3, 10))
+        self.assertEqual(stats['duration']['count'], 1)
+        self.assertEqual(stats['duration']['buckets']['2.5'], 1)
+        self.assertEqual(stats['duration']['buckets']['1'], 0)
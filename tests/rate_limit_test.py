@@ -0,0 +1,171 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from rate_limit import TokenBucket, RequestScheduler, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_is_not_throttled(self):
+        bucket = TokenBucket(rate=3, capacity=3, clock=self.clock, sleep=self.clock.sleep)
+
+        waits = [bucket.acquire() for _ in range(3)]
+
+        self.assertEqual(waits, [0.0, 0.0, 0.0])
+
+    def test_paces_requests_after_burst(self):
+        bucket = TokenBucket(rate=2, capacity=1, clock=self.clock, sleep=self.clock.sleep)
+
+        for _ in range(5):
+            bucket.acquire()
+
+        self.assertAlmostEqual(self.clock.now, 2.0)
+
+    def test_block_for_holds_back_callers(self):
+        bucket = TokenBucket(rate=100, capacity=10, clock=self.clock, sleep=self.clock.sleep)
+        bucket.block_for(5)
+
+        self.assertAlmostEqual(bucket.acquire(), 5.0)
+
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = RequestScheduler('test', rate=100, burst=100, max_retries=3,
+                                          clock=self.clock, sleep=self.clock.sleep)
+
+    def test_success_is_returned_as_is(self):
+        send = MagicMock(return_value=_response(200))
+
+        self.assertEqual(self.scheduler.send(send).status_code, 200)
+        send.assert_called_once()
+
+    def test_retry_after_is_honoured(self):
+        send = MagicMock(side_effect=[_response(429, {'Retry-After': '7'}), _response(200)])
+
+        res = self.scheduler.send(send)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(send.call_count, 2)
+        self.assertGreaterEqual(self.clock.now, 7.0)
+        self.assertEqual(self.scheduler.stats()['rate_limited'], 1)
+        self.assertGreaterEqual(self.scheduler.stats()['throttle_time'], 7.0)
+
+    @patch('rate_limit.random.uniform', side_effect=lambda a, b: b)
+    def test_server_errors_are_retried_with_backoff(self, _):
+        send = MagicMock(side_effect=[_response(502), _response(503), _response(200)])
+
+        res = self.scheduler.send(send)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0])
+        self.assertEqual(self.scheduler.stats()['retries'], 2)
+
+    def test_gives_up_after_max_retries(self):
+        send = MagicMock(return_value=_response(500))
+
+        res = self.scheduler.send(send)
+
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(send.call_count, 4)
+
+    def test_timeouts_are_retried(self):
+        send = MagicMock(side_effect=[requests.Timeout("slow"), _response(200)])
+
+        self.assertEqual(self.scheduler.send(send).status_code, 200)
+
+    def test_timeout_is_raised_after_max_retries(self):
+        send = MagicMock(side_effect=requests.Timeout("slow"))
+
+        with self.assertRaises(requests.Timeout):
+            self.scheduler.send(send)
+
+    def test_not_idempotent_requests_are_not_retried_after_server_errors(self):
+        send = MagicMock(return_value=_response(502))
+
+        self.assertEqual(self.scheduler.send(send, idempotent=False).status_code, 502)
+        send.assert_called_once()
+
+    def test_not_idempotent_requests_are_not_retried_after_read_timeouts(self):
+        send = MagicMock(side_effect=requests.ReadTimeout("slow"))
+
+        with self.assertRaises(requests.ReadTimeout):
+            self.scheduler.send(send, idempotent=False)
+        send.assert_called_once()
+
+    def test_not_idempotent_requests_are_retried_if_not_sent(self):
+        send = MagicMock(side_effect=[_response(429, {'Retry-After': '1'}), requests.ConnectTimeout("down"),
+                                      _response(200)])
+
+        self.assertEqual(self.scheduler.send(send, idempotent=False).status_code, 200)
+        self.assertEqual(send.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        send = MagicMock(return_value=_response(400))
+
+        self.assertEqual(self.scheduler.send(send).status_code, 400)
+        send.assert_called_once()
+
+    def test_hooks_get_one_record_per_request(self):
+        records = []
+        self.scheduler.hooks.append(records.append)
+        res = _response(200, {'Content-Length': '42'})
+        res.request = MagicMock(method='GET', url='https://api.notion.com/v1/pages/1', headers={})
+        send = MagicMock(side_effect=[_response(429, {'Retry-After': '1'}), res])
+
+        self.scheduler.send(send)
+
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual((record.service, record.method, record.status, record.retries, record.bytes_received),
+                         ('test', 'GET', 200, 1, 42))
+
+    def test_hooks_get_failed_requests(self):
+        records = []
+        self.scheduler.hooks.append(records.append)
+        send = MagicMock(side_effect=requests.Timeout("slow"))
+
+        with self.assertRaises(requests.Timeout):
+            self.scheduler.send(send)
+
+        self.assertEqual([(x.status, x.error, x.retries) for x in records], [(None, 'Timeout', 3)])
+
+
+class TestParseRetryAfter(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+
+    def test_http_date_in_the_past(self):
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Startup benchmark: time from launching a fresh interpreter to the first request of a sync phase.
+Every run starts a child process that imports the sync modules, constructs TodoistSyncManager
+(with a fresh local store) and runs sync_deleted_tasks against the API stub (see stub_server.py).
+It reports, in seconds since launch, when imports and construction were done and when the first request finished,
+plus requests sent during construction and the child's peak RSS.
+Usage example:
+    python -m tests.startup_benchmark --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+METRICS = ('imported', 'constructed', 'first_request', 'total')
+
+
+def child(url: str, launched: float):
+    """Runs in the measured process, prints its timings as JSON"""
+    import config
+    import http_sessions
+    from local_store import LocalStore
+    from todoist_sync_manager import TodoistSyncManager
+    imported = time.time()
+
+    # Benchmark helpers are imported after the measured imports
+    import resource
+    import tempfile
+    from tests.stub_server import redirect
+    from tests.sync_benchmark import _database_id
+
+    first_request = []
+    for scheduler in http_sessions.schedulers.values():
+        scheduler.hooks.append(lambda record: first_request or first_request.append(time.time()))
+    config.MASTER_TASKS_DB_ID, config.MASTER_TAG_DB = _database_id('tasks'), _database_id('tags')
+    with redirect(url), tempfile.TemporaryDirectory() as tmp:
+        manager = TodoistSyncManager(LocalStore(os.path.join(tmp, 'startup.db')))
+        constructed = time.time()
+        construction_requests = len(first_request)
+        manager.sync_deleted_tasks()
+        done = time.time()
+        manager.store.close()
+    print(json.dumps({'imported': imported - launched, 'constructed': constructed - launched,
+                      'first_request': first_request[0] - launched if first_request else None,
+                      'total': done - launched, 'construction_requests': construction_requests,
+                      'max_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run(url: str) -> dict:
+    env = {**os.environ, 'NOTION_TOKEN': os.getenv('NOTION_TOKEN', 'stub'),
+           'TODOIST_TOKEN': os.getenv('TODOIST_TOKEN', 'stub'), 'TQDM_DISABLE': '1'}
+    launched = time.time()
+    out = subprocess.run([sys.executable, '-m', 'tests.startup_benchmark', '--child', url, '--launched', str(launched)],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark time to the first request of a fresh process")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--tasks', type=int, default=1000, help="synthetic Todoist tasks to seed")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--launched', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args.child, args.launched)
+        return
+
+    from tests.stub_server import StubServer
+
+    with StubServer() as stub:
+        stub.seed(args.tasks)
+        results = [run(stub.url) for _ in range(args.runs)]
+    print(f"{'seconds since launch':<22} {'median':>8} {'min':>8} {'max':>8}")
+    for metric in METRICS:
+        values = [x[metric] for x in results if x[metric] is not None]
+        print(f"{metric:<22} {statistics.median(values):>8.3f} {min(values):>8.3f} {max(values):>8.3f}")
+    print(f"requests during construction: {max(x['construction_requests'] for x in results)}")
+    print(f"peak RSS: {statistics.median(x['max_rss_mib'] for x in results):.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
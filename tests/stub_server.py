@@ -0,0 +1,682 @@
+"""
+Stub of the Notion and Todoist HTTP APIs the sync talks to, for offline end-to-end runs of the sync phases.
+Serves the endpoints used by notion.py and todoist_utils.py from an in-memory workspace
+(Notion databases recorded in fixtures/notion_databases.json, synthetic Todoist tasks),
+with optional latency and per-service rate limits answered like the real services (429 + Retry-After),
+and counts requests per endpoint. Admin endpoints under /_stub seed and change the workspace.
+Usage example:
+    with StubServer(latency=0.005) as stub:
+        stub.seed(tasks=1000)
+        with redirect(stub.url):  # point the Notion and Todoist clients of this process at the stub
+            ...
+        print(stub.stats())
+"""
+import json
+import multiprocessing
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, UTC
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+NOTION_ORIGIN = 'https://api.notion.com'
+TODOIST_ORIGIN = 'https://api.todoist.com'
+SYNC_PATH = '/sync/v9'
+EVENT_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+PAGE_SIZE = 100
+TODOIST_PAGE_SIZE = 200
+# Todoist projects and labels of the synthetic tasks, partly mapped in mappings.json
+PROJECTS = ['6CrfgrrqJPcqjp8g', '6CrfgrrqCcqQVGFp', '6CrfgrrqHhPRfqGp', '6Unmapped0000001']
+LABELS = ['_-5mins', '_-25mins', '_-1hr', 'maintenance', 'creativity', 'ML_prjt', 'errands']
+
+
+class _RateLimit:
+    """Requests per second with bursts, tells how long a rejected caller has to wait"""
+
+    def __init__(self, rate: float, burst: int):
+        self._interval = 1.0 / rate
+        self._tolerance = self._interval * (max(burst, 1) - 1)
+        self._tat = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            if tat - self._tolerance > now:
+                return tat - self._tolerance - now
+            self._tat = tat + self._interval
+            return 0.0
+
+
+class StubWorkspace:
+    """In-memory Notion databases and Todoist account"""
+
+    def __init__(self, databases: dict[str, dict] = None):
+        databases = databases or json.loads((FIXTURES / 'notion_databases.json').read_text(encoding='utf-8'))
+        self.databases = {db['id']: db for db in databases.values()}
+        self.tasks_db_id = databases['tasks']['id']
+        self.tags_db_id = databases['tags']['id']
+        self.pages: dict[str, dict] = {}
+        self._page_order: dict[str, list[str]] = defaultdict(list)  # database id -> page ids by creation
+        self._text_index: dict[tuple[str, str], dict[str, set[str]]] = defaultdict(lambda: defaultdict(set))
+        self.tasks: dict[str, dict] = {}
+        self.comments: dict[str, list[dict]] = defaultdict(list)
+        self.events: list[dict] = []  # oldest first
+        self.version = 0
+        self._task_versions: dict[str, int] = {}
+        self.lock = threading.RLock()
+
+    """
+    Admin
+    """
+
+    def seed(self, tasks: int, completed: float = 0.05, with_comments: float = 0.1, subtasks: float = 0.4) -> dict:
+        """Add `tasks` synthetic Todoist tasks, a `subtasks` share of them nested one level deep"""
+        with self.lock:
+            start = len(self.tasks)
+            nested_every = max(1, round(1 / subtasks)) if subtasks else 0
+            for i in range(start, start + tasks):
+                parent = f"t{i - 1:07d}" if nested_every and i % nested_every and i > start else None
+                task = self._new_task(i, parent)
+                if completed and i % round(1 / completed) == 0:
+                    task.update(checked=True, completed_at=_now())
+                self._put_task(task)
+                self._event('item', 'added', task)
+                if task['checked']:
+                    self._event('item', 'completed', task)
+                if with_comments and i % round(1 / with_comments) == 0:
+                    for n in range(2):
+                        self._add_comment(task, f"Comment {n} of task {i}")
+            return {'tasks': len(self.tasks)}
+
+    def update(self, fraction: float) -> dict:
+        """Edit content and priority of every 1/fraction-th active task"""
+        with self.lock:
+            changed = self._every(fraction)
+            for task in changed:
+                task.update(content=f"{task['content']} (edited)", priority=task['priority'] % 4 + 1)
+                self._put_task(task)
+                self._event('item', 'updated', task)
+            return {'updated': len(changed)}
+
+    def delete(self, fraction: float) -> dict:
+        """Delete every 1/fraction-th active task"""
+        with self.lock:
+            deleted = self._every(fraction, offset=1)
+            for task in deleted:
+                task['is_deleted'] = True
+                self._put_task(task)
+                self._event('item', 'deleted', task)
+            return {'deleted': len(deleted)}
+
+    def _every(self, fraction: float, offset: int = 0) -> list[dict]:
+        active = [task for task in self.tasks.values() if not task['is_deleted'] and not task['checked']]
+        step = max(1, round(1 / fraction)) if fraction else 0
+        return active[offset::step] if step else []
+
+    def summary(self) -> dict:
+        with self.lock:
+            pages = [page for page in self.pages.values() if page['parent']['database_id'] == self.tasks_db_id]
+            return {'tasks': len(self.tasks), 'events': len(self.events),
+                    'pages': sum(not page['archived'] for page in pages),
+                    'archived_pages': sum(page['archived'] for page in pages),
+                    'backlinks': sum('[Notion](' in (task['description'] or '') for task in self.tasks.values())}
+
+    """
+    Todoist
+    """
+
+    def _new_task(self, i: int, parent_id: str | None) -> dict:
+        now = _now()
+        return {'id': f"t{i:07d}", 'user_id': '1', 'project_id': PROJECTS[i % len(PROJECTS)], 'section_id': None,
+                'parent_id': parent_id, 'added_by_uid': '1', 'assigned_by_uid': None, 'responsible_uid': None,
+                'labels': [LABELS[i % len(LABELS)]] if i % 3 else [], 'deadline': None, 'duration': None,
+                'checked': False, 'is_deleted': False, 'added_at': now, 'completed_at': None, 'updated_at': now,
+                'due': {'date': (datetime.now(UTC) + timedelta(days=i % 30)).strftime('%Y-%m-%d'),
+                        'string': 'soon', 'lang': 'en', 'is_recurring': False, 'timezone': None} if i % 4 == 0
+                else None,
+                'priority': i % 4 + 1, 'child_order': i, 'content': f"Task {i}",
+                'description': f"Description of task {i}" if i % 2 else "", 'note_count': 0, 'day_order': -1,
+                'is_collapsed': False}
+
+    def _put_task(self, task: dict):
+        self.version += 1
+        task['updated_at'] = _now()
+        self.tasks[task['id']] = task
+        self._task_versions[task['id']] = self.version
+
+    def _add_comment(self, task: dict, content: str):
+        comment = {'id': f"c{len(self.comments) + sum(map(len, self.comments.values())):08d}", 'item_id': task['id'],
+                   'project_id': None, 'content': content, 'posted_uid': '1', 'posted_at': _now(),
+                   'file_attachment': None, 'uids_to_notify': None, 'is_deleted': False, 'reactions': None}
+        self.comments[task['id']].append(comment)
+        task['note_count'] = len(self.comments[task['id']])
+        self._event('note', 'added', comment, parent_item_id=task['id'])
+
+    def _event(self, object_type: str, event_type: str, obj: dict, parent_item_id: str = None):
+        self.events.append({'id': len(self.events) + 1, 'object_type': object_type, 'object_id': obj['id'],
+                            'v2_object_id': obj['id'], 'event_type': event_type,
+                            'event_date': datetime.now(UTC).strftime(EVENT_DATE_FORMAT),
+                            'parent_project_id': obj.get('project_id'), 'v2_parent_project_id': obj.get('project_id'),
+                            'parent_item_id': parent_item_id, 'v2_parent_item_id': parent_item_id,
+                            'initiator_id': None, 'extra_data': {'content': obj.get('content')}})
+
+    def get_tasks(self, ids: list[str] = None) -> list[dict]:
+        with self.lock:
+            tasks = [self.tasks[i] for i in ids if i in self.tasks] if ids is not None else self.tasks.values()
+            return [task for task in tasks if not task['is_deleted'] and not task['checked']]
+
+    def get_completed_tasks(self, since: str, until: str) -> list[dict]:
+        with self.lock:
+            return [task for task in self.tasks.values() if task['checked'] and not task['is_deleted']
+                    and since <= task['completed_at'] <= until]
+
+    def update_task(self, task_id: str, **fields) -> dict | None:
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if not task or task['is_deleted']:
+                return None
+            task.update({key: value for key, value in fields.items() if key in task and key != 'id'})
+            self._put_task(task)
+            self._event('item', 'updated', task)
+            return task
+
+    def get_activity(self, params: dict) -> dict:
+        object_event_types = json.loads(params['object_event_types']) if params.get('object_event_types') else None
+        with self.lock:
+            events = [x for x in reversed(self.events)
+                      if (f"{x['object_type']}:{x['event_type']}" in object_event_types if object_event_types
+                          else (not params.get('object_type') or x['object_type'] == params['object_type'])
+                          and (not params.get('event_type') or x['event_type'] == params['event_type']))]
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 30))
+        return {'events': events[offset:offset + limit], 'count': len(events)}
+
+    def sync(self, form: dict) -> dict:
+        """Sync API: runs `commands` and returns resources changed since `sync_token`"""
+        response = {}
+        if 'commands' in form:
+            statuses = {}
+            for command in json.loads(form['commands']):
+                args = dict(command['args'])
+                if command['type'] == 'item_update' and self.update_task(args.pop('id'), **args):
+                    statuses[command['uuid']] = 'ok'
+                else:
+                    statuses[command['uuid']] = {'error_code': 22, 'error': "Item not found"}
+            response.update(sync_status=statuses, temp_id_mapping={})
+        if 'sync_token' in form:
+            token = form['sync_token']
+            since = 0 if token == '*' else int(token)
+            with self.lock:
+                items = [task for task_id, task in self.tasks.items() if self._task_versions[task_id] > since
+                         and (since or not (task['is_deleted'] or task['checked']))]
+                response.update(sync_token=str(self.version), full_sync=token == '*', items=items)
+        return response
+
+    """
+    Notion
+    """
+
+    def query(self, database_id: str, body: dict, filter_properties: list[str] = None) -> dict:
+        with self.lock:
+            query_filter = body.get('filter')
+            candidates = self._candidates(database_id, query_filter)
+            page_ids = [page_id for page_id in self._page_order[database_id]
+                        if candidates is None or page_id in candidates]
+            matches = [self.pages[page_id] for page_id in page_ids if not self.pages[page_id]['archived']
+                       and (not query_filter or self._matches(self.pages[page_id], query_filter))]
+            size = min(int(body.get('page_size', PAGE_SIZE)), PAGE_SIZE)
+            start = int(body.get('start_cursor') or 0)
+            batch = [_project(page, filter_properties) for page in matches[start:start + size]]
+        has_more = start + size < len(matches)
+        return {'object': 'list', 'results': batch, 'has_more': has_more,
+                'next_cursor': str(start + size) if has_more else None, 'type': 'page_or_database'}
+
+    def create_page(self, body: dict) -> tuple[int, dict]:
+        database_id = body['parent']['database_id']
+        with self.lock:
+            schema = self.databases[database_id]['properties']
+            if error := _unknown_property(schema, body.get('properties', {})):
+                return 400, error
+            page_id = str(uuid.uuid4())
+            now = _now()
+            page = {'object': 'page', 'id': page_id, 'created_time': now, 'last_edited_time': now,
+                    'archived': False, 'in_trash': False, 'parent': {'type': 'database_id', 'database_id': database_id},
+                    'url': f"https://www.notion.so/{page_id.replace('-', '')}",
+                    'properties': {name: _render(prop, None) for name, prop in schema.items()},
+                    'children': len(body.get('children', []))}
+            self.pages[page_id] = page
+            self._page_order[database_id].append(page_id)
+            self._set_properties(page, schema, body.get('properties', {}))
+            return 200, _project(page)
+
+    def update_page(self, page_id: str, body: dict) -> tuple[int, dict]:
+        with self.lock:
+            page = self.pages.get(page_id)
+            if not page:
+                return 404, _error(404, 'object_not_found', f"Could not find page with ID: {page_id}.")
+            if page['archived']:
+                return 400, _error(400, 'validation_error', "Can't edit block that is archived.")
+            schema = self.databases[page['parent']['database_id']]['properties']
+            if error := _unknown_property(schema, body.get('properties', {})):
+                return 400, error
+            self._set_properties(page, schema, body.get('properties', {}))
+            if body.get('archived') or body.get('in_trash'):
+                page['archived'] = page['in_trash'] = True
+            page['last_edited_time'] = _now()
+            return 200, _project(page)
+
+    def _set_properties(self, page: dict, schema: dict, properties: dict):
+        for name, value in properties.items():
+            rendered = _render(schema[name], value)
+            if rendered['type'] in ('title', 'rich_text'):
+                index = self._text_index[(page['parent']['database_id'], name)]
+                index[_plain_text(page['properties'][name])].discard(page['id'])
+                index[_plain_text(rendered)].add(page['id'])
+            page['properties'][name] = rendered
+
+    def _candidates(self, database_id: str, query_filter: dict | None) -> set[str] | None:
+        """Pages a filter can match, narrowed through the text index. None if every page has to be checked."""
+        if not query_filter:
+            return None
+        if 'or' in query_filter:
+            parts = [self._candidates(database_id, x) for x in query_filter['or']]
+            return None if any(x is None for x in parts) else set().union(*parts)
+        if 'and' in query_filter:
+            parts = [x for x in (self._candidates(database_id, x) for x in query_filter['and']) if x is not None]
+            return min(parts, key=len) if parts else None
+        condition = query_filter.get('rich_text') or query_filter.get('title')
+        if condition and 'equals' in condition:
+            return self._text_index[(database_id, query_filter['property'])].get(condition['equals'], set())
+        return None
+
+    def _matches(self, page: dict, query_filter: dict) -> bool:
+        if 'or' in query_filter:
+            return any(self._matches(page, x) for x in query_filter['or'])
+        if 'and' in query_filter:
+            return all(self._matches(page, x) for x in query_filter['and'])
+        if 'timestamp' in query_filter:
+            return _compare(page[query_filter['timestamp']], query_filter[query_filter['timestamp']])
+        prop = page['properties'].get(query_filter['property'])
+        if prop is None:
+            return False
+        condition_type = next(key for key in query_filter if key != 'property')
+        condition = query_filter[condition_type]
+        if condition_type in ('rich_text', 'title'):
+            text = _plain_text(prop)
+            if 'equals' in condition:
+                return text == condition['equals']
+            if 'contains' in condition:
+                return condition['contains'] in text
+            if 'is_not_empty' in condition:
+                return bool(text)
+            if 'is_empty' in condition:
+                return not text
+        if condition_type == 'date':
+            date = prop['date']['start'] if prop['date'] else None
+            if 'is_empty' in condition:
+                return date is None
+            return date is not None and _compare(date, condition)
+        return True
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, rate_limits: dict[str, tuple[float, int]] = None,
+                 workspace: StubWorkspace = None):
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.workspace = workspace or StubWorkspace()
+        self.latency = latency
+        self.limits = {service: _RateLimit(*limit) for service, limit in (rate_limits or {}).items()}
+        self.requests: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        self.counter_lock = threading.Lock()
+
+    def count(self, route: str, limited: bool = False):
+        with self.counter_lock:
+            (self.rate_limited if limited else self.requests)[route] += 1
+
+    def stats(self) -> dict:
+        with self.counter_lock:
+            return {'requests': dict(self.requests), 'rate_limited': dict(self.rate_limited)}
+
+    def reset_stats(self):
+        with self.counter_lock:
+            self.requests.clear()
+            self.rate_limited.clear()
+
+
+# (method, path pattern, route name). Todoist REST paths are matched without their version prefix.
+_ROUTES = [
+    ('GET', re.compile(r'^/v1/databases/([^/]+)$'), 'notion databases.retrieve'),
+    ('POST', re.compile(r'^/v1/databases/([^/]+)/query$'), 'notion databases.query'),
+    ('POST', re.compile(r'^/v1/pages/?$'), 'notion pages.create'),
+    ('PATCH', re.compile(r'^/v1/pages/([^/]+)$'), 'notion pages.update'),
+    ('GET', re.compile(rf'^{SYNC_PATH}/activity/get$'), 'todoist activity.get'),
+    ('POST', re.compile(rf'^{SYNC_PATH}/sync$'), 'todoist sync'),
+    ('GET', re.compile(r'/tasks/completed/by_completion_date$'), 'todoist tasks.completed'),
+    ('GET', re.compile(r'/tasks/([^/]+)$'), 'todoist tasks.get'),
+    ('POST', re.compile(r'/tasks/([^/]+)$'), 'todoist tasks.update'),
+    ('GET', re.compile(r'/tasks$'), 'todoist tasks.list'),
+    ('GET', re.compile(r'/comments$'), 'todoist comments.list'),
+    ('GET', re.compile(r'/labels$'), 'todoist labels.list'),
+    ('GET', re.compile(r'/projects$'), 'todoist projects.list'),
+]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: StubHTTPServer
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def _handle(self, method: str):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if url.path.startswith('/_stub/'):
+            self._reply(200, self._admin(url.path.removeprefix('/_stub/'), json.loads(body or b'{}')))
+            return
+        route = next(((name, match.groups()) for route_method, pattern, name in _ROUTES
+                      if route_method == method and (match := pattern.search(url.path))), None)
+        if not route:
+            self._reply(404, _error(404, 'invalid_request_url', f"No stub for {method} {url.path}"))
+            return
+        name, args = route
+        service = name.split()[0]
+        limit = self.server.limits.get(service)
+        if limit and (wait := limit.retry_after()):
+            self.server.count(name, limited=True)
+            self._reply(429, _error(429, 'rate_limited', "Rate limited"), {'Retry-After': f"{wait:.3f}"})
+            return
+        self.server.count(name)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        params['filter_properties'] = parse_qs(url.query).get('filter_properties')
+        self._reply(*self._dispatch(name, args, params, body))
+
+    def _dispatch(self, name: str, args: tuple, params: dict, body: bytes) -> tuple[int, dict]:
+        workspace = self.server.workspace
+        match name:
+            case 'notion databases.retrieve':
+                database = workspace.databases.get(args[0])
+                return (200, database) if database else (404, _error(404, 'object_not_found', "No database"))
+            case 'notion databases.query':
+                return 200, workspace.query(args[0], json.loads(body or b'{}'), params['filter_properties'])
+            case 'notion pages.create':
+                return workspace.create_page(json.loads(body))
+            case 'notion pages.update':
+                return workspace.update_page(args[0], json.loads(body))
+            case 'todoist activity.get':
+                return 200, workspace.get_activity(params)
+            case 'todoist sync':
+                form = {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+                return 200, workspace.sync(form)
+            case 'todoist tasks.completed':
+                return 200, {'items': workspace.get_completed_tasks(params.get('since', ''), params.get('until', '~')),
+                             'next_cursor': None}
+            case 'todoist tasks.get':
+                task = workspace.tasks.get(args[0])
+                return (200, task) if task and not task['is_deleted'] else (404, {'error': "Task not found"})
+            case 'todoist tasks.update':
+                task = workspace.update_task(args[0], **json.loads(body or b'{}'))
+                return (200, task) if task else (404, {'error': "Task not found"})
+            case 'todoist tasks.list':
+                ids = params['ids'].split(',') if params.get('ids') else None
+                return 200, _paginate(workspace.get_tasks(ids), params)
+            case 'todoist comments.list':
+                return 200, _paginate(workspace.comments.get(params.get('task_id'), []), params)
+            case 'todoist labels.list':
+                return 200, _paginate([{'id': f"l{i}", 'name': name, 'color': 'charcoal', 'order': i,
+                                        'is_favorite': False} for i, name in enumerate(LABELS)], params)
+            case 'todoist projects.list':
+                return 200, _paginate([{'id': project_id, 'name': f"Project {i}"}
+                                       for i, project_id in enumerate(PROJECTS)], params)
+
+    def _admin(self, command: str, args: dict) -> dict:
+        workspace = self.server.workspace
+        match command:
+            case 'seed':
+                return workspace.seed(**args)
+            case 'update':
+                return workspace.update(**args)
+            case 'delete':
+                return workspace.delete(**args)
+            case 'summary':
+                return workspace.summary()
+            case 'stats':
+                return self.server.stats()
+            case 'reset_stats':
+                self.server.reset_stats()
+                return {}
+        return {'error': f"Unknown admin command {command}"}
+
+    def _reply(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """
+    Runs a StubHTTPServer in a child process, so its work and memory don't show up in the measured process.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limits: dict[str, tuple[float, int]] = None):
+        self.latency = latency
+        self.rate_limits = rate_limits
+        self.url: str | None = None
+        self._process: multiprocessing.Process | None = None
+
+    def start(self) -> 'StubServer':
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child_conn, self.latency, self.rate_limits),
+                                                daemon=True)
+        self._process.start()
+        self.url = f"http://127.0.0.1:{parent_conn.recv()}"
+        return self
+
+    def stop(self):
+        if self._process:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def seed(self, tasks: int, **kwargs) -> dict:
+        return self._admin('seed', tasks=tasks, **kwargs)
+
+    def update(self, fraction: float) -> dict:
+        return self._admin('update', fraction=fraction)
+
+    def delete(self, fraction: float) -> dict:
+        return self._admin('delete', fraction=fraction)
+
+    def summary(self) -> dict:
+        return self._admin('summary')
+
+    def stats(self) -> dict:
+        return self._admin('stats')
+
+    def reset_stats(self):
+        self._admin('reset_stats')
+
+    def _admin(self, command: str, **args) -> dict:
+        request = urllib.request.Request(f"{self.url}/_stub/{command}", data=json.dumps(args).encode(), method='POST')
+        with urllib.request.urlopen(request) as res:
+            return json.load(res)
+
+
+def _serve(conn, latency: float, rate_limits: dict[str, tuple[float, int]] | None):
+    server = StubHTTPServer(latency=latency, rate_limits=rate_limits)
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+
+class _RedirectAdapter(HTTPAdapter):
+    """Sends requests for a real API origin to the stub instead"""
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.target = urlsplit(url)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = urlunsplit((self.target.scheme, self.target.netloc, url.path, url.query, url.fragment))
+        return super().send(request, **kwargs)
+
+
+@contextmanager
+def redirect(url: str, client_rate: float = None):
+    """
+    Point the shared Notion and Todoist HTTP clients of this process at the stub, restored on exit.
+    @param client_rate: requests per second let through by the client-side schedulers instead of the configured
+        limits, so only the stub's rate limits apply.
+    """
+    import http_sessions
+    from rate_limit import TokenBucket
+    from synctodoist.managers import command_manager
+
+    adapter = _RedirectAdapter(url)
+    sessions = (http_sessions.notion_session(), http_sessions.todoist_session())
+    for session in sessions:
+        session.mount(NOTION_ORIGIN, adapter)
+        session.mount(TODOIST_ORIGIN, adapter)
+    # Sync API requests are built from this base at call time
+    base_url, command_manager.BASE_URL = command_manager.BASE_URL, f"{url}{SYNC_PATH}"
+    buckets = {name: scheduler.bucket for name, scheduler in http_sessions.schedulers.items()}
+    if client_rate:
+        for scheduler in http_sessions.schedulers.values():
+            scheduler.bucket = TokenBucket(client_rate, max(1, int(client_rate)))
+    try:
+        yield
+    finally:
+        for session in sessions:
+            session.adapters.pop(NOTION_ORIGIN, None)
+            session.adapters.pop(TODOIST_ORIGIN, None)
+        adapter.close()
+        command_manager.BASE_URL = base_url
+        for name, bucket in buckets.items():
+            http_sessions.schedulers[name].bucket = bucket
+
+
+def _now() -> str:
+    return datetime.now(UTC).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _error(status: int, code: str, message: str) -> dict:
+    return {'object': 'error', 'status': status, 'code': code, 'message': message}
+
+
+def _unknown_property(schema: dict, properties: dict) -> dict | None:
+    for name in properties:
+        if name not in schema:
+            return _error(400, 'validation_error', f"{name} is not a property that exists.")
+    return None
+
+
+def _paginate(results: list[dict], params: dict) -> dict:
+    start = int(params.get('cursor') or 0)
+    limit = int(params.get('limit') or TODOIST_PAGE_SIZE)
+    more = start + limit < len(results)
+    return {'results': list(results[start:start + limit]), 'next_cursor': str(start + limit) if more else None}
+
+
+def _rich_text(items: list[dict]) -> list[dict]:
+    rendered = []
+    for item in items:
+        if 'text' in item:
+            link = item['text'].get('link')
+            rendered.append({'type': 'text', 'text': {'content': item['text']['content'], 'link': link},
+                             'plain_text': item['text']['content'], 'href': link['url'] if link else None})
+        else:
+            rendered.append({'type': 'mention', 'mention': item.get('mention'), 'plain_text': 'Untitled',
+                             'href': None})
+    return rendered
+
+
+def _render(prop: dict, value: dict | None) -> dict:
+    """Property value as Notion returns it, from a request value (or empty if None)"""
+    prop_type = prop['type']
+    value = (value or {}).get(prop_type)
+    if prop_type in ('title', 'rich_text'):
+        rendered = _rich_text(value or [])
+    elif prop_type in ('relation', 'multi_select'):
+        rendered = value or []
+    elif prop_type == 'checkbox':
+        rendered = bool(value)
+    else:
+        rendered = value or None
+    result = {'id': prop['id'], 'type': prop_type, prop_type: rendered}
+    if prop_type == 'relation':
+        result['has_more'] = False
+    return result
+
+
+def _plain_text(prop: dict) -> str:
+    return ''.join(x['plain_text'] for x in prop[prop['type']])
+
+
+def _project(page: dict, filter_properties: list[str] = None) -> dict:
+    projected = {key: value for key, value in page.items() if key != 'children'}
+    if filter_properties:
+        projected['properties'] = {name: prop for name, prop in page['properties'].items()
+                                   if prop['id'] in filter_properties or name in filter_properties}
+    return projected
+
+
+def _compare(value: str, condition: dict) -> bool:
+    """Compare ISO dates by their instant, dates without a time as midnight UTC"""
+    def instant(iso: str) -> datetime:
+        parsed = datetime.fromisoformat(iso.replace('Z', '+00:00'))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=UTC)
+
+    operator, other = next(iter(condition.items()))
+    left, right = instant(value), instant(other)
+    return {'equals': left == right, 'before': left < right, 'after': left > right,
+            'on_or_before': left <= right, 'on_or_after': left >= right}.get(operator, True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the Notion/Todoist API stub")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--tasks', type=int, default=100, help="synthetic Todoist tasks to seed")
+    args = parser.parse_args()
+    stub = StubHTTPServer(args.port, args.latency)
+    stub.workspace.seed(args.tasks)
+    print(f"Serving stub on http://127.0.0.1:{stub.server_address[1]} (Ctrl+C to stop)")
+    stub.serve_forever()
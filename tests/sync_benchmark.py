@@ -0,0 +1,141 @@
+"""
+Benchmark of the sync phases against the API stub (see stub_server.py).
+For every scale it seeds a fresh stub with that many Todoist tasks and a fresh local store, then measures
+    created: sync_created_tasks of all seeded tasks,
+    updated: sync_updated_tasks after 10% of the tasks were edited,
+    deleted: sync_deleted_tasks after 5% of the tasks were deleted,
+reporting wall time, requests sent to Notion and Todoist (and how many were rate limited) and peak Python memory.
+Usage example:
+    python -m tests.sync_benchmark --scales 100,1000 --latency 0.02 --notion-rate 3
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from dataclasses import dataclass, asdict
+from unittest.mock import patch
+
+# Read by config and notion at import time
+os.environ.setdefault('NOTION_TOKEN', 'stub')
+os.environ.setdefault('TODOIST_TOKEN', 'stub')
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import config  # noqa: E402
+from local_store import LocalStore  # noqa: E402
+from tests.stub_server import FIXTURES, StubServer, redirect  # noqa: E402
+
+DEFAULT_SCALES = (100, 1000, 10000)
+UPDATE_FRACTION = 0.1
+DELETE_FRACTION = 0.05
+CLIENT_RATE = 10000  # requests per second, so only the stub's rate limits apply
+
+
+@dataclass
+class PhaseResult:
+    scale: int
+    phase: str
+    changes: int
+    wall_time: float  # seconds
+    notion_requests: int
+    todoist_requests: int
+    rate_limited: int
+    peak_memory: float  # MiB
+    requests: dict[str, int]
+
+
+def run_scale(tasks: int, latency: float = 0.0, rate_limits: dict[str, tuple[float, int]] = None
+              ) -> list[PhaseResult]:
+    """Seed a fresh stub with `tasks` tasks and measure every sync phase against it"""
+    from todoist_sync_manager import TodoistSyncManager
+
+    with StubServer(latency, rate_limits) as stub, tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        stub.seed(tasks)
+        stack.enter_context(redirect(stub.url, CLIENT_RATE))
+        stack.enter_context(patch.multiple(config, MASTER_TASKS_DB_ID=_database_id('tasks'),
+                                           MASTER_TAG_DB=_database_id('tags'), NOTION_WRITE_CONCURRENCY=1))
+        store = LocalStore(os.path.join(tmp, 'bench.db'))
+        stack.callback(store.close)
+        manager = TodoistSyncManager(store)
+
+        def measure(phase: str, run) -> PhaseResult:
+            stub.reset_stats()
+            tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                changes = run()
+                wall_time = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            stats = stub.stats()
+            return PhaseResult(tasks, phase, changes, wall_time, _count(stats['requests'], 'notion'),
+                               _count(stats['requests'], 'todoist'), sum(stats['rate_limited'].values()),
+                               peak / 2 ** 20, stats['requests'])
+
+        results = [measure('created', lambda: manager.sync_created_tasks(sync_completed=True))]
+        # Backlinks written to the new tasks are task updates too, sync them before measuring the edits
+        manager.sync_updated_tasks()
+        stub.update(UPDATE_FRACTION)
+        results.append(measure('updated', manager.sync_updated_tasks))
+        stub.delete(DELETE_FRACTION)
+        results.append(measure('deleted', manager.sync_deleted_tasks))
+        return results
+
+
+def _database_id(name: str) -> str:
+    return json.loads((FIXTURES / 'notion_databases.json').read_text(encoding='utf-8'))[name]['id']
+
+
+def _count(requests: dict[str, int], service: str) -> int:
+    return sum(count for route, count in requests.items() if route.startswith(f"{service} "))
+
+
+def format_results(results: list[PhaseResult], details: bool = False) -> str:
+    header = f"{'tasks':>7} {'phase':<8} {'changes':>7} {'wall s':>8} {'notion':>7} {'todoist':>7} " \
+             f"{'429s':>5} {'peak MiB':>9}"
+    lines = [header, '-' * len(header)]
+    for x in results:
+        lines.append(f"{x.scale:>7} {x.phase:<8} {x.changes:>7} {x.wall_time:>8.2f} {x.notion_requests:>7} "
+                     f"{x.todoist_requests:>7} {x.rate_limited:>5} {x.peak_memory:>9.1f}")
+        if details:
+            lines.extend(f"{'':>17}{route:<30} {count:>7}" for route, count in sorted(x.requests.items()))
+    return '\n'.join(lines)
+
+
+def _rate_limit(value: str) -> tuple[float, int]:
+    """RATE[:BURST] requests per second"""
+    rate, _, burst = value.partition(':')
+    return float(rate), int(burst or 1)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the sync phases against the Notion/Todoist API stub")
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                        help="comma-separated numbers of Todoist tasks to seed")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the stub adds to every request")
+    parser.add_argument('--notion-rate', type=_rate_limit, help="stub rate limit of Notion as RATE[:BURST]")
+    parser.add_argument('--todoist-rate', type=_rate_limit, help="stub rate limit of Todoist as RATE[:BURST]")
+    parser.add_argument('--details', action='store_true', help="print requests per endpoint")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    limits = (('notion', args.notion_rate), ('todoist', args.todoist_rate))
+    rate_limits = {service: limit for service, limit in limits if limit}
+    results = []
+    for scale in (int(x) for x in args.scales.split(',')):
+        results.extend(run_scale(scale, args.latency, rate_limits))
+        print(format_results(results[-3:], args.details), flush=True)
+    print()
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([asdict(x) for x in results], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
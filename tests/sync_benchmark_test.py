@@ -0,0 +1,42 @@
+import math
+import unittest
+
+import pytest
+
+from tests.sync_benchmark import DELETE_FRACTION, UPDATE_FRACTION, run_scale
+from todoist_utils import SYNC_COMMANDS_LIMIT
+
+TASKS = 100
+
+
+@pytest.mark.performance
+class TestSyncBenchmark(unittest.TestCase):
+    """Request budgets of the sync phases against the API stub"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results = {x.phase: x for x in run_scale(TASKS)}
+
+    def test_created_phase_writes_one_page_per_task_and_batches_backlinks(self):
+        created = self.results['created']
+
+        self.assertEqual(created.changes, TASKS)
+        self.assertEqual(created.requests['notion pages.create'], TASKS)
+        self.assertEqual(created.requests['todoist tasks.list'], math.ceil(TASKS / 100))
+        # Backlink batches plus the item syncs of the activity log reads
+        self.assertLessEqual(created.requests['todoist sync'], math.ceil(TASKS / SYNC_COMMANDS_LIMIT) + 2)
+        self.assertEqual(created.rate_limited, 0)
+
+    def test_updated_phase_touches_only_edited_tasks(self):
+        updated = self.results['updated']
+
+        self.assertEqual(updated.changes, TASKS * UPDATE_FRACTION)
+        self.assertEqual(updated.requests['notion pages.update'], updated.changes)
+        self.assertNotIn('notion pages.create', updated.requests)
+
+    def test_deleted_phase_archives_only_deleted_tasks(self):
+        deleted = self.results['deleted']
+
+        self.assertEqual(deleted.changes, TASKS * DELETE_FRACTION)
+        self.assertEqual(deleted.requests['notion pages.update'], deleted.changes)
+        self.assertLessEqual(deleted.notion_requests, deleted.changes + 1)
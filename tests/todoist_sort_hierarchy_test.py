@@ -245,6 +245,25 @@ class TestTodoistTaskHierarchy:
         assert len(parent_task.comments) == 1
         assert parent_task.comments[0].content == "Test comment"
 
+    def test_levels(self, complex_hierarchy):
+        """Test grouping tasks into independent hierarchy levels."""
+        levels = sort_tasks_by_hierarchy(complex_hierarchy, levels=True)
+
+        level_ids = [{task.task.id for task in level} for level in levels]
+        assert level_ids == [{"root1", "root2"}, {"child1", "child2", "child3"}, {"grandchild"},
+                             {"great_grandchild"}]
+
+    def test_levels_flatten_to_sorted_order(self, complex_hierarchy):
+        """Test that flattened levels match the flat sort order."""
+        levels = sort_tasks_by_hierarchy(complex_hierarchy, levels=True)
+
+        flat = [task for level in levels for task in level]
+        assert flat == sort_tasks_by_hierarchy(complex_hierarchy)
+
+    def test_levels_empty_list(self):
+        """Test levels of an empty list."""
+        assert sort_tasks_by_hierarchy([], levels=True) == []
+
     @pytest.mark.performance
     def test_performance_large_dataset(self, todoist_task_factory):
         """Test performance with large dataset."""
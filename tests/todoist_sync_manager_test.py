@@ -1,7 +1,14 @@
+import asyncio
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 
-from todoist_sync_manager import TodoistSyncManager
+import pytest
+
+from local_store import LocalStore, TaskLink
+from todoist_sync_manager import TodoistSyncManager, INDEX_REFRESHED_STATE, INDEX_FULL_REFRESHED_STATE, \
+    match_updated_entries, UPDATED_PROPERTIES, OP_CREATE_PAGE, OP_UPDATE_PAGE
+from todoist_utils import fingerprint
 from todoist_utils import TodoistTask
 
 
@@ -9,10 +16,22 @@ class TestTodoistSyncManager(unittest.TestCase):
 
     @patch('todoist_utils.load_todoist_to_notion_mapper', return_value = {})
     def setUp(self, mock_load_mapper):
-        self.manager = TodoistSyncManager()
+        self.manager = TodoistSyncManager(store=LocalStore(':memory:'))
         self.manager.todoist_fetcher = MagicMock()
         self.manager.todoist_fetcher.todoist_api = MagicMock()
 
+    @patch('todoist_utils._shared_api', None)
+    @patch('todoist_utils._send_sync_post')
+    @patch('todoist_utils.TodoistAPI')
+    @patch('todoist_utils.load_todoist_to_notion_mapper', return_value={})
+    def test_construction_creates_no_client_and_sends_no_request(self, _, mock_api, mock_send):
+        manager = TodoistSyncManager(store=LocalStore(':memory:'))
+
+        mock_api.assert_not_called()
+        mock_send.assert_not_called()
+        self.assertIs(manager.todoist_fetcher.todoist_api, manager.todoist_mapper.todoist_api)
+        mock_api.assert_called_once()
+
     def test_update_task_no_notion_url(self):
         task = TodoistTask(MagicMock(content="Test Task", description=""))
         task.notion_url = None
@@ -100,6 +119,289 @@ class TestTodoistSyncManager(unittest.TestCase):
             "123", description="[Notion](https://notion.so/newpage)\n[Notion](not notion link)\nExisting description"
         )
 
+    def test_update_task_queues_backlink(self):
+        task = TodoistTask(MagicMock(id="123", content="Test Task", description=""))
+        task.notion_url = "https://notion.so/page"
+        backlinks = MagicMock()
+
+        self.manager._update_todoist_task_with_notion_link(task, backlinks=backlinks)
+
+        backlinks.queue.assert_called_once_with("123", "[Notion](https://notion.so/page)")
+        self.manager.todoist_fetcher.todoist_api.update_task.assert_not_called()
+
+    @patch('todoist_sync_manager.notion.read_database_metadata', return_value={'properties': {}})
+    @patch('todoist_sync_manager.notion.get_notion_tasks_before_time')
+    def test_unchanged_tasks_are_skipped_by_fingerprint(self, mock_get_entries, _):
+        unchanged = {key: "same" for key in UPDATED_PROPERTIES}
+        changed = {**unchanged, 'priority': "new"}
+        self.manager.store.upsert_links([TaskLink("1", "p1"), TaskLink("2", "p2")])
+        self.manager.store.set_fingerprints("1", fingerprint(unchanged), unchanged)
+        self.manager.store.set_fingerprints("2", fingerprint(unchanged), unchanged)
+        self.manager.todoist_fetcher.get_updated_tasks.return_value = (
+            [MagicMock(id="1"), MagicMock(id="2")],
+            {"1": "2024-01-01T10:30:00+00:00", "2": "2024-01-01T10:30:00+00:00"})
+        self.manager.todoist_mapper = MagicMock()
+        self.manager.todoist_mapper.fingerprint_properties.side_effect = \
+            lambda task, keys, metadata: unchanged if task.task.id == "1" else changed
+        self.manager.todoist_mapper.update_properties.return_value = {'Priority': {'select': {'name': 'p1'}}}
+        mock_get_entries.return_value = [self._notion_page("2", "p2")]
+
+        updates = self.manager._get_notion_updates(sync_created=True, sync_completed=True)
+
+        self.assertEqual([task.task.id for task in mock_get_entries.call_args.args[3]], ["2"])
+        self.manager.todoist_mapper.update_properties.assert_called_once()
+        self.assertEqual(self.manager.todoist_mapper.update_properties.call_args.args[2], ['priority'])
+        self.assertEqual(len(updates), 1)
+
+        entry, props, fingerprints = updates[0]
+        self.manager._on_page_updated(entry, props, True, self._notion_page("2", "p2"), fingerprints)
+        self.assertEqual(self.manager.store.get_link("2").fingerprint, fingerprint(changed))
+
+    def test_sync_cycle_reads_activity_log_once(self):
+        snapshot = self.manager.todoist_fetcher.get_event_snapshot.return_value
+        self.manager.sync_deleted_tasks = MagicMock()
+        self.manager.sync_updated_tasks = MagicMock()
+        self.manager.sync_created_tasks = MagicMock()
+
+        self.manager.sync_cycle()
+
+        self.manager.todoist_fetcher.get_event_snapshot.assert_called_once()
+        self.manager.sync_deleted_tasks.assert_called_once_with(snapshot=snapshot)
+        self.manager.sync_updated_tasks.assert_called_once_with(snapshot=snapshot)
+        self.manager.sync_created_tasks.assert_called_once_with(sync_completed=True, snapshot=snapshot)
+        self.manager.todoist_fetcher.commit_event_watermarks.assert_called_once_with('cycle')
+
+    @staticmethod
+    def _notion_page(task_id, page_id):
+        return {'id': page_id, 'url': f"https://notion.so/{page_id}",
+                'properties': {'TodoistTaskId': {'type': 'rich_text', 'rich_text': [{'plain_text': task_id}]},
+                               'Synced': {'type': 'date', 'date': {'start': '2024-01-01T10:00:00+00:00'}}}}
+
+    def test_sync_events_syncs_only_given_events(self):
+        events = [{'object_type': 'item', 'event_type': 'deleted', 'v2_object_id': '1'}]
+        self.manager.sync_deleted_tasks = MagicMock()
+        self.manager.sync_updated_tasks = MagicMock()
+        self.manager.sync_created_tasks = MagicMock()
+
+        self.manager.sync_events(events)
+
+        snapshot = self.manager.sync_deleted_tasks.call_args.kwargs['snapshot']
+        self.assertEqual(snapshot.of_type('item:deleted'), events)
+        self.manager.sync_updated_tasks.assert_called_once_with(snapshot=snapshot)
+        self.manager.sync_created_tasks.assert_called_once_with(snapshot=snapshot)
+        self.manager.todoist_fetcher.get_event_snapshot.assert_not_called()
+        self.manager.todoist_fetcher.commit_event_watermarks.assert_not_called()
+
+    @patch('todoist_utils._send_sync_commands',
+           side_effect=lambda commands: {'sync_status': {x['uuid']: 'ok' for x in commands}})
+    @patch('todoist_sync_manager.notion.iter_database_by_filters')
+    @patch('todoist_sync_manager.notion.create_page')
+    @patch('todoist_sync_manager.notion.update_page')
+    def test_resume_outbox_replays_pending_writes(self, mock_update_page, mock_create_page, mock_read_by_filters,
+                                                  mock_send_commands):
+        # Page of task 1 was created right before a crash, task 2 never reached Notion
+        mock_read_by_filters.return_value = iter([self._notion_page("1", "p1")])
+        mock_create_page.return_value = (True, self._notion_page("2", "p2"))
+        mock_update_page.return_value = (True, self._notion_page("3", "p3"))
+        self.manager.store.append_ops([
+            (OP_CREATE_PAGE, "1", {'properties': {}, 'children': [], 'description': "", 'overwrite_backlink': False}),
+            (OP_CREATE_PAGE, "2", {'properties': {'Name': {}}, 'children': [], 'description': "Note",
+                                   'overwrite_backlink': False}),
+            (OP_UPDATE_PAGE, "p3", {'page': {'id': "p3", 'url': None, 'properties': {}},
+                                    'properties': {'Priority': {}}, 'fingerprints': None})])
+
+        self.assertEqual(self.manager.resume_outbox(), 3)
+
+        mock_create_page.assert_called_once_with(self.manager.tasks_db_id, Name={})
+        mock_update_page.assert_called_once_with("p3", Priority={})
+        self.assertEqual({x['args']['id']: x['args']['description'] for x in mock_send_commands.call_args.args[0]},
+                         {"1": "[Notion](https://notion.so/p1)", "2": "[Notion](https://notion.so/p2)\nNote"})
+        self.assertEqual(self.manager.store.linked_task_ids(), {"1", "2", "3"})
+        self.assertEqual(self.manager.store.pending_ops(), [])
+
+    @patch('todoist_sync_manager.notion.update_page', return_value=(False, {'status': 502}))
+    def test_failed_write_stays_in_outbox(self, _):
+        self.manager._get_notion_updates = MagicMock(return_value=[
+            (self._notion_page("1", "p1"), {'Priority': {}}, {})])
+
+        with self.assertLogs(level='ERROR'):
+            self.manager.sync_updated_tasks()
+
+        [op] = self.manager.store.pending_ops()
+        self.assertEqual((op.kind, op.key, op.attempts), (OP_UPDATE_PAGE, "p1", 1))
+        self.assertEqual(op.payload['properties'], {'Priority': {}})
+
+    @patch('notion.get_synced_notion_tasks')
+    def test_refresh_task_index_full_on_first_run(self, mock_get_synced):
+        mock_get_synced.return_value = [self._notion_page("1", "p1"), self._notion_page("2", "p2")]
+
+        self.manager.refresh_task_index()
+
+        mock_get_synced.assert_called_once_with(self.manager.tasks_db_id, 'TodoistTaskId', None,
+                                                properties=['TodoistTaskId', 'Synced'])
+        self.assertEqual(self.manager.store.linked_task_ids(), {"1", "2"})
+        self.assertEqual(self.manager.store.get_link("1").url, "https://notion.so/p1")
+
+    @patch('notion.get_synced_notion_tasks')
+    def test_failed_full_index_refresh_keeps_index_and_state(self, mock_get_synced):
+        self.manager.store.upsert_link(TaskLink("1", "p1"))
+        self.manager.store.upsert_link(TaskLink("2", "p2"))
+        mock_get_synced.return_value = None
+
+        with self.assertLogs(level='WARNING'):
+            self.manager.refresh_task_index(full=True)
+
+        self.assertEqual(self.manager.store.linked_task_ids(), {"1", "2"})
+        self.assertIsNone(self.manager.store.get_state(INDEX_FULL_REFRESHED_STATE))
+        self.assertIsNone(self.manager.store.get_state(INDEX_REFRESHED_STATE))
+
+    @patch('notion.get_synced_notion_tasks')
+    def test_refresh_task_index_delta(self, mock_get_synced):
+        self.manager.store.upsert_link(TaskLink("1", "p1"))
+        self.manager.store.set_state(INDEX_REFRESHED_STATE, "2099-01-01T10:00:00+00:00")
+        self.manager.store.set_state(INDEX_FULL_REFRESHED_STATE, "2099-01-01T09:00:00+00:00")
+        mock_get_synced.return_value = [self._notion_page("2", "p2")]
+
+        self.manager.refresh_task_index()
+
+        mock_get_synced.assert_called_once_with(self.manager.tasks_db_id, 'TodoistTaskId',
+                                                "2099-01-01T09:58:00+00:00", properties=['TodoistTaskId', 'Synced'])
+        self.assertEqual(self.manager.store.linked_task_ids(), {"1", "2"})
+
+    @patch('notion.get_synced_notion_tasks')
+    def test_failed_delta_index_refresh_keeps_refreshed_state(self, mock_get_synced):
+        self.manager.store.set_state(INDEX_REFRESHED_STATE, "2099-01-01T10:00:00+00:00")
+        self.manager.store.set_state(INDEX_FULL_REFRESHED_STATE, "2099-01-01T09:00:00+00:00")
+        mock_get_synced.return_value = None
+
+        with self.assertLogs(level='WARNING'):
+            self.manager.refresh_task_index()
+
+        self.assertEqual(self.manager.store.get_state(INDEX_REFRESHED_STATE), "2099-01-01T10:00:00+00:00")
+
+
+class FakeAsyncNotionClient:
+    """Records page creation order; parents are deliberately slower than their children"""
+
+    def __init__(self):
+        self.created = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def create_page(self, parent_id, *args, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.02 if kwargs['id'].startswith('root') else 0.001)
+        self.in_flight -= 1
+        self.created.append(kwargs['id'])
+        return True, {'id': f"page-{kwargs['id']}", 'url': f"https://notion.so/{kwargs['id']}", 'properties': {}}
+
+
+class TestTodoistSyncManagerAsync(unittest.IsolatedAsyncioTestCase):
+
+    @patch('todoist_utils.load_todoist_to_notion_mapper', return_value={})
+    def setUp(self, mock_load_mapper):
+        self.manager = TodoistSyncManager(store=LocalStore(':memory:'))
+        self.manager.todoist_fetcher = MagicMock()
+        self.parent_page_ids = {}
+
+        def map_notion_task(task):
+            self.parent_page_ids[task.task.id] = self.manager.parent_resolver.resolve(task)
+            return {'id': task.task.id}, []
+
+        self.manager._map_notion_task = map_notion_task
+        self.client = FakeAsyncNotionClient()
+
+    @patch('todoist_utils._send_sync_commands',
+           side_effect=lambda commands: {'sync_status': {x['uuid']: 'ok' for x in commands}})
+    @patch('todoist_sync_manager.config.NOTION_WRITE_CONCURRENCY', 4)
+    async def test_sync_created_tasks_async_creates_parents_first(self, mock_send_commands):
+        tasks = [TodoistTask(MagicMock(id=task_id, parent_id=parent_id, description=""))
+                 for task_id, parent_id in [("root1", None), ("root2", None), ("child1", "root1"),
+                                            ("child2", "root2"), ("grandchild", "child1")]]
+        self.manager._get_tasks_to_create = MagicMock(return_value=tasks)
+
+        with patch('todoist_sync_manager.AsyncNotionClient', return_value=self.client):
+            await self.manager.sync_created_tasks_async()
+
+        order = self.client.created
+        self.assertEqual(len(order), 5)
+        self.assertLess(order.index("root1"), order.index("child1"))
+        self.assertLess(order.index("child1"), order.index("grandchild"))
+        self.assertLess(order.index("root2"), order.index("child2"))
+        self.assertGreater(self.client.max_in_flight, 1)
+        self.assertEqual(self.manager.store.linked_task_ids(), {"root1", "root2", "child1", "child2", "grandchild"})
+        self.manager.todoist_fetcher.todoist_api.update_task.assert_not_called()
+        mock_send_commands.assert_called_once()
+        self.assertEqual({x['args']['id'] for x in mock_send_commands.call_args.args[0]},
+                         {"root1", "root2", "child1", "child2", "grandchild"})
+        self.assertEqual(self.parent_page_ids, {"root1": None, "root2": None, "child1": "page-root1",
+                                                "child2": "page-root2", "grandchild": "page-child1"})
+        self.assertEqual(self.manager.store.pending_ops(), [])
+
+
+def _synced_entry(task_id, synced):
+    return {'id': f"page-{task_id}",
+            'properties': {'TodoistTaskId': {'type': 'rich_text', 'rich_text': [{'plain_text': task_id}]},
+                           'Synced': {'type': 'date', 'date': {'start': synced}}}}
+
+
+class TestMatchUpdatedEntries:
+    SYNCED = "2024-01-01T10:00:00+00:00"
+    UPDATED = "2024-01-01T10:30:00+00:00"
+
+    def _dataset(self, n):
+        tasks = {str(i): TodoistTask(MagicMock(id=str(i))) for i in range(n)}
+        events = {task_id: self.UPDATED for task_id in tasks}
+        entries = [_synced_entry(task_id, self.SYNCED) for task_id in reversed(tasks)]
+        return entries, tasks, events
+
+    def test_entries_are_paired_with_their_task(self):
+        entries, tasks, events = self._dataset(3)
+
+        matches = match_updated_entries(entries, tasks, events)
+
+        assert [(entry['id'], task.task.id) for entry, task in matches] == \
+               [("page-2", "2"), ("page-1", "1"), ("page-0", "0")]
+
+    def test_entries_synced_after_the_update_are_skipped(self):
+        entries, tasks, events = self._dataset(2)
+        entries[0] = _synced_entry("1", "2024-01-01T11:00:00+00:00")
+
+        matches = match_updated_entries(entries, tasks, events)
+
+        assert [task.task.id for _, task in matches] == ["0"]
+
+    def test_entries_without_updated_task_are_skipped(self):
+        entries, tasks, events = self._dataset(2)
+        entries.append(_synced_entry("unknown", self.SYNCED))
+
+        assert len(match_updated_entries(entries, tasks, events)) == 2
+
+    @pytest.mark.performance
+    def test_performance_scales_linearly(self):
+        """Matching 10k updated tasks should take about 10x as long as 1k, not 100x"""
+        timings = {}
+        for n in (1000, 10000):
+            entries, tasks, events = self._dataset(n)
+            # Best of several runs, single samples are skewed by GC pauses and other load
+            samples = []
+            for _ in range(5):
+                start_time = time.perf_counter()
+                matches = match_updated_entries(entries, tasks, events)
+                samples.append(time.perf_counter() - start_time)
+                assert len(matches) == n
+            timings[n] = min(samples)
+
+        assert timings[10000] < 1.0, f"Matching 10000 tasks took {timings[10000]:.2f}s"
+        assert timings[10000] < timings[1000] * 30, f"Scaling is not linear: {timings}"
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,15 +1,27 @@
+import json
+import time
 import unittest
+from datetime import datetime, timedelta, UTC
+from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
-from todoist_utils import TodoistToNotionMapper, TodoistTask
+
+import httpx
+import pytest
+from todoist_api_python.models import Task
+
+from local_store import LocalStore, TaskLink
+from tests.stub_server import StubWorkspace
+from todoist_utils import TodoistToNotionMapper, TodoistTask, ParentPageResolver, TodoistFetcher, BacklinkWriter, \
+    SharedEventSnapshot, SNAPSHOT_STREAM, compile_mapping_plan
 
 class TestTodoistToNotionMapper(unittest.TestCase):
 
     @patch('todoist_utils.load_todoist_to_notion_mapper')
-    @patch('todoist_utils.TodoistAPI')
-    def setUp(self, mock_api, mock_load_mapper):
+    def setUp(self, mock_load_mapper):
         mock_load_mapper.return_value = {}  # Return an empty dict for mappings
-        self.mapper = TodoistToNotionMapper()
-        self.mock_api = mock_api
+        self.mock_api = MagicMock()
+        self.mapper = TodoistToNotionMapper(todoist_api=self.mock_api)
 
     def test_extract_parent_notion_uuid_no_parent(self):
         task = TodoistTask(MagicMock(parent_id=None))
@@ -18,66 +30,547 @@ class TestTodoistToNotionMapper(unittest.TestCase):
 
     def test_extract_parent_notion_uuid_no_notion_link(self):
         parent_task = MagicMock(description="No Notion link here")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertIsNone(result)
 
     def test_extract_parent_notion_uuid_full_link(self):
         parent_task = MagicMock(description="[Page](https://www.notion.so/username/Page-bf98f999c90a41e198f999c90a01e1d2)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999c90a41e198f999c90a01e1d2")
 
     def test_extract_parent_notion_uuid_no_username(self):
         parent_task = MagicMock(description="[Page](https://www.notion.so/Page-bf98f999c90a41e198f999c90a01e1d2)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999c90a41e198f999c90a01e1d2")
 
     def test_extract_parent_notion_uuid_no_page_name(self):
         parent_task = MagicMock(description="[Page](https://www.notion.so/bf98f999c90a41e198f999c90a01e1d2)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999c90a41e198f999c90a01e1d2")
 
     def test_extract_parent_notion_uuid_with_query_params(self):
         parent_task = MagicMock(description="[Page](https://www.notion.so/username/Page-bf98f999c90a41e198f999c90a01e1d2?pvs=4)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999c90a41e198f999c90a01e1d2")
 
     def test_extract_parent_notion_uuid_without_notion_host(self):
         parent_task = MagicMock(description="[Page](/username/Page-bf98f999c90a41e198f999c90a01e1d2)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999c90a41e198f999c90a01e1d2")
 
     def test_extract_parent_notion_uuid_with_dashes(self):
         parent_task = MagicMock(description="[Page](https://www.notion.so/username/Page-bf98f999-c90a-41e1-98f9-99c90a01e1d2)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999-c90a-41e1-98f9-99c90a01e1d2")
 
     def test_extract_parent_notion_uuid_only(self):
         parent_task = MagicMock(description="[Page](/bf98f999-c90a-41e1-98f9-99c90a01e1d2)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999-c90a-41e1-98f9-99c90a01e1d2")
 
     def test_extract_parent_notion_uuid_without_page_name(self):
         parent_task = MagicMock(description="[Page](https://www.notion.so/username/bf98f999-c90a-41e1-98f9-99c90a01e1d2)")
-        self.mock_api.return_value.get_task.return_value = parent_task
+        self.mock_api.get_task.return_value = parent_task
         task = TodoistTask(MagicMock(parent_id="parent_id"))
         result = self.mapper.extract_parent_notion_uuid(task)
         self.assertEqual(result, "bf98f999-c90a-41e1-98f9-99c90a01e1d2")
 
+
+class TestParentPageResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.store = LocalStore(':memory:')
+        self.fetcher = MagicMock()
+        self.resolver = ParentPageResolver(self.store, self.fetcher)
+
+    def test_no_parent(self):
+        self.assertIsNone(self.resolver.resolve(TodoistTask(MagicMock(parent_id=None))))
+
+    def test_created_in_current_run(self):
+        self.resolver.prefetch([TodoistTask(MagicMock(id="parent", parent_id=None)),
+                                TodoistTask(MagicMock(id="child", parent_id="parent"))])
+        self.resolver.add_created("parent", "page-parent")
+
+        self.assertEqual(self.resolver.resolve(TodoistTask(MagicMock(parent_id="parent"))), "page-parent")
+        self.fetcher.get_tasks.assert_not_called()
+
+    def test_local_index(self):
+        self.store.upsert_link(TaskLink("parent", "page-parent"))
+        self.resolver.prefetch([TodoistTask(MagicMock(id="child", parent_id="parent"))])
+
+        self.assertEqual(self.resolver.resolve(TodoistTask(MagicMock(parent_id="parent"))), "page-parent")
+        self.fetcher.get_tasks.assert_not_called()
+
+    def test_unresolved_parents_are_fetched_in_one_batch(self):
+        self.fetcher.get_tasks.return_value = [
+            MagicMock(id="p1", description="[Notion](https://www.notion.so/bf98f999c90a41e198f999c90a01e1d2)"),
+            MagicMock(id="p2", description="No Notion link here")]
+        self.resolver.prefetch([TodoistTask(MagicMock(id="c1", parent_id="p1")),
+                                TodoistTask(MagicMock(id="c2", parent_id="p2")),
+                                TodoistTask(MagicMock(id="c3", parent_id="p1"))])
+
+        self.fetcher.get_tasks.assert_called_once()
+        self.assertCountEqual(self.fetcher.get_tasks.call_args.args[0], ["p1", "p2"])
+        self.assertEqual(self.resolver.resolve(TodoistTask(MagicMock(parent_id="p1"))),
+                         "bf98f999c90a41e198f999c90a01e1d2")
+        self.assertIsNone(self.resolver.resolve(TodoistTask(MagicMock(parent_id="p2"))))
+
+
+class TestTodoistFetcherComments(unittest.TestCase):
+
+    def setUp(self):
+        self.fetcher = TodoistFetcher(todoist_api=MagicMock())
+        self.fetcher.get_events = MagicMock(return_value=[])
+        self.get_comments = self.fetcher.todoist_api.get_comments
+        self.get_comments.side_effect = lambda task_id: [[MagicMock(content=f"comment of {task_id}")]]
+
+    def test_tasks_without_comments_are_skipped(self):
+        items = [_sync_item('1', note_count=0), _sync_item('2', note_count=2)]
+        self.fetcher.store = LocalStore(':memory:')
+        self.fetcher.store.apply_item_sync(items, True, 'token')
+        tasks = [TodoistTask(Task.from_dict(item)) for item in items]
+
+        self.fetcher.append_comments(tasks)
+
+        self.get_comments.assert_called_once_with(task_id="2")
+        self.assertEqual(tasks[0].comments, [])
+        self.assertEqual(tasks[1].comments[0].content, "comment of 2")
+
+    def test_unchanged_comments_are_reused(self):
+        self.fetcher.append_comments([TodoistTask(MagicMock(id="1")), TodoistTask(MagicMock(id="2"))])
+        self.get_comments.reset_mock()
+        self.fetcher.get_events.return_value = [
+            {'event_date': '2999-01-01T10:00:00.000000Z', 'v2_parent_item_id': '2'}]
+
+        tasks = [TodoistTask(MagicMock(id="1")), TodoistTask(MagicMock(id="2"))]
+        self.fetcher.append_comments(tasks)
+
+        self.get_comments.assert_called_once_with(task_id="2")
+        self.assertEqual(tasks[0].comments[0].content, "comment of 1")
+
+    def test_changed_comments_of_tasks_outside_the_call_are_dropped(self):
+        self.fetcher.append_comments([TodoistTask(MagicMock(id="1"))])
+        self.get_comments.reset_mock()
+        self.fetcher.get_events.return_value = [
+            {'event_date': '2999-01-01T10:00:00.000000Z', 'v2_parent_item_id': '1'}]
+        self.fetcher.append_comments([TodoistTask(MagicMock(id="2"))])
+        self.fetcher.get_events.return_value = []
+
+        self.fetcher.append_comments([TodoistTask(MagicMock(id="1"))])
+
+        self.assertEqual([c.kwargs for c in self.get_comments.call_args_list], [{'task_id': "2"}, {'task_id': "1"}])
+
+    @patch('config.TODOIST_COMMENT_CACHE_SIZE', 2)
+    def test_least_recently_used_comments_are_evicted(self):
+        self.fetcher.append_comments([TodoistTask(MagicMock(id=task_id)) for task_id in ("1", "2")])
+        self.fetcher.append_comments([TodoistTask(MagicMock(id="1"))])
+        self.fetcher.append_comments([TodoistTask(MagicMock(id="3"))])
+
+        self.assertEqual(list(self.fetcher._comments), ["1", "3"])
+
+    def test_first_call_only_reads_latest_note_events(self):
+        self.fetcher.append_comments([TodoistTask(MagicMock(id="1"))])
+
+        self.assertEqual(self.fetcher.get_events.call_args.kwargs['limit'], 1)
+
+
+class TestTodoistFetcherEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.fetcher = TodoistFetcher(LocalStore(':memory:'), todoist_api=MagicMock())
+        # 250 events, newest first
+        self.all_events = [{'id': i, 'v2_object_id': str(i)} for i in range(250, 0, -1)]
+        self.fetcher._send_sync_get = MagicMock(side_effect=lambda endpoint, **params: {
+            'count': len(self.all_events),
+            'events': self.all_events[params['offset']:params['offset'] + params['limit']]})
+
+    def test_without_stream_reads_everything(self):
+        events = self.fetcher.get_events()
+
+        self.assertEqual(len(events), 250)
+        self.assertEqual(self.fetcher._send_sync_get.call_count, 3)
+
+    def test_first_read_of_stream_reads_everything(self):
+        events = self.fetcher.get_events(stream='created')
+
+        self.assertEqual(len(events), 250)
+
+    def test_stops_at_committed_watermark(self):
+        self.fetcher.get_events(stream='created')
+        self.fetcher.commit_event_watermarks()
+        self.all_events = [{'id': i, 'v2_object_id': str(i)} for i in range(255, 0, -1)]
+        self.fetcher._send_sync_get.reset_mock()
+
+        events = self.fetcher.get_events(stream='created')
+
+        self.assertEqual([x['id'] for x in events], [255, 254, 253, 252, 251])
+        self.fetcher._send_sync_get.assert_called_once()
+
+    def test_uncommitted_events_are_read_again(self):
+        self.fetcher.get_events(stream='created')
+
+        self.assertEqual(len(self.fetcher.get_events(stream='created')), 250)
+
+    def test_streams_are_independent(self):
+        self.fetcher.get_events(stream='created')
+        self.fetcher.commit_event_watermarks('created')
+
+        self.assertEqual(len(self.fetcher.get_events(stream='deleted')), 250)
+
+    def test_event_snapshot_is_read_in_one_pass(self):
+        types = [('item', 'added'), ('item', 'updated'), ('note', 'added')]
+        self.all_events = [{'id': i, 'object_type': types[i % 3][0], 'event_type': types[i % 3][1]}
+                           for i in range(90, 0, -1)]
+
+        snapshot = self.fetcher.get_event_snapshot()
+
+        self.fetcher._send_sync_get.assert_called_once()
+        self.assertEqual(len(snapshot.of_type('item:added')), 30)
+        self.assertEqual(len(snapshot.of_type('item:updated', 'note:added')), 60)
+        self.assertEqual(snapshot.of_type('item:deleted'), [])
+
+    def test_shared_snapshot_is_read_once_per_tick(self):
+        shared = SharedEventSnapshot(self.fetcher, ['deleted', 'updated'])
+
+        self.assertEqual(len(shared.get('deleted').events), 250)
+        calls = self.fetcher._send_sync_get.call_count
+        self.assertEqual(len(shared.get('updated').events), 250)
+        self.assertEqual(self.fetcher._send_sync_get.call_count, calls)
+
+    def test_shared_snapshot_commits_once_every_phase_processed_it(self):
+        shared = SharedEventSnapshot(self.fetcher, ['deleted', 'updated'])
+        shared.get('deleted')
+        shared.processed('deleted')
+        shared.expire()
+        self.assertEqual(self.fetcher._get_watermark(SNAPSHOT_STREAM), 0)
+        self.all_events = [{'id': i, 'v2_object_id': str(i)} for i in range(252, 0, -1)]
+
+        self.assertEqual([x['id'] for x in shared.get('deleted').events], [252, 251])
+        self.assertEqual(len(shared.get('updated').events), 252)
+        shared.processed('updated')
+        self.assertEqual(self.fetcher._get_watermark(SNAPSHOT_STREAM), 250)
+        shared.processed('deleted')
+        self.assertEqual(self.fetcher._get_watermark(SNAPSHOT_STREAM), 252)
+
+
+
+class TestTodoistFetcherCompleted(unittest.TestCase):
+
+    def setUp(self):
+        self.fetcher = TodoistFetcher(LocalStore(':memory:'), todoist_api=MagicMock())
+        self.completed = self.fetcher.todoist_api.get_completed_tasks_by_completion_date
+        self.completed.return_value = [[MagicMock(id='1')]]
+
+    def _since(self) -> datetime:
+        return self.completed.call_args.kwargs['since']
+
+    def test_first_fetch_reads_90_days(self):
+        self.fetcher.get_completed_tasks(stream='created')
+
+        self.assertAlmostEqual((datetime.now(UTC) - self._since()).total_seconds(), 90 * 86400, delta=5)
+
+    @patch('todoist_utils.config.COMPLETED_TASKS_OVERLAP', 300)
+    def test_committed_fetch_reads_from_its_end_with_overlap(self):
+        self.fetcher.get_completed_tasks(stream='created')
+        until = self.completed.call_args.kwargs['until']
+        self.fetcher.commit_event_watermarks('created')
+
+        self.fetcher.get_completed_tasks(stream='created')
+
+        self.assertEqual(self._since(), until - timedelta(seconds=300))
+
+    def test_uncommitted_fetch_is_read_again(self):
+        self.fetcher.get_completed_tasks(stream='created')
+        first_since = self._since()
+
+        self.fetcher.get_completed_tasks(stream='created')
+
+        self.assertAlmostEqual((self._since() - first_since).total_seconds(), 0, delta=5)
+
+    def test_explicit_since_leaves_stream_alone(self):
+        since = datetime.now(UTC) - timedelta(days=1)
+
+        self.fetcher.get_completed_tasks(since=since, stream='created')
+        self.fetcher.commit_event_watermarks('created')
+
+        self.assertEqual(self._since(), since)
+        self.assertIsNone(self.fetcher.store.get_state('completed_tasks.synced_until.created'))
+
+    def test_stale_timestamp_is_clamped_to_90_days(self):
+        self.fetcher.store.set_state('completed_tasks.synced_until.created', '2020-01-01T00:00:00+00:00')
+
+        self.fetcher.get_completed_tasks(stream='created')
+
+        self.assertAlmostEqual((datetime.now(UTC) - self._since()).total_seconds(), 90 * 86400, delta=5)
+
+
+
+class TestTodoistFetcherItems(unittest.TestCase):
+
+    def setUp(self):
+        self.fetcher = TodoistFetcher(LocalStore(':memory:'), todoist_api=MagicMock())
+        self.fetcher.todoist_api.get_tasks.return_value = [[MagicMock(id='9')]]
+        self.responses = [{'sync_token': 't1', 'full_sync': True,
+                           'items': [_sync_item('100', v2_id='1', content="a"),
+                                     _sync_item('200', v2_id='2', v2_parent_id='1', parent_id='100', content="b"),
+                                     _sync_item('300', v2_id='3', content="c", checked=True,
+                                                completed_at='2099-01-01T10:00:00.000000Z')]}]
+        self.send = patch('todoist_utils._send_sync_post',
+                          side_effect=lambda endpoint, **data: self.responses.pop(0)).start()
+        self.addCleanup(patch.stopall)
+
+    def test_first_sync_is_full_then_incremental(self):
+        self.responses.append({'sync_token': 't2', 'full_sync': False,
+                               'items': [{'id': '100', 'v2_id': '1', 'is_deleted': True}]})
+
+        self.assertEqual(self.fetcher.sync_items(), 3)
+        self.assertEqual(self.fetcher.sync_items(), 1)
+
+        self.assertEqual([call.kwargs['sync_token'] for call in self.send.call_args_list], ['*', 't1'])
+        self.assertEqual(list(self.fetcher.store.get_items(['1', '2'])), ['2'])
+
+    def test_items_are_stored_with_v2_ids(self):
+        self.fetcher.sync_items()
+
+        self.assertEqual(self.fetcher.store.get_items(['2'])['2']['parent_id'], '1')
+
+    def test_get_tasks_reads_the_item_store(self):
+        tasks = self.fetcher.get_tasks(['2', '1', '3'])
+
+        self.assertEqual([task.id for task in tasks], ['2', '1'])
+        self.assertEqual((tasks[0].parent_id, tasks[0].content, tasks[0].is_completed), ('1', "b", False))
+        self.fetcher.todoist_api.get_tasks.assert_not_called()
+
+    def test_get_tasks_reads_items_in_the_sync_api_shape(self):
+        # Sync API items have no updated_at and deadline and name is_collapsed collapsed
+        item = _sync_item('400', v2_id='4', collapsed=True)
+        for field in ('updated_at', 'deadline', 'is_collapsed'):
+            del item[field]
+        self.responses[0]['items'].append(item)
+
+        [task] = self.fetcher.get_tasks(['4'])
+
+        self.assertEqual((task.id, task.is_collapsed, task.deadline), ('4', True, None))
+        self.assertEqual(task.updated_at, task.created_at)
+
+    def test_get_tasks_of_unreadable_items_are_fetched(self):
+        self.responses[0]['items'].append(_sync_item('400', v2_id='9', added_at="not a date"))
+
+        with self.assertLogs('todoist_utils', level='WARNING'):
+            tasks = self.fetcher.get_tasks(['1', '9'])
+
+        self.assertEqual([task.id for task in tasks], ['1', '9'])
+        self.fetcher.todoist_api.get_tasks.assert_called_once_with(ids=['9'])
+
+    def test_get_tasks_can_include_completed(self):
+        tasks = self.fetcher.get_tasks(['3'], include_completed=True)
+
+        self.assertEqual([task.id for task in tasks], ['3'])
+
+    def test_get_tasks_unknown_to_the_store_are_fetched(self):
+        tasks = self.fetcher.get_tasks(['1', '9'])
+
+        self.assertEqual([task.id for task in tasks], ['1', '9'])
+        self.fetcher.todoist_api.get_tasks.assert_called_once_with(ids=['9'])
+
+
+def _sync_item(item_id: str, **fields) -> dict:
+    """Complete task item as served by the API stub"""
+    return {**StubWorkspace()._new_task(int(item_id), None), 'id': item_id, **fields}
+
+
+MAPPINGS = {
+    'content': {'none_strategy': 'value-as-is', 'default_values': {'name': 'Name', 'type': 'title'}},
+    'priority': {'none_strategy': 'value-as-is',
+                 'default_values': {'name': 'Priority', 'type': 'select', 'expression': "'p' + str(5-value)"}},
+    'labels': {'none_strategy': 'ignore', 'default_values': {'type': 'relation'},
+               'values': {'_-1hr': {'name': 'POM', 'type': 'select', 'value': '🍅🍅'},
+                          'finances': {'name': 'Projects', 'value': 'bc8cbd959db24dbeacbe597ac5fb1440'}}},
+}
+METADATA = {'Name': {'type': 'title'}, 'Priority': {'type': 'select'}, 'POM': {'type': 'select'},
+            'Projects': {'type': 'relation'}}
+
+
+def _synthetic_task(i):
+    task_dict = {'id': str(i), 'content': f"Task {i}", 'priority': i % 4 + 1,
+                 'labels': ['_-1hr', 'finances', 'other'][:i % 4]}
+    return TodoistTask(SimpleNamespace(to_dict=lambda: task_dict, parent_id=None))
+
+
+class TestMappingPlan(unittest.TestCase):
+
+    @patch('todoist_utils.load_todoist_to_notion_mapper', return_value=MAPPINGS)
+    def setUp(self, mock_load_mapper):
+        self.mapper = TodoistToNotionMapper(todoist_api=MagicMock())
+
+    def test_targets_are_resolved_against_schema(self):
+        plan = compile_mapping_plan(MAPPINGS, METADATA)
+
+        self.assertEqual(plan['priority'].default.type, 'select')
+        self.assertTrue(plan['priority'].default.is_property)
+        self.assertEqual(plan['labels'].target('_-1hr').name, 'POM')
+        self.assertEqual(plan['labels'].target('unknown'), plan['labels'].default)
+        self.assertTrue(plan['labels'].ignore_unmapped)
+        self.assertEqual(eval(plan['priority'].expression, {'value': 4}), 'p1')
+
+    def test_missing_property_is_formatted_by_mapped_type(self):
+        plan = compile_mapping_plan(MAPPINGS, {'Name': {'type': 'title'}})
+
+        self.assertFalse(plan['priority'].default.is_property)
+        self.assertEqual(plan['priority'].default.format('p1'), {'text': {'content': 'p1'}})
+
+    def test_plan_is_compiled_once_per_schema(self):
+        with patch('todoist_utils.compile_mapping_plan', wraps=compile_mapping_plan) as mock_compile:
+            first = self.mapper.get_mapping_plan(METADATA)
+            self.mapper.get_mapping_plan(METADATA)
+            self.mapper.get_mapping_plan(dict(METADATA))  # same schema, refetched
+            self.mapper.get_mapping_plan({**METADATA, 'POM': {'type': 'multi_select'}})
+
+        self.assertEqual(mock_compile.call_count, 2)
+        self.assertIsNot(self.mapper.get_mapping_plan(METADATA), first)
+
+    def test_map_task(self):
+        with patch.object(self.mapper, 'resolve_parent_notion_uuid', return_value=None), \
+                self.assertLogs(level='WARNING'):
+            props, blocks = self.mapper.map_todoist_to_notion_task(_synthetic_task(3), METADATA, 'Parent item')
+
+        self.assertEqual(props, {
+            'Name': {'title': [{'text': {'content': 'Task 3'}}]},
+            'Priority': {'select': {'name': 'p1'}},
+            'POM': {'select': {'name': '🍅🍅'}},
+            'Projects': {'relation': [{'id': 'bc8cbd959db24dbeacbe597ac5fb1440'}]}})
+        self.assertEqual(blocks, [])
+
+    @pytest.mark.performance
+    def test_mapping_benchmark(self):
+        tasks = [_synthetic_task(i) for i in range(10000)]
+        self.mapper.resolve_parent_notion_uuid = lambda task: None
+        self.mapper.get_label_tag_mapping = lambda: {}
+
+        start_time = time.perf_counter()
+        for task in tasks:
+            self.mapper.map_todoist_to_notion_task(task, METADATA, 'Parent item')
+        execution_time = time.perf_counter() - start_time
+
+        assert execution_time < 5.0, \
+            f"Mapping 10000 tasks took {execution_time:.2f}s ({execution_time / len(tasks) * 1e6:.1f} µs per task)"
+
+
+@patch('todoist_utils._send_sync_commands')
+class TestBacklinkWriter(unittest.TestCase):
+
+    @staticmethod
+    def _ok(commands):
+        return {'sync_status': {x['uuid']: 'ok' for x in commands}}
+
+    def test_commands_are_sent_in_batches_of_100(self, mock_send):
+        mock_send.side_effect = self._ok
+        writer = BacklinkWriter()
+
+        for i in range(250):
+            writer.queue(str(i), f"[Notion](https://notion.so/{i})")
+        self.assertEqual(mock_send.call_count, 2)  # full batches are sent while queueing
+        errors = writer.flush()
+
+        self.assertEqual([len(c.args[0]) for c in mock_send.call_args_list], [100, 100, 50])
+        self.assertEqual(mock_send.call_args_list[0].args[0][0],
+                         {'type': 'item_update', 'uuid': mock_send.call_args_list[0].args[0][0]['uuid'],
+                          'args': {'id': '0', 'description': "[Notion](https://notion.so/0)"}})
+        self.assertEqual(errors, {})
+
+    def test_errors_are_reported_per_command(self, mock_send):
+        def reject_second(commands):
+            status = self._ok(commands)
+            status['sync_status'][commands[1]['uuid']] = {'error_code': 22, 'error': "Item not found"}
+            return status
+        mock_send.side_effect = reject_second
+        writer = BacklinkWriter()
+        for task_id in ("1", "2", "3"):
+            writer.queue(task_id, "[Notion](https://notion.so/page)")
+
+        with self.assertLogs(level='ERROR'):
+            errors = writer.flush()
+
+        self.assertEqual(errors, {"2": {'error_code': 22, 'error': "Item not found"}})
+
+    def test_failed_request_marks_whole_batch(self, mock_send):
+        mock_send.side_effect = httpx.ConnectError("unreachable")
+        writer = BacklinkWriter()
+        writer.queue("1", "[Notion](https://notion.so/page)")
+
+        with self.assertLogs(level='ERROR'):
+            errors = writer.flush()
+
+        self.assertEqual(list(errors), ["1"])
+
+    def test_flush_without_commands(self, mock_send):
+        self.assertEqual(BacklinkWriter().flush(), {})
+        mock_send.assert_not_called()
+
+
+class TestTodoistFetcherFullScan(unittest.TestCase):
+    """Full activity-log scans against a recorded /activity/get response"""
+    LATENCY = 0.02  # simulated round trip per page
+
+    def setUp(self):
+        self.fetcher = TodoistFetcher(LocalStore(':memory:'), todoist_api=MagicMock())
+        self.log = json.loads((Path(__file__).parent / 'fixtures' / 'activity_log.json').read_text())
+        self.fetcher._send_sync_get = MagicMock(side_effect=self._activity_get)
+
+    def _activity_get(self, endpoint, **params):
+        time.sleep(self.LATENCY)
+        return {'count': self.log['count'],
+                'events': self.log['events'][params['offset']:params['offset'] + params['limit']]}
+
+    def _timed_scan(self, workers):
+        with patch('config.TODOIST_ACTIVITY_WORKERS', workers):
+            start = time.perf_counter()
+            events = self.fetcher.get_events(stream='created')
+            return events, time.perf_counter() - start
+
+    def test_parallel_scan_keeps_log_order(self):
+        events, _ = self._timed_scan(workers=4)
+
+        self.assertEqual(events, self.log['events'])
+        self.assertEqual(self.fetcher._send_sync_get.call_count, 5)
+
+    def test_repeated_events_of_shifted_pages_are_dropped(self):
+        # A new event arrived after the first page was read, so page 2 starts with the last event of page 1
+        first_page = self.log['events'][:100]
+        self.fetcher._send_sync_get.side_effect = [
+            {'count': 480, 'events': first_page},
+            *({'count': 481, 'events': self.log['events'][offset - 1:offset + 99]} for offset in range(100, 480, 100))]
+
+        events = self.fetcher.get_events()
+
+        self.assertEqual(len(events), 480)
+
+    @pytest.mark.performance
+    def test_parallel_scan_benchmark(self):
+        sequential, sequential_time = self._timed_scan(workers=1)
+        parallel, parallel_time = self._timed_scan(workers=4)
+
+        self.assertEqual(parallel, sequential)
+        self.assertLess(parallel_time, sequential_time,
+                        f"full scan of {len(parallel)} events: sequential {sequential_time * 1000:.0f} ms, "
+                        f"parallel {parallel_time * 1000:.0f} ms")
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
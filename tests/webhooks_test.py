@@ -0,0 +1,92 @@
+"""
+Webhook receiver tests, driven by replaying recorded deliveries against a local receiver.
+"""
+
+import json
+import threading
+import unittest
+import urllib.request
+from pathlib import Path
+
+from webhooks import WebhookReceiver, EventQueue, replay, to_activity_events, verify_signature, sign
+
+DELIVERIES = json.loads((Path(__file__).parent / 'fixtures' / 'webhook_deliveries.json').read_text())
+SECRET = "client-secret"
+
+
+class TestWebhookReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = WebhookReceiver(host="127.0.0.1", port=0, secret=SECRET).start()
+        self.addCleanup(self.receiver.stop)
+
+    def _queued(self):
+        return {(x['object_type'], x['event_type'], x['v2_object_id']) for x in self.receiver.queue.drain()}
+
+    def test_replayed_deliveries_are_queued(self):
+        statuses = replay(self.receiver.url, DELIVERIES, SECRET)
+
+        self.assertEqual(statuses, [200] * len(DELIVERIES))
+        self.assertEqual(self._queued(), {
+            ('item', 'added', '6X7rM8997g3RQmvh'),
+            ('item', 'added', '6X7rfFVPjhvv84XG'),
+            ('item', 'updated', '6X7rM8997g3RQmvh'),  # two updates merged
+            ('note', 'added', '6X7rfP6gW8xRqRqV'),
+            ('item', 'updated', '6X7rfFVPjhvv84XG'),  # task of the new comment
+            ('item', 'completed', '6X7rM8997g3RQmvh'),
+            ('item', 'deleted', '6X4Vw2Hfmg67M8F6'),
+        })
+
+    def test_unsigned_delivery_is_rejected(self):
+        self.assertEqual(replay(self.receiver.url, DELIVERIES[:1]), [401])
+        self.assertEqual(len(self.receiver.queue), 0)
+
+    def test_unsigned_receiver_only_listens_on_loopback(self):
+        with self.assertRaises(ValueError):
+            WebhookReceiver(host="0.0.0.0", port=0, secret="")
+        with WebhookReceiver(host="localhost", port=0, secret="") as receiver:
+            self.assertEqual(replay(receiver.url, DELIVERIES[:1]), [200])
+
+    def test_malformed_delivery_is_rejected(self):
+        body = b'{"event_name": "item:added", "event_data": {}}'
+        request = urllib.request.Request(self.receiver.url, data=body, method='POST',
+                                         headers={'X-Todoist-Hmac-SHA256': sign(body, SECRET)})
+
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(request)
+
+        self.assertEqual(ctx.exception.code, 400)
+
+    def test_wait_returns_once_events_arrive(self):
+        threading.Timer(0.05, replay, (self.receiver.url, DELIVERIES[:1], SECRET)).start()
+
+        self.assertTrue(self.receiver.queue.wait(timeout=5))
+
+
+class TestWebhookEvents(unittest.TestCase):
+
+    def test_note_event_updates_its_task(self):
+        events = to_activity_events(DELIVERIES[4], "delivery-1")
+
+        self.assertEqual([(x['object_type'], x['event_type']) for x in events],
+                         [('note', 'added'), ('item', 'updated')])
+        self.assertEqual(events[0]['v2_parent_item_id'], '6X7rfFVPjhvv84XG')
+        self.assertEqual(events[1]['v2_object_id'], '6X7rfFVPjhvv84XG')
+
+    def test_other_objects_are_ignored(self):
+        self.assertEqual(to_activity_events(DELIVERIES[-1]), [])
+
+    def test_signature(self):
+        body = json.dumps(DELIVERIES[0]).encode()
+
+        self.assertTrue(verify_signature(body, sign(body, SECRET), SECRET))
+        self.assertFalse(verify_signature(body, sign(body, "other"), SECRET))
+        self.assertFalse(verify_signature(body, None, SECRET))
+        self.assertTrue(verify_signature(body, None, None))
+
+    def test_wait_times_out_without_events(self):
+        self.assertFalse(EventQueue().wait(timeout=0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
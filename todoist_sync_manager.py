@@ -1,7 +1,10 @@
+import asyncio
 import logging
 import re
-from collections import defaultdict, deque
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+from typing import Iterable, Iterator
 
 import pytz
 
@@ -12,39 +15,134 @@ from notion import PropertyFormatter as PFormat
 from notion import PropertyParser as PParser
 from notion_filters import Filter
 from models import TodoistTask
+from todoist_utils import EventSnapshot, SNAPSHOT_STREAM
+from local_store import LocalStore, OutboxOp, TaskLink
+from metrics import sync_metrics
+from notion_async import AsyncNotionClient
 
 TODOIST_ID_PROP = 'TodoistTaskId'
 SYNCED_TIME_PROPERTY_NAME = 'Synced'
 PARENT_PROPERTY_NAME = 'Parent item'
+INDEX_REFRESHED_STATE = 'task_index.refreshed'
+INDEX_FULL_REFRESHED_STATE = 'task_index.full_refreshed'
+# Notion rounds last_edited_time to the minute, so delta refreshes look a bit further back
+INDEX_REFRESH_OVERLAP = timedelta(minutes=2)
+# Todoist task properties kept in sync on updates
+UPDATED_PROPERTIES = ['content', 'due.date', 'is_completed', 'priority', 'comments']
+# Notion page properties read for the task index and for archiving, the rest is left out of the responses
+LINK_PROPERTIES = [TODOIST_ID_PROP, SYNCED_TIME_PROPERTY_NAME]
+ARCHIVE_PROPERTIES = ['Name', TODOIST_ID_PROP]
+# Activity-log streams read by sync_updated_tasks when called without a snapshot
+UPDATE_STREAMS = ('updated', 'completed', 'updated.added')
+# Kinds of outbox operations. Page creations are completed once the Todoist backlink is written too.
+OP_CREATE_PAGE = 'notion.create_page'
+OP_UPDATE_PAGE = 'notion.update_page'
+OP_ARCHIVE_PAGE = 'notion.archive_page'
 
 _LOG = logging.getLogger(__name__)
 LOCAL_TIMEZONE = pytz.timezone(config.T_ZONE)
 
 
 class TodoistSyncManager:
-    def __init__(self):
-        self.todoist_mapper = todoist_utils.TodoistToNotionMapper()
-        self.todoist_fetcher = todoist_utils.TodoistFetcher()
+    def __init__(self, store: LocalStore = None):
+        self.store = store if store else LocalStore()
+        self.todoist_fetcher = todoist_utils.TodoistFetcher(self.store)
+        self.parent_resolver = todoist_utils.ParentPageResolver(self.store, self.todoist_fetcher)
+        self.todoist_mapper = todoist_utils.TodoistToNotionMapper(self.parent_resolver)
         self.tasks_db_id = config.MASTER_TASKS_DB_ID
 
     def sync_all(self):
-        self.sync_created_tasks(all_tasks=False, sync_completed=False)
-        self.sync_updated_tasks(sync_created=False, sync_completed=True)
-        self.sync_deleted_tasks()
-
-    def create_notion_task(self, task: TodoistTask):
+        snapshot = self.todoist_fetcher.get_event_snapshot()
+        self.sync_created_tasks(all_tasks=False, sync_completed=False, snapshot=snapshot)
+        self.sync_updated_tasks(sync_created=False, sync_completed=True, snapshot=snapshot)
+        self.sync_deleted_tasks(snapshot=snapshot)
+        self.todoist_fetcher.commit_event_watermarks(SNAPSHOT_STREAM)
+
+    def sync_cycle(self):
+        """
+        One polling cycle: deleted, updated and created tasks,
+        all read from a single pass over the Todoist activity log, after the writes left pending by earlier cycles.
+        """
+        self.resume_outbox()
+        snapshot = self.todoist_fetcher.get_event_snapshot()
+        self.sync_deleted_tasks(snapshot=snapshot)
+        self.sync_updated_tasks(snapshot=snapshot)
+        self.sync_created_tasks(sync_completed=True, snapshot=snapshot)
+        self.todoist_fetcher.commit_event_watermarks(SNAPSHOT_STREAM)
+
+    async def sync_cycle_async(self):
+        """Same as sync_cycle, with Notion writes of every phase running concurrently"""
+        await asyncio.to_thread(self.resume_outbox)
+        snapshot = await asyncio.to_thread(self.todoist_fetcher.get_event_snapshot)
+        await self.sync_deleted_tasks_async(snapshot=snapshot)
+        await self.sync_updated_tasks_async(snapshot=snapshot)
+        await self.sync_created_tasks_async(sync_completed=True, snapshot=snapshot)
+        self.todoist_fetcher.commit_event_watermarks(SNAPSHOT_STREAM)
+
+    def sync_events(self, events: list[dict]):
+        """
+        Targeted sync of the tasks changed by the given activity-log shaped events (e.g. received by webhooks).
+        Leaves the activity-log watermarks alone, the next sync_cycle reconciles anything missed.
+        """
+        snapshot = EventSnapshot(events)
+        self.sync_deleted_tasks(snapshot=snapshot)
+        self.sync_updated_tasks(snapshot=snapshot)
+        self.sync_created_tasks(snapshot=snapshot)
+
+    async def sync_events_async(self, events: list[dict]):
+        snapshot = EventSnapshot(events)
+        await self.sync_deleted_tasks_async(snapshot=snapshot)
+        await self.sync_updated_tasks_async(snapshot=snapshot)
+        await self.sync_created_tasks_async(snapshot=snapshot)
+
+    def create_notion_task(self, task: TodoistTask, overwrite_existing_backlink: bool = False) -> int:
+        """
+        Create the Notion page of a task.
+        @return: id of the outbox operation, to be completed once the backlink is written to Todoist
+        """
+        notion_props, child_blocks = self._map_notion_task(task)
+        op_id = self._plan_page_creation(task, notion_props, child_blocks, overwrite_existing_backlink)
+        success, page = notion.create_page(self.tasks_db_id, *child_blocks, **notion_props)
+        self._on_page_created(task, notion_props, child_blocks, success, page, op_id)
+        return op_id
+
+    async def create_notion_task_async(self, client: AsyncNotionClient, task: TodoistTask,
+                                       overwrite_existing_backlink: bool = False) -> int:
+        # Mapping may call Todoist for labels, keep it off the event loop
+        notion_props, child_blocks = await asyncio.to_thread(self._map_notion_task, task)
+        op_id = self._plan_page_creation(task, notion_props, child_blocks, overwrite_existing_backlink)
+        success, page = await client.create_page(self.tasks_db_id, *child_blocks, **notion_props)
+        self._on_page_created(task, notion_props, child_blocks, success, page, op_id)
+        return op_id
+
+    def _plan_page_creation(self, task: TodoistTask, notion_props: dict, child_blocks: list[dict],
+                            overwrite_existing_backlink: bool) -> int:
+        return self.store.append_op(OP_CREATE_PAGE, task.task.id, {
+            'properties': notion_props, 'children': list(child_blocks),
+            'description': task.task.description, 'overwrite_backlink': overwrite_existing_backlink})
+
+    def _map_notion_task(self, task: TodoistTask) -> tuple[dict, list[dict]]:
         metadata = notion.read_database_metadata(self.tasks_db_id)['properties']
-        notion_props, child_blocks = self.todoist_mapper.map_todoist_to_notion_task(task, metadata, PARENT_PROPERTY_NAME)
+        notion_props, child_blocks = self.todoist_mapper.map_todoist_to_notion_task(task, metadata,
+                                                                                    PARENT_PROPERTY_NAME)
 
         synced_time = datetime.now(LOCAL_TIMEZONE).isoformat()
         notion_props.update({SYNCED_TIME_PROPERTY_NAME: PFormat.date(synced_time)})
+        return notion_props, child_blocks
 
-        success, page = notion.create_page(self.tasks_db_id, *child_blocks, **notion_props)
+    def _on_page_created(self, task: TodoistTask, notion_props: dict, child_blocks: list[dict], success: bool,
+                         page: dict, op_id: int = None):
         if success:
             _LOG.info(f"Page created: {page['url']}")
             task.notion_url = page['url']
+            task.notion_page_id = page['id']
+            self.parent_resolver.add_created(task.task.id, page['id'])
+            self.store.upsert_link(TaskLink(task.task.id, page['id'], page['url'],
+                                            PParser.date(page, SYNCED_TIME_PROPERTY_NAME)))
         else:
             _LOG.error(f"Error creating page from {task=}\n\t{notion_props=}\n\t{child_blocks=}\n\t{page}")
+            if op_id:
+                self.store.fail_op(op_id, str(page))
 
     def gather_metadata(self):
         # Todoist
@@ -65,101 +163,394 @@ class TodoistSyncManager:
         print(f"id: {master_tasks_db_metadata['id']}; name: {master_tasks_db_metadata['title'][0]['plain_text']};\n"
               f"properties: {p_dict}")
 
-    def sync_created_tasks(self, all_tasks=False, sync_completed=False, overwrite_existing_backlinks=False):
+    @sync_metrics.phase('created')
+    def sync_created_tasks(self, all_tasks=False, sync_completed=False, overwrite_existing_backlinks=False,
+                           snapshot: EventSnapshot = None) -> int:
+        """Create Notion pages of Todoist tasks not synced yet. Returns the number of tasks created."""
+        tasks_to_create = self._get_tasks_to_create(all_tasks, sync_completed, snapshot)
 
+        _LOG.info("Creating new Notion tasks for unlinked Todoist tasks...")
+        backlinks = todoist_utils.BacklinkWriter()
+        ops = {}
+        for task in tasks_to_create:
+            ops[task.task.id] = self.create_notion_task(task, overwrite_existing_backlinks)
+            # 4. Update Todoist task with Notion page reference
+            self._update_todoist_task_with_notion_link(task, overwrite_existing=overwrite_existing_backlinks,
+                                                       backlinks=backlinks)
+        self._complete_backlinks(backlinks, {task.task.id: ops[task.task.id] for task in tasks_to_create
+                                             if task.notion_url})
+        self.todoist_fetcher.commit_event_watermarks('created')
+        return len(tasks_to_create)
+
+    @sync_metrics.phase('created')
+    async def sync_created_tasks_async(self, all_tasks=False, sync_completed=False,
+                                       overwrite_existing_backlinks=False, snapshot: EventSnapshot = None) -> int:
+        """
+        Same as sync_created_tasks, but creates the task hierarchy level by level,
+        with up to NOTION_WRITE_CONCURRENCY pages of one level created at once.
+        """
+        tasks_to_create = self._get_tasks_to_create(all_tasks, sync_completed, snapshot)
+
+        _LOG.info("Creating new Notion tasks for unlinked Todoist tasks...")
+        semaphore = asyncio.Semaphore(config.NOTION_WRITE_CONCURRENCY)
+        backlinks = todoist_utils.BacklinkWriter()
+        ops = {}
+
+        async def create(client: AsyncNotionClient, task: TodoistTask):
+            async with semaphore:
+                ops[task.task.id] = await self.create_notion_task_async(client, task, overwrite_existing_backlinks)
+                # Sends a Sync API batch whenever one is full
+                await asyncio.to_thread(self._update_todoist_task_with_notion_link, task,
+                                        overwrite_existing=overwrite_existing_backlinks, backlinks=backlinks)
+
+        async with AsyncNotionClient() as notion_client:
+            for level in sort_tasks_by_hierarchy(tasks_to_create, levels=True):
+                await asyncio.gather(*(create(notion_client, task) for task in level))
+        await asyncio.to_thread(self._complete_backlinks, backlinks,
+                                {task.task.id: ops[task.task.id] for task in tasks_to_create if task.notion_url})
+        self.todoist_fetcher.commit_event_watermarks('created')
+        return len(tasks_to_create)
+
+    def _get_tasks_to_create(self, all_tasks: bool, sync_completed: bool, snapshot: EventSnapshot = None
+                             ) -> list[TodoistTask]:
+        """Todoist tasks not linked to Notion yet, parents first, with comments"""
         # 1.Get tasks with notes from Todoist
         _LOG.info("Fetching tasks from Todoist...")
         all_tasks = [task for page in self.todoist_fetcher.todoist_api.get_tasks() for task in page] if all_tasks \
-            else self.todoist_fetcher.get_recently_added_tasks(get_completed=sync_completed)
+            else self.todoist_fetcher.get_recently_added_tasks(get_completed=sync_completed, snapshot=snapshot)
         _LOG.info(f"Fetched {len(all_tasks)} tasks from Todoist.")
 
         tasks: list[TodoistTask] = [TodoistTask(task=task) for task in all_tasks]
         tasks = sort_tasks_by_hierarchy(tasks)
 
         # 2. Get already synced notion tasks not to create dupes
-        _LOG.info("Fetching synced tasks from Notion...")
-        notion_tasks = notion.get_synced_notion_tasks(self.tasks_db_id, TODOIST_ID_PROP)
-        linked_task_ids = list(PParser.rich_text(notion_task, TODOIST_ID_PROP) for notion_task in notion_tasks)
-        _LOG.info(f"Found {len(notion_tasks)} synced tasks in Notion.")
+        _LOG.info("Refreshing index of synced Notion tasks...")
+        self.refresh_task_index()
+        linked_task_ids = self.store.linked_task_ids()
+        _LOG.info(f"Found {len(linked_task_ids)} synced tasks in Notion.")
 
         # 3. Create not yet linked actions/tasks in Notion
         tasks_to_create = [task for task in tasks if task.task.id not in linked_task_ids]
 
         _LOG.info(f"Fetching task comments from Todoist...")
-        self.todoist_fetcher.append_comments(tasks_to_create)
-
-        _LOG.info("Creating new Notion tasks for unlinked Todoist tasks...")
-        for task in tasks_to_create:
-            self.create_notion_task(task)
-            # 4. Update Todoist task with Notion page reference
-            self._update_todoist_task_with_notion_link(task, overwrite_existing=overwrite_existing_backlinks)
+        self.todoist_fetcher.append_comments(tasks_to_create, snapshot)
+        self.parent_resolver.prefetch(tasks_to_create)
+        return tasks_to_create
+
+    def refresh_task_index(self, full: bool = False) -> None:
+        """
+        Bring the local task id -> Notion page index up to date.
+        Reads only pages edited since the previous refresh, with a full rebuild every
+        TASK_INDEX_FULL_REFRESH_HOURS to drop links to pages removed directly in Notion.
+        """
+        now = datetime.now(UTC)
+        last_refreshed = self.store.get_state(INDEX_REFRESHED_STATE)
+        last_full_refreshed = self.store.get_state(INDEX_FULL_REFRESHED_STATE)
+        full = full or not last_refreshed or not last_full_refreshed or (
+                now - datetime.fromisoformat(last_full_refreshed)
+                > timedelta(hours=config.TASK_INDEX_FULL_REFRESH_HOURS))
+
+        edited_since = None if full \
+            else (datetime.fromisoformat(last_refreshed) - INDEX_REFRESH_OVERLAP).isoformat()
+        pages = notion.get_synced_notion_tasks(self.tasks_db_id, TODOIST_ID_PROP, edited_since,
+                                               properties=LINK_PROPERTIES)
+        if pages is None:
+            _LOG.warning(f"{'Full' if full else 'Delta'} task index refresh failed, keeping the current index")
+            return
+        links = [_task_link_from_page(page) for page in pages]
+        if full:
+            self.store.replace_links(links)
+            self.store.set_state(INDEX_FULL_REFRESHED_STATE, now.isoformat())
+        else:
+            self.store.upsert_links(links)
+        self.store.set_state(INDEX_REFRESHED_STATE, now.isoformat())
+        _LOG.debug(f"{'Full' if full else 'Delta'} task index refresh read {len(links)} Notion pages")
 
-    def _update_todoist_task_with_notion_link(self, task: TodoistTask, overwrite_existing: bool = False) -> None:
+    def _update_todoist_task_with_notion_link(self, task: TodoistTask, overwrite_existing: bool = False,
+                                              backlinks: todoist_utils.BacklinkWriter = None) -> None:
+        """Add the Notion page link to the task description, queued on `backlinks` if given"""
         if not task.notion_url:
             _LOG.warning(f"Task '{task.task.content}' has no Notion page reference")
             return
-        notion_reference = f"[Notion]({task.notion_url})"
-        task_description = task.task.description
-        if not task_description:
-            task_description = notion_reference
-        elif notion_reference not in task_description:
-            if overwrite_existing:
-                task_description = re.sub(todoist_utils.NOTION_SHORTHAND_LINK_PATTERN, "", task_description).strip()
-            task_description = f"{notion_reference}\n{task_description}"
-        self.todoist_fetcher.todoist_api.update_task(task.task.id, description=task_description)
-
-    def sync_updated_tasks(self, sync_created=True, sync_completed=True):
+        task_description = backlink_description(task.notion_url, task.task.description, overwrite_existing)
+        if backlinks:
+            backlinks.queue(task.task.id, task_description)
+        else:
+            self.todoist_fetcher.todoist_api.update_task(task.task.id, description=task_description)
+
+    def _complete_backlinks(self, backlinks: todoist_utils.BacklinkWriter, ops: dict[str, int]):
+        """Send queued backlinks and settle the page creation operations of their tasks"""
+        errors = backlinks.flush()
+        self.store.complete_ops(op_id for task_id, op_id in ops.items() if task_id not in errors)
+        for task_id, error in errors.items():
+            if task_id in ops:
+                self.store.fail_op(ops[task_id], str(error))
+
+    @sync_metrics.phase('updated')
+    def sync_updated_tasks(self, sync_created=True, sync_completed=True, snapshot: EventSnapshot = None) -> int:
+        """Patch Notion pages of updated Todoist tasks. Returns the number of pages patched."""
+        updates = self._get_notion_updates(sync_created, sync_completed, snapshot)
+        for (entry, props_to_upd, fingerprints), op_id in zip(updates, self._plan_page_updates(updates)):
+            success, page = notion.update_page(entry['id'], **props_to_upd)
+            self._on_page_updated(entry, props_to_upd, success, page, fingerprints, op_id)
+        self.todoist_fetcher.commit_event_watermarks(*UPDATE_STREAMS)
+        return len(updates)
+
+    @sync_metrics.phase('updated')
+    async def sync_updated_tasks_async(self, sync_created=True, sync_completed=True,
+                                       snapshot: EventSnapshot = None) -> int:
+        updates = self._get_notion_updates(sync_created, sync_completed, snapshot)
+        semaphore = asyncio.Semaphore(config.NOTION_WRITE_CONCURRENCY)
+
+        async def update(client: AsyncNotionClient, entry: dict, props_to_upd: dict, fingerprints: dict[str, str],
+                         op_id: int):
+            async with semaphore:
+                success, page = await client.update_page(entry['id'], **props_to_upd)
+            self._on_page_updated(entry, props_to_upd, success, page, fingerprints, op_id)
+
+        async with AsyncNotionClient() as notion_client:
+            await asyncio.gather(*(update(notion_client, *upd, op_id)
+                                   for upd, op_id in zip(updates, self._plan_page_updates(updates))))
+        self.todoist_fetcher.commit_event_watermarks(*UPDATE_STREAMS)
+        return len(updates)
+
+    def _get_notion_updates(self, sync_created: bool, sync_completed: bool, snapshot: EventSnapshot = None
+                            ) -> list[tuple[dict, dict, dict[str, str]]]:
+        """
+        Notion entries of updated Todoist tasks paired with the properties to patch
+        and the fingerprints to store once the patch succeeded
+        """
         # get relevant prop updates mappings
-        updated_tasks, updated_events = self.todoist_fetcher.get_updated_tasks(sync_created, sync_completed)
-        updated_tasks = [TodoistTask(task=task) for task in updated_tasks]
-        self.todoist_fetcher.append_comments(updated_tasks)
-
-        entries_to_update = notion.get_notion_tasks_before_time(self.tasks_db_id, TODOIST_ID_PROP,
-                                                                SYNCED_TIME_PROPERTY_NAME, updated_tasks,
-                                                                updated_events)
-        # Filter notion entries by date and time since api call filters only by date ignoring time
-        entries_to_update = [e for e in entries_to_update if
-                             PParser.date(e, SYNCED_TIME_PROPERTY_NAME) < updated_events[
-                                 PParser.rich_text(e, TODOIST_ID_PROP)]]
+        updated_tasks, updated_events = self.todoist_fetcher.get_updated_tasks(sync_created, sync_completed, snapshot)
+        updated_tasks = {str(task.id): TodoistTask(task=task) for task in updated_tasks}
+        self.todoist_fetcher.append_comments(list(updated_tasks.values()), snapshot)
 
         metadata = notion.read_database_metadata(self.tasks_db_id)['properties']
-        for entry in entries_to_update:
-            todoist_task = next(
-                filter(lambda x: str(x.task.id) == PParser.rich_text(entry, TODOIST_ID_PROP), updated_tasks))
-            props_to_check_for_upd = ['content', 'due.date', 'is_completed', 'priority', 'comments']
-            props_to_upd = self.todoist_mapper.update_properties(entry, todoist_task, props_to_check_for_upd, metadata)
+        fingerprints = {task_id: self.todoist_mapper.fingerprint_properties(task, UPDATED_PROPERTIES, metadata)
+                        for task_id, task in updated_tasks.items()}
+        dirty_properties = self._get_dirty_properties(fingerprints)
+        dirty_tasks = {task_id: updated_tasks[task_id] for task_id in dirty_properties}
+        _LOG.info(f"{len(dirty_tasks)} of {len(updated_tasks)} updated tasks changed since the last sync")
+
+        entries = notion.get_notion_tasks_before_time(self.tasks_db_id, TODOIST_ID_PROP, SYNCED_TIME_PROPERTY_NAME,
+                                                      list(dirty_tasks.values()), updated_events)
+
+        updates = []
+        for entry, todoist_task in match_updated_entries(entries, dirty_tasks, updated_events):
+            task_id = str(todoist_task.task.id)
+            props_to_upd = self.todoist_mapper.update_properties(entry, todoist_task, dirty_properties[task_id],
+                                                                 metadata)
 
             if props_to_upd:
                 props_to_upd[SYNCED_TIME_PROPERTY_NAME] = PFormat.date(datetime.now(LOCAL_TIMEZONE).isoformat())
-                success, page = notion.update_page(entry['id'], **props_to_upd)
-                if success:
-                    _LOG.info(f"Notion task '{PParser.title(entry, 'Name')}' was updated: {page['url']}")
-                else:
-                    _LOG.error(
-                        f"Error updating Notion task '{PParser.title(entry, 'Name')}', {props_to_upd=}: {entry['url']=}")
-
-    def sync_deleted_tasks(self) -> None:
-        events = self.todoist_fetcher.get_events(object_type='item', event_type='deleted')
+                updates.append((entry, props_to_upd, fingerprints[task_id]))
+            else:
+                # Notion shows the current values already
+                self._save_fingerprints(task_id, fingerprints[task_id])
+        return updates
+
+    def _get_dirty_properties(self, fingerprints: dict[str, dict[str, str]]) -> dict[str, list[str]]:
+        """
+        Properties to diff per task: those whose mapped payload changed since it was last written to Notion.
+        Tasks with an unchanged payload are left out, tasks without stored fingerprints get all properties.
+        """
+        links = self.store.get_links(fingerprints.keys())
+        dirty = {}
+        for task_id, task_fingerprints in fingerprints.items():
+            link = links.get(task_id)
+            if link and link.fingerprint == todoist_utils.fingerprint(task_fingerprints):
+                continue
+            stored = link.property_fingerprints or {} if link else {}
+            dirty[task_id] = [key for key in UPDATED_PROPERTIES if stored.get(key) != task_fingerprints[key]]
+        return dirty
+
+    def _save_fingerprints(self, task_id: str, property_fingerprints: dict[str, str]):
+        self.store.set_fingerprints(task_id, todoist_utils.fingerprint(property_fingerprints), property_fingerprints)
+
+    def _plan_page_updates(self, updates: list[tuple[dict, dict, dict[str, str]]]) -> list[int]:
+        return self.store.append_ops(
+            (OP_UPDATE_PAGE, entry['id'], {'page': _page_stub(entry), 'properties': props_to_upd,
+                                           'fingerprints': fingerprints})
+            for entry, props_to_upd, fingerprints in updates)
+
+    def _on_page_updated(self, entry: dict, props_to_upd: dict, success: bool, page: dict,
+                         fingerprints: dict[str, str] = None, op_id: int = None):
+        if success:
+            _LOG.info(f"Notion task '{PParser.title(entry, 'Name')}' was updated: {page['url']}")
+            link = _task_link_from_page(page)
+            self.store.upsert_link(link)
+            if fingerprints:
+                self._save_fingerprints(link.task_id, fingerprints)
+            if op_id:
+                self.store.complete_ops([op_id])
+        else:
+            _LOG.error(
+                f"Error updating Notion task '{PParser.title(entry, 'Name')}', {props_to_upd=}: {entry['url']=}")
+            if op_id:
+                self.store.fail_op(op_id, str(page))
+
+    @sync_metrics.phase('deleted')
+    def sync_deleted_tasks(self, snapshot: EventSnapshot = None) -> int:
+        """Archive Notion pages of deleted Todoist tasks. Returns the number of pages archived."""
+        archive_props = self._archive_props()
+        archives = self._plan_page_archives(self._get_notion_tasks_of_deleted(snapshot), archive_props)
+        for task, op_id in archives:
+            success, page = notion.update_page(task['id'], archive=True, **archive_props)
+            self._on_page_archived(task, success, page, op_id)
+        self.todoist_fetcher.commit_event_watermarks('deleted')
+        return len(archives)
+
+    @sync_metrics.phase('deleted')
+    async def sync_deleted_tasks_async(self, snapshot: EventSnapshot = None) -> int:
+        archive_props = self._archive_props()
+        archives = self._plan_page_archives(self._get_notion_tasks_of_deleted(snapshot), archive_props)
+        semaphore = asyncio.Semaphore(config.NOTION_WRITE_CONCURRENCY)
+
+        async def archive(client: AsyncNotionClient, task: dict, op_id: int):
+            async with semaphore:
+                success, page = await client.update_page(task['id'], archive=True, **archive_props)
+            self._on_page_archived(task, success, page, op_id)
+
+        async with AsyncNotionClient() as notion_client:
+            await asyncio.gather(*(archive(notion_client, task, op_id) for task, op_id in archives))
+        self.todoist_fetcher.commit_event_watermarks('deleted')
+        return len(archives)
+
+    def _get_notion_tasks_of_deleted(self, snapshot: EventSnapshot = None) -> Iterator[dict]:
+        events = snapshot.of_type('item:deleted') if snapshot \
+            else self.todoist_fetcher.get_events(object_type='item', event_type='deleted', stream='deleted')
         if not events:
-            return
+            return iter(())
         deleted_tasks_id = [str(x['v2_object_id']) for x in events]
-        notion_tasks_to_delete = self._get_notion_tasks_to_delete(TODOIST_ID_PROP, deleted_tasks_id)
+        return self._get_notion_tasks_to_delete(TODOIST_ID_PROP, deleted_tasks_id)
 
+    @staticmethod
+    def _archive_props() -> dict:
         synced_time = datetime.now(LOCAL_TIMEZONE).isoformat()
-        update_to_delete = {SYNCED_TIME_PROPERTY_NAME: PFormat.date(synced_time)}
+        return {SYNCED_TIME_PROPERTY_NAME: PFormat.date(synced_time)}
 
-        for task in notion_tasks_to_delete:
-            success, page = notion.update_page(task['id'], archive=True, **update_to_delete)
-            if success:
-                _LOG.info(f"Notion task '{PParser.title(task, 'Name')}' was archived: {page['url']}")
-            else:
-                _LOG.error(f"Error archiving Notion task '{PParser.title(task, 'Name')}': {task['url']=}")
+    def _plan_page_archives(self, tasks: Iterable[dict], archive_props: dict) -> list[tuple[dict, int]]:
+        """Record the archiving of the streamed pages, keeping only the page stubs needed to run it"""
+        stubs = [_page_stub(task) for task in tasks]
+        op_ids = self.store.append_ops(
+            (OP_ARCHIVE_PAGE, stub['id'], {'page': stub, 'properties': archive_props}) for stub in stubs)
+        return list(zip(stubs, op_ids))
+
+    def _on_page_archived(self, task: dict, success: bool, page: dict, op_id: int = None):
+        if success:
+            _LOG.info(f"Notion task '{PParser.title(task, 'Name')}' was archived: {page['url']}")
+            self.store.remove_link(PParser.rich_text(task, TODOIST_ID_PROP))
+            if op_id:
+                self.store.complete_ops([op_id])
+        else:
+            _LOG.error(f"Error archiving Notion task '{PParser.title(task, 'Name')}': {task['url']=}")
+            if op_id:
+                self.store.fail_op(op_id, str(page))
 
-    def _get_notion_tasks_to_delete(self, prop_name: str, deleted_tasks_id: list[str]):
+    def _get_notion_tasks_to_delete(self, prop_name: str, deleted_tasks_id: list[str]) -> Iterator[dict]:
         by_deleted_id_filter = [Filter.RichText(prop_name).equals(del_id) for del_id in deleted_tasks_id]
-        query = Filter.Or(*by_deleted_id_filter)
-        entries_to_delete = notion.read_database(self.tasks_db_id, query)
-        return entries_to_delete
+        return notion.iter_database_by_filters(self.tasks_db_id, by_deleted_id_filter,
+                                               filter_properties=ARCHIVE_PROPERTIES)
+
+    @sync_metrics.phase('outbox')
+    def resume_outbox(self) -> int:
+        """
+        Run the Notion/Todoist writes recorded in the outbox but never confirmed, e.g. because the process died.
+        Page creations check Notion first, so pages created right before a crash only get their backlink.
+        Operations of different pages run concurrently on NOTION_WRITE_CONCURRENCY workers.
+        @return: number of operations resumed
+        """
+        self.store.prune_ops((datetime.now(UTC) - timedelta(hours=config.OUTBOX_RETENTION_HOURS)).isoformat())
+        ops = self.store.pending_ops()
+        if not ops:
+            return 0
+        _LOG.info(f"Resuming {len(ops)} pending writes from the outbox")
+        unlinked = [op.key for op in ops if op.kind == OP_CREATE_PAGE and not self.store.is_linked(op.key)]
+        # Pages created right before a crash, not indexed yet
+        by_task_id_filter = [Filter.RichText(TODOIST_ID_PROP).equals(task_id) for task_id in unlinked]
+        found = notion.iter_database_by_filters(self.tasks_db_id, by_task_id_filter, filter_properties=LINK_PROPERTIES)
+        created_pages = {link.task_id: link for link in map(_task_link_from_page, found)}
+        by_key = defaultdict(list)
+        for op in ops:
+            by_key[op.key].append(op)
+        backlinks = todoist_utils.BacklinkWriter()
+        backlink_ops = {}
+
+        def replay(key_ops: list[OutboxOp]):
+            for key_op in key_ops:
+                self._replay_op(key_op, created_pages, backlinks, backlink_ops)
+
+        with ThreadPoolExecutor(max_workers=config.NOTION_WRITE_CONCURRENCY) as pool:
+            list(pool.map(replay, by_key.values()))
+        self._complete_backlinks(backlinks, backlink_ops)
+        return len(ops)
+
+    def _replay_op(self, op: OutboxOp, created_pages: dict[str, TaskLink], backlinks: todoist_utils.BacklinkWriter,
+                   backlink_ops: dict[str, int]):
+        payload = op.payload
+        if op.kind == OP_UPDATE_PAGE:
+            success, page = notion.update_page(payload['page']['id'], **payload['properties'])
+            self._on_page_updated(payload['page'], payload['properties'], success, page, payload['fingerprints'],
+                                  op.id)
+        elif op.kind == OP_ARCHIVE_PAGE:
+            success, page = notion.update_page(payload['page']['id'], archive=True, **payload['properties'])
+            self._on_page_archived(payload['page'], success, page, op.id)
+        elif op.kind == OP_CREATE_PAGE:
+            link = self.store.get_link(op.key) or created_pages.get(op.key)
+            if not link:
+                success, page = notion.create_page(self.tasks_db_id, *payload['children'], **payload['properties'])
+                if not success:
+                    _LOG.error(f"Error creating page of task {op.key} from the outbox: {page}")
+                    self.store.fail_op(op.id, str(page))
+                    return
+                link = TaskLink(op.key, page['id'], page['url'], PParser.date(page, SYNCED_TIME_PROPERTY_NAME))
+            self.store.upsert_link(link)
+            backlinks.queue(op.key, backlink_description(link.url, payload['description'],
+                                                         payload['overwrite_backlink']))
+            backlink_ops[op.key] = op.id
+        else:
+            _LOG.warning(f"Dropping outbox operation of unknown kind {op.kind}")
+            self.store.fail_op(op.id, f"unknown kind {op.kind}", max_attempts=1)
+
+
+def _task_link_from_page(page: dict) -> TaskLink:
+    return TaskLink(PParser.rich_text(page, TODOIST_ID_PROP), page['id'], page.get('url'),
+                    PParser.date(page, SYNCED_TIME_PROPERTY_NAME))
+
+
+def _page_stub(page: dict) -> dict:
+    """The parts of a Notion page needed to replay and log a write of it"""
+    properties = page.get('properties') or {}
+    return {'id': page['id'], 'url': page.get('url'),
+            'properties': {name: properties[name] for name in ('Name', TODOIST_ID_PROP) if name in properties}}
+
+
+def backlink_description(notion_url: str, description: str | None, overwrite_existing: bool = False) -> str:
+    """Todoist task description starting with a link to the task's Notion page"""
+    notion_reference = f"[Notion]({notion_url})"
+    if not description:
+        return notion_reference
+    if notion_reference in description:
+        return description
+    if overwrite_existing:
+        description = re.sub(todoist_utils.NOTION_SHORTHAND_LINK_PATTERN, "", description).strip()
+    return f"{notion_reference}\n{description}"
+
+
+def match_updated_entries(entries: list[dict], updated_tasks: dict[str, TodoistTask],
+                          updated_events: dict[str, str]) -> list[tuple[dict, TodoistTask]]:
+    """
+    Pair Notion entries with their updated Todoist task (by task id),
+    keeping only entries synced before the task's latest update event.
+    """
+    matches = []
+    for entry in entries:
+        task_id = PParser.rich_text(entry, TODOIST_ID_PROP)
+        todoist_task = updated_tasks.get(task_id)
+        # Compare date and time here since the API filter checks the date only
+        if todoist_task and PParser.date(entry, SYNCED_TIME_PROPERTY_NAME) < updated_events[task_id]:
+            matches.append((entry, todoist_task))
+    return matches
 
 
 def update_task_id(page_id, task_id):
@@ -169,9 +560,12 @@ def update_task_id(page_id, task_id):
         _LOG.error(f"Error adding TodoistTaskId={task_id} to notion task '{page['url']}'")
 
 
-def sort_tasks_by_hierarchy(tasks: list[TodoistTask]) -> list[TodoistTask]:
+def sort_tasks_by_hierarchy(tasks: list[TodoistTask], levels: bool = False
+                            ) -> list[TodoistTask] | list[list[TodoistTask]]:
     """
     Sort tasks to ensure that any parent task always comes before its children
+    :param levels: return hierarchy levels instead of a flat list: all roots (and orphans),
+        then all their children, etc. Tasks of one level don't depend on each other.
     """
     if not tasks:
         return []
@@ -193,23 +587,20 @@ def sort_tasks_by_hierarchy(tasks: list[TodoistTask]) -> list[TodoistTask]:
             # If parent doesn't exist, in_degree stays 0 (orphaned task)
 
     # Kahn's algorithm for topological sorting
-    queue = deque()
-    result = []
-
     # Start with all nodes that have in-degree 0 (root tasks and orphaned tasks)
-    for task in tasks:
-        if in_degree[task.task.id] == 0:
-            queue.append(task)
+    level = [task for task in tasks if in_degree[task.task.id] == 0]
+    result = []
 
     # Process tasks level by level
-    while queue:
-        current_task = queue.popleft()
-        result.append(current_task)
-
-        # Process all children of current task
-        for child_task in children[current_task.task.id]:
-            in_degree[child_task.task.id] -= 1
-            if in_degree[child_task.task.id] == 0:
-                queue.append(child_task)
-
-    return result
+    while level:
+        result.append(level)
+        next_level = []
+        # Process all children of current level tasks
+        for current_task in level:
+            for child_task in children[current_task.task.id]:
+                in_degree[child_task.task.id] -= 1
+                if in_degree[child_task.task.id] == 0:
+                    next_level.append(child_task)
+        level = next_level
+
+    return result if levels else [task for level_tasks in result for task in level_tasks]
@@ -1,22 +1,32 @@
 import ast
+import hashlib
+import json
 import logging
 import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta, UTC
 from enum import Enum
-from functools import reduce, lru_cache
-from typing import Literal, Any
+from functools import reduce, lru_cache, partial
+from types import CodeType
+from typing import Literal, Any, Callable
 from tqdm import tqdm
 
 import httpx
 import pytz
 from todoist_api_python.api import TodoistAPI
-from synctodoist import TodoistAPI as SyncTodoistAPI
 from synctodoist.managers import command_manager
-from todoist_api_python.models import Task
+from todoist_api_python.models import Task, Comment
 from models import TodoistTask
 
 import notion
 import config
+from local_store import ITEMS_SYNC_TOKEN_STATE, LocalStore
+from metrics import sync_metrics
+from http_sessions import todoist_session, todoist_sync_client
 from notion import PropertyFormatter as PFormat
 from notion import PropertyParser as PParser
 
@@ -37,6 +47,22 @@ NOTION_SHORTHAND_LINK_PATTERN = re.compile(
     "\\[Notion]\\((" + NOTION_LINK_PATTERN.pattern + ")\\)"
 )
 
+EVENT_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+COMMENT_EVENT_TYPES = ['note:added', 'note:updated', 'note:deleted']
+ACTIVITY_STATE = 'activity.last_event_id'
+COMPLETED_STATE = 'completed_tasks.synced_until'
+COMPLETED_WINDOW = timedelta(days=90)  # the longest period Todoist returns completed tasks for
+SYNC_COMMANDS_LIMIT = 100  # max commands of one Sync API request
+ITEM_RESOURCE_TYPES = json.dumps(['items'])
+# Sync API items carry legacy ids next to the v2 ones used by the REST API and the activity log
+V2_ID_FIELDS = {'v2_id': 'id', 'v2_parent_id': 'parent_id', 'v2_project_id': 'project_id',
+                'v2_section_id': 'section_id'}
+SNAPSHOT_STREAM = 'cycle'
+# Fields of the REST Task model that Sync API items may lack, with the value their absence stands for
+ITEM_DEFAULTS = {'description': '', 'section_id': None, 'parent_id': None, 'labels': [], 'priority': 1, 'due': None,
+                 'deadline': None, 'duration': None, 'responsible_uid': None, 'assigned_by_uid': None,
+                 'completed_at': None}
+
 ObjectType = Literal['item', 'project', 'note']
 EventType = Literal['added', 'updated', 'deleted', 'completed', 'uncompleted']
 ObjectEventType = Literal[
@@ -45,6 +71,53 @@ ObjectEventType = Literal[
     'note:added', 'note:updated', 'note:deleted']
 
 
+# Everything the sync phases read from the activity log
+SNAPSHOT_EVENT_TYPES: list[ObjectEventType] = ['item:added', 'item:updated', 'item:completed', 'item:deleted',
+                                               *COMMENT_EVENT_TYPES]
+
+
+@dataclass
+class EventSnapshot:
+    """Activity-log events of one sync cycle, fetched in a single pass and shared by all sync phases"""
+    events: list[dict]
+
+    def of_type(self, *object_event_types: ObjectEventType) -> list[dict]:
+        return [x for x in self.events if f"{x['object_type']}:{x['event_type']}" in object_event_types]
+
+
+class SharedEventSnapshot:
+    """
+    Activity-log events shared by sync phases polled on their own intervals, read in one pass per poll tick.
+    Every read returns the events since the committed SNAPSHOT_STREAM watermark, each phase gets those
+    it hasn't processed yet, and the watermark is committed once every phase has processed the events up to it.
+    Usage example:
+        shared = SharedEventSnapshot(fetcher, ['deleted', 'updated'])
+        changes = manager.sync_deleted_tasks(snapshot=shared.get('deleted'))
+        shared.processed('deleted')
+        shared.expire()  # at the end of the tick, the next get reads again
+    """
+
+    def __init__(self, fetcher: 'TodoistFetcher', phases: list[str]):
+        self.fetcher = fetcher
+        self._processed = {phase: 0 for phase in phases}  # phase -> id of the newest event it processed
+        self._snapshot: EventSnapshot | None = None
+
+    def get(self, phase: str) -> EventSnapshot:
+        """Events of the current tick `phase` hasn't processed yet"""
+        if self._snapshot is None:
+            self._snapshot = self.fetcher.get_event_snapshot()
+        return EventSnapshot([x for x in self._snapshot.events if int(x['id']) > self._processed[phase]])
+
+    def processed(self, phase: str):
+        """Mark the events `get` returned to `phase` as processed"""
+        self._processed[phase] = max((int(x['id']) for x in self._snapshot.events), default=self._processed[phase])
+        if all(self._processed.values()):
+            self.fetcher.commit_event_watermark(SNAPSHOT_STREAM, min(self._processed.values()))
+
+    def expire(self):
+        self._snapshot = None
+
+
 class NoneStrategy(Enum):
     IGNORE = 'ignore'  # Ignore property value if it is not mapped
     VALUE_AS_IS = 'value-as-is'
@@ -59,6 +132,7 @@ def load_todoist_to_notion_mapper() -> dict:
         return ast.literal_eval(contents)
 
 
+@lru_cache
 def get_notion_formatter_mapper():
     # TODO move 'is_property' to pformat object
     return {'title': {'method': PFormat.single_title, 'parser': PParser.title, 'list_values': True},
@@ -75,15 +149,123 @@ def get_default_property_values():
     return {'type': 'rich_text'}
 
 
-class TodoistToNotionMapper:
-
-    def __init__(self):
+@dataclass(frozen=True)
+class ValueTarget:
+    """Notion property (or child block heading) a Todoist value is mapped to, with its bound formatter"""
+    name: str
+    type: str | None  # property type in the database, or mapped type if the property doesn't exist
+    formatter: dict | None
+    is_property: bool
+    value: Any = None  # value from the mappings file, replaces the Todoist value
+    format: Callable[[Any], dict] | None = None  # formats `value` if set, otherwise the Todoist value
+    is_text: bool = False  # title or rich_text, long values are split into several text objects
+
+
+@dataclass(frozen=True)
+class PropertyPlan:
+    """Mapping of one Todoist property compiled against a database schema"""
+    prop_key: str
+    default: ValueTarget
+    values: dict[str, ValueTarget]
+    ignore_unmapped: bool
+    map_by_name: bool
+    link: str | None
+    expression: CodeType | None
+
+    def target(self, todoist_val) -> ValueTarget:
+        return self.values.get(str(todoist_val), self.default) if self.values else self.default
+
+
+def compile_mapping_plan(mappings: dict, db_metadata: dict) -> dict[str, PropertyPlan]:
+    """Resolve target names, types and formatters of mappings.json once for the given database schema"""
+    return {prop_key: _compile_property_plan(prop_key, mapping, db_metadata) for prop_key, mapping in mappings.items()}
+
+
+def _compile_property_plan(prop_key: str, mapping: dict, db_metadata: dict) -> PropertyPlan:
+    default_values = mapping.get('default_values', {})
+    default_name = default_values.get('name', get_default_property_values().get('name', f"{prop_key}: "))
+    default_type = default_values.get('type', get_default_property_values().get('type'))
+    expression = default_values.get('expression')
+    return PropertyPlan(
+        prop_key=prop_key,
+        default=_compile_value_target(default_name, default_type, None, db_metadata),
+        values={key: _compile_value_target(value.get('name', default_name), value.get('type', default_type),
+                                           value.get('value'), db_metadata)
+                for key, value in mapping.get('values', {}).items()},
+        ignore_unmapped=mapping.get('none_strategy') == NoneStrategy.IGNORE.value,
+        map_by_name=mapping.get('none_strategy') == NoneStrategy.MAP_BY_NAME.value,
+        link=mapping.get('link'),
+        expression=compile(expression, f"<mappings.json: {prop_key}>", 'eval') if expression else None)
+
+
+def _compile_value_target(name: str, mapped_type: str, value, db_metadata: dict) -> ValueTarget:
+    is_property = bool(name) and name in db_metadata.keys()
+    prop_type = db_metadata[name]['type'] if is_property else mapped_type
+    formatter = get_notion_formatter_mapper().get(prop_type)
+    method = formatter['method'] if formatter else None
+    if not formatter:
+        format_ = None
+    elif value and method in (PFormat.single_title, PFormat.single_rich_text):
+        format_ = PFormat.text
+    elif value and method == PFormat.single_relation:
+        format_ = PFormat.id
+    else:
+        format_ = partial(method, property_obj=is_property)
+    return ValueTarget(name, prop_type, formatter, is_property, value, format_,
+                       method in (PFormat.single_title, PFormat.single_rich_text))
+
+
+_shared_api: TodoistAPI | None = None
+_shared_api_lock = threading.Lock()
+
+
+def shared_todoist_api() -> TodoistAPI:
+    """TodoistAPI (REST) client shared by all fetchers and mappers, created on first use"""
+    global _shared_api
+    with _shared_api_lock:
+        if _shared_api is None:
+            _shared_api = TodoistAPI(token=config.TODOIST_TOKEN, session=todoist_session())
+        return _shared_api
+
+
+class _LazyTodoistAPI:
+    """`todoist_api` is the client given to the constructor, or the shared one, created when first used"""
+    _todoist_api: TodoistAPI | None = None
+
+    @property
+    def todoist_api(self) -> TodoistAPI:
+        if self._todoist_api is None:
+            self._todoist_api = shared_todoist_api()
+        return self._todoist_api
+
+    @todoist_api.setter
+    def todoist_api(self, todoist_api: TodoistAPI):
+        self._todoist_api = todoist_api
+
+
+class TodoistToNotionMapper(_LazyTodoistAPI):
+
+    def __init__(self, parent_resolver: 'ParentPageResolver' = None, todoist_api: TodoistAPI = None):
         self.mappings = load_todoist_to_notion_mapper()
-        self.todoist_api = TodoistAPI(token=config.TODOIST_TOKEN)
+        self._todoist_api = todoist_api
+        self.parent_resolver = parent_resolver
+        # (metadata, schema signature, plan) of the last compiled schema, replaced as a whole for thread safety
+        self._compiled_plan: tuple[dict, tuple, dict[str, PropertyPlan]] | None = None
 
     def get_mapping(self, prop_key: str) -> dict:
         return self.mappings[prop_key]
 
+    def get_mapping_plan(self, db_metadata: dict) -> dict[str, PropertyPlan]:
+        """Mapping plan for the database schema, compiled again only when property names or types change"""
+        compiled = self._compiled_plan
+        if compiled and compiled[0] is db_metadata:
+            return compiled[2]
+        signature = tuple((name, prop.get('type')) for name, prop in db_metadata.items())
+        plan = compiled[2] if compiled and compiled[1] == signature \
+            else compile_mapping_plan(self.mappings, db_metadata)
+        self._compiled_plan = (db_metadata, signature, plan)
+        return plan
+
     @lru_cache
     def get_label_tag_mapping(self, n_tags=None, todoist_tags_text_prop='Todoist Tags'):
         """
@@ -91,7 +273,8 @@ class TodoistToNotionMapper:
         :return: dict(todoist_label_id: notion_tag_page_id)
         """
         labels = {label.name: label.id for page in self.todoist_api.get_labels() for label in page}
-        notion_master_tags = n_tags if n_tags else notion.read_database(config.MASTER_TAG_DB)
+        notion_master_tags = n_tags if n_tags else notion.iter_database(
+            config.MASTER_TAG_DB, filter_properties=[todoist_tags_text_prop])
         notion_tags = {tag: page['id'] for page in notion_master_tags if
                        (tag := PParser.rich_text(page, todoist_tags_text_prop))}
         tag_mapping = {labels[key]: notion_tags[key] for key in notion_tags if key in labels}
@@ -103,29 +286,31 @@ class TodoistToNotionMapper:
         if not parent_id:
             return None
         parent_task = self.todoist_api.get_task(parent_id)
-        match = re.match(NOTION_MARKDOWN_LINK_PATTERN, parent_task.description)
-        if match:
-            return match.group(6)
-        return None
+        return extract_notion_uuid(parent_task.description)
+
+    def resolve_parent_notion_uuid(self, task: TodoistTask) -> str | None:
+        if self.parent_resolver:
+            return self.parent_resolver.resolve(task)
+        return self.extract_parent_notion_uuid(task)
 
     def map_property(self, task: TodoistTask, prop_name: str, db_metadata: dict, notion_props: dict = None,
                      child_blocks: list = None,
-                     convert_md_links=False) -> tuple[dict[str, Any], list[dict]]:
+                     convert_md_links=False, task_dict: dict = None) -> tuple[dict[str, Any], list[dict]]:
         if isinstance(notion_props, type(None)):
             notion_props = {}
         if isinstance(child_blocks, type(None)):
             child_blocks = []
 
-        _p, _c = self.parse_prop(task, prop_name, db_metadata, convert_md_links)
+        _p, _c = self.parse_prop(task, prop_name, db_metadata, convert_md_links, task_dict)
         if _p:
             notion_props.update(_p)
         if _c:
             child_blocks.append(_c) if not isinstance(_c, list) else child_blocks.extend(_c)
         return notion_props, child_blocks
 
-    def parse_prop(self, task: TodoistTask, prop_key: str,
-                   db_metadata: dict, convert_md_links: bool) -> tuple[dict[str, Any] | None, list[dict] | None]:
-        if not task or not (todoist_val := deep_get_task_prop(task.task.to_dict(), prop_key)):
+    def parse_prop(self, task: TodoistTask, prop_key: str, db_metadata: dict, convert_md_links: bool,
+                   task_dict: dict = None) -> tuple[dict[str, Any] | None, list[dict] | None]:
+        if not task or not (todoist_val := deep_get_task_prop(task_dict or task.task.to_dict(), prop_key)):
             return None, None
 
         value_list = todoist_val if isinstance(todoist_val, list) else [todoist_val]
@@ -165,83 +350,55 @@ class TodoistToNotionMapper:
         :return: example:
             {"POM": {"formatter": {"method": pformat.select, "list_values": False}, "values": [], "raw_val": []}}
         """
-        label_mapper = self.get_label_tag_mapping() if prop_key == 'labels' else None
+        plan = self.get_mapping_plan(db_metadata)[prop_key]
         props = {}
-        mappings = self.get_mapping(prop_key)
-        default_notion_values = mappings.get('default_values', {})
         for todoist_val in todoist_val_list:
-            mapped_prop = mappings.get('values', {}).get(str(todoist_val), {})
-            mapped_name = mapped_prop.get('name',
-                                          default_notion_values.get('name',
-                                                                    get_default_property_values().get('name',
-                                                                                                      f"{prop_key}: ")))
-            mapped_type = mapped_prop.get('type',
-                                          default_notion_values.get('type', get_default_property_values().get('type')))
-            mapped_value = mapped_prop.get('value')
-            is_property = mapped_name and mapped_name in db_metadata.keys()
-            formatter = get_notion_formatter_mapper().get(
-                db_metadata[mapped_name]['type'] if is_property else mapped_type)
-
-            current_prop = props.get(mapped_name, {})
-            current_prop['formatter'] = formatter
-            current_prop_values = current_prop.get('values', [])
-            current_prop_raw_values = current_prop.get('raw_val', [])
-
-            current_prop['values'] = current_prop_values
-            current_prop['raw_val'] = current_prop_raw_values
-            props[mapped_name] = current_prop
+            target = plan.target(todoist_val)
+            current_prop = props.setdefault(target.name, {'values': [], 'raw_val': []})
+            current_prop['formatter'] = target.formatter
+            current_prop_values = current_prop['values']
+            current_prop_raw_values = current_prop['raw_val']
 
             # Parse mapped property value according to mapping file
-            if mapped_value:
-                current_prop_raw_values.append(mapped_value)
-                if not formatter:
+            if target.value:
+                current_prop_raw_values.append(target.value)
+                if not target.formatter:
                     _LOG.warning(f"Formatter for {prop_key} value {todoist_val} is not defined.")
-                    current_prop_values.append(PFormat.text(mapped_value))
-                    continue
-                elif formatter['method'] == PFormat.single_title:
-                    current_prop_values.append(PFormat.text(mapped_value))
-                    continue
-                elif formatter['method'] == PFormat.single_rich_text:
-                    current_prop_values.append(PFormat.text(mapped_value))
-                    continue
-                elif formatter['method'] == PFormat.single_relation:
-                    current_prop_values.append(PFormat.id(mapped_value))
+                    current_prop_values.append(PFormat.text(target.value))
                     continue
-                current_prop_values.append(formatter['method'](mapped_value, property_obj=is_property))
+                current_prop_values.append(target.format(target.value))
                 continue
 
             # If property value is not mapped, ignore it
-            if mappings.get('none_strategy') == NoneStrategy.IGNORE.value:
+            if plan.ignore_unmapped:
                 _LOG.warning(f"Property {prop_key} value {todoist_val} is not mapped. Ignoring it.")
                 continue
 
-            if (mappings.get('none_strategy') == NoneStrategy.MAP_BY_NAME.value
-                    and label_mapper and todoist_val in label_mapper):
+            if (plan.map_by_name and prop_key == 'labels'
+                    and todoist_val in (label_mapper := self.get_label_tag_mapping())):
                 current_prop_values.append(PFormat.mention(label_mapper[todoist_val]))
                 current_prop_raw_values.append(todoist_val)
                 continue
 
             # If property value is not mapped, parse it according to NoneStrategy.VALUE_AS_IS and default_values rules
-            if convert_md_links and formatter['method'] in \
-                    [PFormat.single_title, PFormat.single_rich_text] and MD_LINK_PATTERN.search(todoist_val):
+            if convert_md_links and target.is_text and MD_LINK_PATTERN.search(todoist_val):
                 rich_text_objects = parse_md_string_to_rich_text_objects(todoist_val)
                 current_prop_values.extend(rich_text_objects)
                 current_prop_raw_values.append(parse_md_string_to_notion_view(todoist_val))
                 continue
 
-            if 'link' in mappings.keys():
-                link = mappings.get('link').format(todoist_val)
-                current_prop_values.append(PFormat.link(todoist_val, link))
+            if plan.link:
+                current_prop_values.append(PFormat.link(todoist_val, plan.link.format(todoist_val)))
                 continue
 
-            if 'expression' in default_notion_values.keys():
-                todoist_val = eval(default_notion_values.get('expression'), {'value': todoist_val})
+            if plan.expression:
+                todoist_val = eval(plan.expression, {'value': todoist_val})
 
-            if formatter['method'] in [PFormat.single_title, PFormat.single_rich_text]:
+            if target.is_text:
                 current_prop_values.extend(
                     [PFormat.text(todoist_val[i:i + 2000]) for i in range(0, len(todoist_val), 2000)])
             else:
-                current_prop_values.append(formatter['method'](todoist_val, property_obj=is_property))
+                current_prop_values.append(target.format(todoist_val))
 
             current_prop_raw_values.append(todoist_val)
         return props
@@ -249,9 +406,11 @@ class TodoistToNotionMapper:
     def map_todoist_to_notion_task(self, task: TodoistTask, notion_db_metadata: dict[str, Any], parent_property: str
                                    ) -> tuple[dict[str, Any], list[dict]]:
         notion_props, child_blocks = {}, []
+        task_dict = task.task.to_dict()
         # Map task properties to Notion properties or child blocks
         for prop in self.mappings.keys():
-            self.map_property(task, prop, notion_db_metadata, notion_props, child_blocks, convert_md_links=True)
+            self.map_property(task, prop, notion_db_metadata, notion_props, child_blocks, convert_md_links=True,
+                              task_dict=task_dict)
         # Map task comments to Notion properties or child blocks
         if task.comments:
             props, blocks = self.parse_prop_list([comment.content for comment in task.comments],
@@ -259,42 +418,22 @@ class TodoistToNotionMapper:
             notion_props.update(props)
             child_blocks.extend(blocks)
         # Add parent page relation
-        parent_page_id = self.extract_parent_notion_uuid(task)
+        parent_page_id = self.resolve_parent_notion_uuid(task)
         if parent_page_id:
             notion_props.update({parent_property: PFormat.single_relation(parent_page_id)})
         return notion_props, child_blocks
 
     def update_properties(self, notion_task: dict, todoist_task: TodoistTask, prop_keys_to_update: list[str], db_metadata: dict):
         props_to_upd = {}
+        task_dict = _update_task_dict(todoist_task)
+        plan = self.get_mapping_plan(db_metadata)
         for prop_key in prop_keys_to_update:
-            mappings = self.get_mapping(prop_key)
-            # TODO handle list properties
-            task_dict = todoist_task.task.to_dict()
-            task_dict['is_completed'] = todoist_task.task.is_completed
-            task_dict['comments'] = [com.content for com in todoist_task.comments]
-            todoist_val = deep_get_task_prop(task_dict, prop_key)
-            default_notion_values = mappings.get('default_values', {})
-            mapped_prop = mappings.get('values', {}).get(str(todoist_val), {})
-            mapped_name = mapped_prop.get('name', default_notion_values.get('name'))
-            if not mapped_name or mapped_name not in db_metadata.keys():
+            if not (mapped := self._map_update_value(task_dict, prop_key, plan, db_metadata)):
                 continue
-            mapped_type = db_metadata[mapped_name]['type']
-            parser = get_notion_formatter_mapper().get(mapped_type)['parser']
-
-            if todoist_val is not None and (not isinstance(todoist_val, list) or len(todoist_val) != 0):
-                props = self.parse_prop_list_to_dict(todoist_val if isinstance(todoist_val, list) else [todoist_val],
-                                                     prop_key,
-                                                     db_metadata, prop_key == 'content')
-                new_val = reduce(lambda x, y: f"{x}{y}", props[mapped_name]['raw_val'], '')
-                formatted_values = props[mapped_name]['values']
-            else:
-                new_val = None
-                if mapped_type in ['title', 'rich_text', 'relation']:
-                    formatted_values = [None]
-                else:
-                    props = self.parse_prop_list_to_dict([None], prop_key, db_metadata, prop_key == 'content')
-                    formatted_values = props[mapped_name]['values']
-            old_val = parser(notion_task, mapped_name)
+            target, new_val, formatted_values = mapped
+            mapped_name = target.name
+            mapped_type = target.type
+            old_val = target.formatter['parser'](notion_task, mapped_name)
 
             if new_val != old_val:
                 _LOG.debug(f"for {todoist_task.task.content=}, {prop_key=} \n\t\t{old_val=}, \n\t\t{new_val=}")
@@ -309,22 +448,96 @@ class TodoistToNotionMapper:
                     props_to_upd[mapped_name] = formatted_values[0]
         return props_to_upd
 
+    def fingerprint_properties(self, todoist_task: TodoistTask, prop_keys: list[str], db_metadata: dict
+                               ) -> dict[str, str]:
+        """Hash of the Notion payload update_properties would write, per property key"""
+        task_dict = _update_task_dict(todoist_task)
+        plan = self.get_mapping_plan(db_metadata)
+        fingerprints = {}
+        for prop_key in prop_keys:
+            mapped = self._map_update_value(task_dict, prop_key, plan, db_metadata)
+            fingerprints[prop_key] = fingerprint((mapped[0].name, mapped[2]) if mapped else None)
+        return fingerprints
+
+    def _map_update_value(self, task_dict: dict, prop_key: str, plan: dict[str, PropertyPlan], db_metadata: dict
+                          ) -> tuple[ValueTarget, str | None, list] | None:
+        """Target property, comparable raw value and formatted values of a task property, None if not mapped"""
+        todoist_val = deep_get_task_prop(task_dict, prop_key)
+        target = plan[prop_key].target(todoist_val)
+        if not target.is_property or not target.formatter:
+            return None
+        if todoist_val is not None and (not isinstance(todoist_val, list) or len(todoist_val) != 0):
+            props = self.parse_prop_list_to_dict(todoist_val if isinstance(todoist_val, list) else [todoist_val],
+                                                 prop_key,
+                                                 db_metadata, prop_key == 'content')
+            new_val = reduce(lambda x, y: f"{x}{y}", props[target.name]['raw_val'], '')
+            formatted_values = props[target.name]['values']
+        else:
+            new_val = None
+            if target.type in ['title', 'rich_text', 'relation']:
+                formatted_values = [None]
+            else:
+                props = self.parse_prop_list_to_dict([None], prop_key, db_metadata, prop_key == 'content')
+                formatted_values = props[target.name]['values']
+        return target, new_val, formatted_values
+
 
-class TodoistFetcher:
-    def __init__(self):
-        self.todoist_api = TodoistAPI(token=config.TODOIST_TOKEN)
-        self.sync_api = SyncTodoistAPI(api_key=config.TODOIST_TOKEN)
-        self.sync_api.sync(True)
+def _update_task_dict(todoist_task: TodoistTask) -> dict:
+    task_dict = todoist_task.task.to_dict()
+    task_dict['is_completed'] = todoist_task.task.is_completed
+    task_dict['comments'] = [com.content for com in todoist_task.comments]
+    return task_dict
 
-    def get_completed_tasks(self, since: datetime = None) -> list[Task]:
-        ss = since if since else datetime.now(UTC) - timedelta(days=90)
-        result = self.todoist_api.get_completed_tasks_by_completion_date(since=ss, until=datetime.now(UTC))
-        return [task for page in result for task in page]
+
+def fingerprint(payload) -> str:
+    """Stable hash of a JSON-like payload"""
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+class TodoistFetcher(_LazyTodoistAPI):
+    """
+    Reads tasks, comments and activity-log events from Todoist.
+    With a store, task state is read from the items kept there by incremental Sync API syncs
+    instead of REST lookups. Nothing is requested before the first read.
+    """
+
+    def __init__(self, store: LocalStore = None, todoist_api: TodoistAPI = None):
+        self._todoist_api = todoist_api
+        self.store = store
+        # task id -> comments fetched in earlier cycles, least recently used first
+        self._comments: OrderedDict[str, list[Comment]] = OrderedDict()
+        self._comments_lock = threading.Lock()
+        self._pending_watermarks: dict[str, int] = {}  # stream -> id of the newest event read, not yet committed
+        self._pending_completed: dict[str, datetime] = {}  # stream -> end of the completed tasks read, not committed
+
+    def get_completed_tasks(self, since: datetime = None, stream: str = None) -> list[Task]:
+        """
+        Tasks completed since `since` (at most the last 90 days).
+        @param stream: name of the consumer of these tasks. Without `since`, only tasks completed after the end of
+            the stream's committed fetch (minus COMPLETED_TASKS_OVERLAP for clock skew) are read.
+            The stream moves forward with `commit_event_watermarks`.
+        """
+        until = datetime.now(UTC)
+        ss = max(since or self._get_completed_since(stream) or until - COMPLETED_WINDOW, until - COMPLETED_WINDOW)
+        result = self.todoist_api.get_completed_tasks_by_completion_date(since=ss, until=until)
+        tasks = [task for page in result for task in page]
+        if stream and not since:
+            self._pending_completed[stream] = until
+        _LOG.debug(f"Received {len(tasks)} tasks completed since {ss.isoformat()}")
+        return tasks
+
+    def _get_completed_since(self, stream: str | None) -> datetime | None:
+        synced_until = self.store.get_state(f"{COMPLETED_STATE}.{stream}") if stream and self.store else None
+        if not synced_until:
+            return None
+        return datetime.fromisoformat(synced_until) - timedelta(seconds=config.COMPLETED_TASKS_OVERLAP)
 
     def get_events(self, limit=10000, batch_size=100,
                    event_type: EventType = None,
                    object_type: ObjectType = None,
-                   object_event_types: list[ObjectEventType] = None) -> list[dict]:
+                   object_event_types: list[ObjectEventType] = None,
+                   stream: str = None) -> list[dict]:
         """
         For todoist_api doc possible kwargs see https://developer.todoist.com/sync/v9/#get-activity-logs
         @param limit: limit of all collected events available from Todoist.
@@ -333,30 +546,89 @@ class TodoistFetcher:
         @param object_type: filter events by object type (e.g. 'item', 'project', 'note'),
         @param object_event_types: list of strings of the form [object_type]:[event_type].
             When this parameter is specified the object_type and event_type parameters are ignored.
+        @param stream: name of the consumer of these events. If given, only events newer than the stream's
+            committed watermark are returned and pagination stops as soon as it reaches older ones.
+            The watermark moves forward with `commit_event_watermarks`.
+            Without a watermark all pages are read, up to TODOIST_ACTIVITY_WORKERS of them concurrently.
         @return: event objects (see https://developer.todoist.com/sync/v9/#activity).
         """
         if 0 > batch_size > 100:
             _LOG.warning(f"{batch_size=}, but value must be between 1 and 100. Setting value to 100")
             batch_size = 100
 
-        self.sync_api.sync()
-        events = []
-        count = batch_size
         params = {'limit': batch_size, 'offset': 0}
         if event_type:
             params['event_type'] = event_type
         if object_type:
             params['object_type'] = object_type
         if object_event_types:
-            params['object_event_types'] = object_event_types
-        while len(events) < count:
-            result = self._send_sync_get('activity/get', **params)
-            events.extend(result['events'])
-            if params['offset'] == 0:
-                count = min(result['count'], limit)
-            params['offset'] += batch_size
+            params['object_event_types'] = json.dumps(object_event_types)
+        watermark = self._get_watermark(stream)
+        result = self._send_sync_get('activity/get', **params)
+        count = min(result['count'], limit)
+        if watermark:
+            events = self._get_events_until(watermark, result, params, count)
+        else:
+            # Full scan: the total is known after the first page, so the rest can be fetched at once
+            pages = self._get_event_pages(params, range(batch_size, count, batch_size))
+            events = _unique_events(result['events'] + pages)
+        if stream and events:
+            self._pending_watermarks[stream] = max(int(x['id']) for x in events)
+        _LOG.debug(f"Received {len(events)} new events" + (f" for {stream=}" if stream else ""))
         return events
 
+    def _get_events_until(self, watermark: int, result: dict, params: dict, count: int) -> list[dict]:
+        """Page through the log until reaching events older than the watermark"""
+        events = []
+        while True:
+            # Activity log is ordered newest first, so everything after the watermark was seen before
+            new_events = [x for x in result['events'] if int(x['id']) > watermark]
+            events.extend(new_events)
+            if len(events) >= count or len(new_events) < len(result['events']) or not result['events']:
+                return events
+            params['offset'] += params['limit']
+            result = self._send_sync_get('activity/get', **params)
+
+    def _get_event_pages(self, params: dict, offsets: range) -> list[dict]:
+        """Fetch activity-log pages at `offsets` concurrently, keeping the log order"""
+        def fetch(offset: int) -> list[dict]:
+            return self._send_sync_get('activity/get', **{**params, 'offset': offset})['events']
+
+        with ThreadPoolExecutor(max_workers=config.TODOIST_ACTIVITY_WORKERS) as pool:
+            return [x for page in pool.map(fetch, offsets) for x in page]
+
+    @sync_metrics.phase('snapshot')
+    def get_event_snapshot(self, object_event_types: list[ObjectEventType] = None) -> EventSnapshot:
+        """
+        Read new events of all sync phases in one paginated pass.
+        Commit with `commit_event_watermarks(SNAPSHOT_STREAM)` once the whole cycle is processed.
+        """
+        events = self.get_events(object_event_types=object_event_types or SNAPSHOT_EVENT_TYPES,
+                                 stream=SNAPSHOT_STREAM)
+        return EventSnapshot(events)
+
+    def commit_event_watermarks(self, *streams: str):
+        """
+        Mark events read by `get_events` and completed tasks read by `get_completed_tasks`
+        (of the given or of all streams) as processed
+        """
+        for stream in streams or list(self._pending_watermarks):
+            if stream in self._pending_watermarks and self.store:
+                self.store.set_state(f"{ACTIVITY_STATE}.{stream}", str(self._pending_watermarks.pop(stream)))
+        for stream in streams or list(self._pending_completed):
+            if stream in self._pending_completed and self.store:
+                self.store.set_state(f"{COMPLETED_STATE}.{stream}", self._pending_completed.pop(stream).isoformat())
+
+    def commit_event_watermark(self, stream: str, event_id: int):
+        """Mark events of `stream` up to `event_id` as processed, for streams read before all of them were"""
+        if self.store and event_id > self._get_watermark(stream):
+            self.store.set_state(f"{ACTIVITY_STATE}.{stream}", str(event_id))
+
+    def _get_watermark(self, stream: str | None) -> int:
+        if not stream or not self.store:
+            return 0
+        return int(self.store.get_state(f"{ACTIVITY_STATE}.{stream}") or 0)
+
     def get_all_tasks(self, get_completed: bool = False) -> list[Task]:
         active_tasks = [task for page in self.todoist_api.get_tasks() for task in page]
 
@@ -366,40 +638,48 @@ class TodoistFetcher:
 
         return active_tasks
 
-    def get_recently_added_tasks(self, since_date: datetime = None, days_old: int = None, get_completed: bool = True
-                                 ) -> list[Task]:
-        events: list[dict] = self.get_events(object_type='item', event_type='added')
+    def get_recently_added_tasks(self, since_date: datetime = None, days_old: int = None, get_completed: bool = True,
+                                 snapshot: EventSnapshot = None) -> list[Task]:
+        events: list[dict] = snapshot.of_type('item:added') if snapshot \
+            else self.get_events(object_type='item', event_type='added', stream='created')
         since_date = datetime.now(UTC) - timedelta(days=days_old) if not since_date and days_old else None
         created_tasks: list[str] = list(x['v2_object_id'] for x in events if not since_date
-                                        or datetime.strptime(x['event_date'], "%Y-%m-%dT%H:%M:%S.%fZ")
+                                        or datetime.strptime(x['event_date'], EVENT_DATE_FORMAT)
                                         > since_date)
         _LOG.debug(f"Received {len(created_tasks)} recently created tasks" + (
             f" for the last {days_old} days" if days_old else ""))
 
         all_tasks = self.get_tasks(ids=created_tasks)
         if get_completed:
-            completed_tasks = self.get_completed_tasks(since=since_date)
+            # Without an explicit period only tasks completed since the last committed fetch are read
+            completed_tasks = self.get_completed_tasks(since=since_date, stream=None if since_date else 'created')
             all_tasks.extend(completed_tasks)
 
         return all_tasks
 
-    def get_updated_tasks(self, sync_created: bool = True, sync_completed: bool = True
-                          ) -> tuple[list[Task], dict[str, str]]:
+    def get_updated_tasks(self, sync_created: bool = True, sync_completed: bool = True,
+                          snapshot: EventSnapshot = None) -> tuple[list[Task], dict[str, str]]:
         """
+        @param snapshot: events of the current cycle, read from the activity log if not given
         @return: tuple of updated tasks and dict of task_id: event_date
         """
-        events = self.get_events(object_type='item', event_type='updated')
-        if sync_completed:
-            events.extend(self.get_events(object_type='item', event_type='completed'))
-            # sort to have the latest event_date after reducing to unique dict entry
-            events.sort(key=lambda k: k['event_date'])
+        if snapshot:
+            events = snapshot.of_type('item:updated', 'item:completed') if sync_completed \
+                else snapshot.of_type('item:updated')
+        else:
+            events = self.get_events(object_type='item', event_type='updated', stream='updated')
+            if sync_completed:
+                events.extend(self.get_events(object_type='item', event_type='completed', stream='completed'))
+        # sort to have the latest event_date after reducing to unique dict entry
+        events.sort(key=lambda k: k['event_date'])
         updated_tasks_to_date = {x['v2_object_id']: LOCAL_TIMEZONE.normalize(
             pytz.timezone("UTC").localize(
-                datetime.strptime(x['event_date'], "%Y-%m-%dT%H:%M:%S.%fZ"))).isoformat() for x in events}
+                datetime.strptime(x['event_date'], EVENT_DATE_FORMAT))).isoformat() for x in events}
 
         tasks_to_exclude = []
         if not sync_created:
-            events = self.get_events(object_type='item', event_type='added')
+            events = snapshot.of_type('item:added') if snapshot \
+                else self.get_events(object_type='item', event_type='added', stream='updated.added')
             tasks_to_exclude.extend([x['v2_object_id'] for x in events])
         tasks_to_exclude = list(set(tasks_to_exclude))
         for task_id in tasks_to_exclude:
@@ -407,37 +687,278 @@ class TodoistFetcher:
                 updated_tasks_to_date.pop(task_id)
 
         task_ids = list(updated_tasks_to_date.keys())
-        updated_tasks = self.get_tasks(task_ids)
+        updated_tasks = self.get_tasks(task_ids, include_completed=sync_completed)
         # items.all(
         #     lambda x: x['id'] in updated_tasks_to_date.keys() and (sync_completed or x['checked'] == 0))
         _LOG.debug(f"Received {len(updated_tasks)} updated tasks")
         return updated_tasks, updated_tasks_to_date
 
-    def get_tasks(self, ids: list[str]) -> list[Task]:
+    def sync_items(self) -> int:
+        """
+        Bring the store's items up to date with the Sync API, incrementally from the stored sync_token
+        (a full sync the first time).
+        @return: number of items added, changed or deleted since the previous sync
+        """
+        sync_token = self.store.get_state(ITEMS_SYNC_TOKEN_STATE) or '*'
+        result = _send_sync_post('sync', sync_token=sync_token, resource_types=ITEM_RESOURCE_TYPES)
+        items = [_v2_item(item) for item in result.get('items', [])]
+        self.store.apply_item_sync(items, result.get('full_sync', sync_token == '*'), result['sync_token'])
+        _LOG.debug(f"Synced {len(items)} changed items" + (" (full sync)" if sync_token == '*' else ""))
+        return len(items)
+
+    def get_tasks(self, ids: list[str], include_completed: bool = False) -> list[Task]:
+        """
+        Tasks of the given ids, read from the store's items after an incremental sync.
+        Ids the store doesn't know are looked up with the REST API (without a store all of them are).
+        @param include_completed: also return completed tasks instead of active ones only
+        """
+        if not self.store:
+            return self._get_tasks_from_api(ids)
+        self.sync_items()
+        items = self.store.get_items(ids)
+        tasks, missing = [], []
+        for task_id in ids:
+            if task_id not in items:
+                missing.append(task_id)
+            elif include_completed or not items[task_id].get('checked'):
+                try:
+                    tasks.append(_task_from_item(items[task_id]))
+                except Exception as e:
+                    _LOG.warning(f"Failed to read task {task_id} from the item store, fetching it: {e}")
+                    missing.append(task_id)
+        if missing:
+            _LOG.debug(f"{len(missing)} of {len(ids)} tasks are not in the item store, fetching them")
+            tasks.extend(self._get_tasks_from_api(missing))
+        return tasks
+
+    def _get_tasks_from_api(self, ids: list[str]) -> list[Task]:
         updated_tasks = []
         for i in range(0, len(ids), 100):
             chunk_ids = ids[i:i + 100]
             updated_tasks.extend([task for page in self.todoist_api.get_tasks(ids=chunk_ids) for task in page])
         return updated_tasks
 
-    def append_comments(self, tasks: list[TodoistTask]):
-        """Append comments to tasks."""
-        # for task in [task for task in tasks if task.task.comment_count > 0]:
-        for task in tqdm(tasks, desc="Fetching comments", unit="task"):
-            try:
-                task.comments = [comment for page in self.todoist_api.get_comments(task_id=task.task.id) for comment in page]
-            except Exception as e:
-                _LOG.error(f"Failed to fetch comments for task {task.task.id}: {e}")
+    def append_comments(self, tasks: list[TodoistTask], snapshot: EventSnapshot = None):
+        """
+        Append comments to tasks.
+        Comments fetched in earlier cycles (of the last TODOIST_COMMENT_CACHE_SIZE tasks) are reused
+        until note events show they changed, tasks known to have no comments are skipped
+        and the rest is fetched in parallel.
+        @param snapshot: events of the current cycle, note events are read from the activity log if not given
+        """
+        changed_task_ids = _comment_task_ids(snapshot.of_type(*COMMENT_EVENT_TYPES)) if snapshot \
+            else self._get_tasks_with_changed_comments()
+        # Events are read once, so drop changed comments of every task, not only of the tasks of this call
+        with self._comments_lock:
+            for task_id in changed_task_ids:
+                self._comments.pop(task_id, None)
+        note_counts = self._note_counts([task.task.id for task in tasks])
+        tasks_to_fetch = []
+        for task in tasks:
+            task_id = task.task.id
+            if (comments := self._cached_comments(task_id)) is not None:
+                task.comments = comments
+            elif note_counts.get(task_id) == 0:
+                task.comments = []
+            else:
+                tasks_to_fetch.append(task)
+
+        _LOG.debug(f"Fetching comments for {len(tasks_to_fetch)} of {len(tasks)} tasks")
+        with ThreadPoolExecutor(max_workers=config.TODOIST_COMMENT_WORKERS) as pool:
+            for _ in tqdm(pool.map(self._fetch_comments, tasks_to_fetch), total=len(tasks_to_fetch),
+                          desc="Fetching comments", unit="task"):
+                pass
+
+    def _note_counts(self, ids: list[str]) -> dict[str, int]:
+        """Comment counts of the tasks the item store knows, Task objects don't carry them"""
+        if not self.store:
+            return {}
+        return {task_id: item['note_count'] for task_id, item in self.store.get_items(ids).items()
+                if 'note_count' in item}
+
+    def _fetch_comments(self, task: TodoistTask):
+        try:
+            pages = self.todoist_api.get_comments(task_id=task.task.id)
+            task.comments = [comment for page in pages for comment in page]
+            self._cache_comments(task.task.id, task.comments)
+        except Exception as e:
+            _LOG.error(f"Failed to fetch comments for task {task.task.id}: {e}")
+
+    def _cached_comments(self, task_id: str) -> list[Comment] | None:
+        with self._comments_lock:
+            if task_id not in self._comments:
+                return None
+            self._comments.move_to_end(task_id)
+            return self._comments[task_id]
+
+    def _cache_comments(self, task_id: str, comments: list[Comment]):
+        with self._comments_lock:
+            self._comments[task_id] = comments
+            self._comments.move_to_end(task_id)
+            while len(self._comments) > config.TODOIST_COMMENT_CACHE_SIZE:
+                self._comments.popitem(last=False)
+
+    def _get_tasks_with_changed_comments(self) -> set[str]:
+        """Ids of tasks with comments added, updated or deleted since the previous call"""
+        # Nothing cached yet, every task will be fetched anyway: only move the watermark to the latest event
+        limit = 1 if not self._comments else 10000
+        events = self.get_events(limit=limit, object_event_types=COMMENT_EVENT_TYPES, stream='comments')
+        self.commit_event_watermarks('comments')
+        if not self._comments:
+            return set()
+        return _comment_task_ids(events)
 
     @staticmethod
     def _send_sync_get(endpoint: str, **params) -> dict:
         """Reuse sync api get request"""
         url = f'{command_manager.BASE_URL}/{endpoint}'
-        command_manager._headers.update({'Authorization': f'Bearer {command_manager.settings.api_key}'})
-        with httpx.Client(headers=command_manager._headers) as client:
-            response = client.get(url=url, params=params)
-            response.raise_for_status()
-            return response.json()  # type: ignore
+        response = todoist_sync_client().get(url=url, params=params, headers=_sync_headers())
+        response.raise_for_status()
+        return response.json()  # type: ignore
+
+
+class ParentPageResolver:
+    """
+    Finds Notion pages of parent tasks without a Todoist request per subtask. Looks at pages created
+    in the current run first, then at the local task index, and only then at the parents' Todoist
+    descriptions, fetched in one batch by `prefetch`.
+    """
+
+    def __init__(self, store: LocalStore, fetcher: TodoistFetcher):
+        self.store = store
+        self.fetcher = fetcher
+        self._page_ids: dict[str, str] = {}  # todoist task id -> notion page id
+
+    def add_created(self, task_id: str, page_id: str):
+        self._page_ids[task_id] = page_id
+
+    def prefetch(self, tasks: list[TodoistTask]):
+        """Start a new run: batch-resolve parents that are neither in `tasks` nor in the local index."""
+        self._page_ids.clear()
+        task_ids = {task.task.id for task in tasks}
+        unresolved = list({task.task.parent_id for task in tasks if task.task.parent_id
+                           and task.task.parent_id not in task_ids and not self.store.is_linked(task.task.parent_id)})
+        if not unresolved:
+            return
+        for parent_task in self.fetcher.get_tasks(unresolved):
+            if page_id := extract_notion_uuid(parent_task.description):
+                self._page_ids[parent_task.id] = page_id
+        _LOG.debug(f"Resolved {len(self._page_ids)} of {len(unresolved)} parent pages from Todoist")
+
+    def resolve(self, task: TodoistTask) -> str | None:
+        parent_id = task.task.parent_id
+        if not parent_id:
+            return None
+        if parent_id in self._page_ids:
+            return self._page_ids[parent_id]
+        link = self.store.get_link(parent_id)
+        return link.page_id if link else None
+
+
+class BacklinkWriter:
+    """
+    Queues `item_update` description changes and sends them to the Sync API in batches
+    of up to SYNC_COMMANDS_LIMIT commands instead of one REST call per task.
+    Usage example:
+        backlinks = BacklinkWriter()
+        backlinks.queue(task_id, description)
+        errors = backlinks.flush()
+    """
+
+    def __init__(self, batch_size: int = SYNC_COMMANDS_LIMIT):
+        self.batch_size = min(batch_size, SYNC_COMMANDS_LIMIT)
+        self._commands: list[dict] = []
+        self._lock = threading.Lock()
+        self.errors: dict[str, Any] = {}  # task id -> sync_status error of every flush so far
+
+    def queue(self, task_id: str, description: str) -> None:
+        """Queue a description update, sending the batch once it is full"""
+        with self._lock:
+            self._commands.append({'type': 'item_update', 'uuid': str(uuid.uuid4()),
+                                   'args': {'id': task_id, 'description': description}})
+            full = len(self._commands) >= self.batch_size
+        # Another thread may have taken the batch in the meantime
+        if full and (batch := self._take_batch()):
+            self._commit(batch)
+
+    def flush(self) -> dict[str, Any]:
+        """
+        Send all queued commands.
+        @return: errors by task id of the commands Todoist rejected
+        """
+        while batch := self._take_batch():
+            self._commit(batch)
+        return self.errors
+
+    def _take_batch(self) -> list[dict]:
+        with self._lock:
+            batch, self._commands = self._commands[:self.batch_size], self._commands[self.batch_size:]
+            return batch
+
+    def _commit(self, commands: list[dict]) -> None:
+        try:
+            sync_status = _send_sync_commands(commands).get('sync_status', {})
+        except httpx.HTTPError as e:
+            sync_status = {x['uuid']: {'error': str(e)} for x in commands}
+        for command in commands:
+            status = sync_status.get(command['uuid'], {'error': "no sync_status returned"})
+            if status != 'ok':
+                task_id = command['args']['id']
+                _LOG.error(f"Error updating description of Todoist task {task_id}: {status}")
+                with self._lock:
+                    self.errors[task_id] = status
+        _LOG.debug(f"Sent {len(commands)} item_update commands")
+
+
+def _send_sync_commands(commands: list[dict]) -> dict:
+    return _send_sync_post('sync', commands=json.dumps(commands))
+
+
+def _send_sync_post(endpoint: str, **data) -> dict:
+    url = f'{command_manager.BASE_URL}/{endpoint}'
+    response = todoist_sync_client().post(url=url, data=data, headers=_sync_headers())
+    response.raise_for_status()
+    return response.json()  # type: ignore
+
+
+def _sync_headers() -> dict:
+    return {**command_manager._headers, 'Authorization': f'Bearer {config.TODOIST_TOKEN}'}
+
+
+def _v2_item(item: dict) -> dict:
+    """Sync API item with the ids of the REST API"""
+    v2_item = {key: value for key, value in item.items() if key not in V2_ID_FIELDS}
+    for v2_field, field in V2_ID_FIELDS.items():
+        if item.get(v2_field):
+            v2_item[field] = item[v2_field]
+    return v2_item
+
+
+def _task_from_item(item: dict) -> Task:
+    """REST Task of a stored Sync API item, with the fields Sync items lack filled in"""
+    data = {**ITEM_DEFAULTS, **item}
+    data.setdefault('added_by_uid', item.get('user_id'))
+    data.setdefault('updated_at', item.get('completed_at') or item.get('added_at'))
+    # Both names load the same attribute, keep the one Sync items use
+    data.setdefault('collapsed', data.pop('is_collapsed', False))
+    data.setdefault('child_order', data.pop('order', 0))
+    return Task.from_dict(data)
+
+
+def _unique_events(events: list[dict]) -> list[dict]:
+    """Events added during a scan shift the offsets, which repeats the last events of a page on the next one"""
+    seen = set()
+    return [x for x in events if x['id'] not in seen and not seen.add(x['id'])]
+
+
+def _comment_task_ids(note_events: list[dict]) -> set[str]:
+    return {str(item_id) for x in note_events if (item_id := x.get('v2_parent_item_id') or x.get('parent_item_id'))}
+
+
+def extract_notion_uuid(description: str | None) -> str | None:
+    """Notion page id from a markdown Notion link at the start of a Todoist description"""
+    match = re.match(NOTION_MARKDOWN_LINK_PATTERN, description or '')
+    return match.group(6) if match else None
 
 
 def deep_get_task_prop(task_dict, keys, default=None):
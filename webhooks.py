@@ -0,0 +1,213 @@
+"""
+Receiver for Todoist webhooks (https://developer.todoist.com/sync/v9/#webhooks).
+Deliveries are turned into activity-log shaped events, so the sync phases can process them
+like a polled EventSnapshot, but only for the tasks that actually changed.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, UTC
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+from todoist_utils import EVENT_DATE_FORMAT
+
+_LOG = logging.getLogger(__name__)
+
+ITEM_EVENTS = ('item:added', 'item:updated', 'item:completed', 'item:uncompleted', 'item:deleted')
+NOTE_EVENTS = ('note:added', 'note:updated', 'note:deleted')
+SIGNATURE_HEADER = 'X-Todoist-Hmac-SHA256'
+DELIVERY_ID_HEADER = 'X-Todoist-Delivery-ID'
+
+
+def sign(body: bytes, secret: str) -> str:
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def verify_signature(body: bytes, signature: str | None, secret: str | None) -> bool:
+    """Deliveries are signed with the app's client secret. Without a configured secret every delivery is accepted."""
+    if not secret:
+        return True
+    return bool(signature) and hmac.compare_digest(sign(body, secret), signature)
+
+
+def to_activity_events(payload: dict, delivery_id: str = None) -> list[dict]:
+    """
+    Translate a webhook delivery into activity-log events.
+    Comment changes also produce an `item:updated` event of their task, so the task's comments get synced.
+    """
+    event_name = payload.get('event_name')
+    data = payload.get('event_data') or {}
+    event_date = datetime.now(UTC).strftime(EVENT_DATE_FORMAT)
+    if event_name in ITEM_EVENTS:
+        object_type, event_type = event_name.split(':')
+        # Uncompleting changes the task like any other update
+        event_type = 'updated' if event_type == 'uncompleted' else event_type
+        return [{'id': delivery_id, 'object_type': object_type, 'event_type': event_type,
+                 'v2_object_id': str(data.get('v2_id') or data['id']), 'event_date': event_date}]
+    if event_name in NOTE_EVENTS:
+        task_id = str(data.get('v2_item_id') or data.get('item_id'))
+        object_type, event_type = event_name.split(':')
+        return [{'id': delivery_id, 'object_type': object_type, 'event_type': event_type,
+                 'v2_object_id': str(data.get('v2_id') or data.get('id')), 'v2_parent_item_id': task_id,
+                 'event_date': event_date},
+                {'id': delivery_id, 'object_type': 'item', 'event_type': 'updated',
+                 'v2_object_id': task_id, 'event_date': event_date}]
+    _LOG.debug(f"Ignoring webhook event {event_name}")
+    return []
+
+
+class EventQueue:
+    """
+    Thread-safe queue of webhook events waiting for a targeted sync.
+    Repeated events of the same task and type are merged, keeping the latest one.
+    """
+
+    def __init__(self):
+        self._events: dict[tuple[str, str, str], dict] = {}
+        self._condition = threading.Condition()
+
+    def put(self, events: list[dict]):
+        with self._condition:
+            for event in events:
+                key = (event['object_type'], event['event_type'], event['v2_object_id'])
+                self._events.pop(key, None)
+                self._events[key] = event
+            self._condition.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until events are queued. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._events, timeout)
+
+    def drain(self, debounce: float = 0.0) -> list[dict]:
+        """Take all queued events, after giving bursts of related deliveries `debounce` seconds to arrive"""
+        if debounce:
+            time.sleep(debounce)
+        with self._condition:
+            events, self._events = list(self._events.values()), {}
+            return events
+
+    def __len__(self):
+        with self._condition:
+            return len(self._events)
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server: 'WebhookReceiver'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not verify_signature(body, self.headers.get(SIGNATURE_HEADER), self.server.secret):
+            _LOG.warning(f"Rejected webhook delivery with invalid signature from {self.client_address[0]}")
+            self._reply(401)
+            return
+        try:
+            payload = json.loads(body)
+            events = to_activity_events(payload, self.headers.get(DELIVERY_ID_HEADER))
+        except (ValueError, KeyError, AttributeError) as e:
+            _LOG.warning(f"Rejected malformed webhook delivery: {e!r}")
+            self._reply(400)
+            return
+        self.server.queue.put(events)
+        _LOG.debug(f"Webhook {payload.get('event_name')} queued {len(events)} events")
+        # Todoist retries deliveries that aren't answered with 200
+        self._reply(200)
+
+    def _reply(self, status: int):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        _LOG.debug(format % args)
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """
+    Local HTTP endpoint for Todoist webhooks, served from a background thread.
+    Listening on a non-loopback host requires a secret, so deliveries from the network are verified.
+    Usage example:
+        with WebhookReceiver(port=8080) as receiver:
+            if receiver.queue.wait(timeout=900):
+                events = receiver.queue.drain()
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = None, port: int = None, secret: str = None, queue: EventQueue = None):
+        host = host or config.TODOIST_WEBHOOK_HOST
+        secret = secret if secret is not None else config.TODOIST_WEBHOOK_SECRET
+        if not secret and not _is_loopback(host):
+            raise ValueError(f"Refusing to accept unsigned webhooks on {host}, set TODOIST_WEBHOOK_SECRET "
+                             f"or listen on a loopback host")
+        super().__init__((host, port if port is not None else config.TODOIST_WEBHOOK_PORT), _WebhookHandler)
+        self.secret = secret
+        self.queue = queue if queue else EventQueue()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> 'WebhookReceiver':
+        self._thread = threading.Thread(target=self.serve_forever, name='webhook-receiver', daemon=True)
+        self._thread.start()
+        _LOG.info(f"Listening for Todoist webhooks on {self.url}")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+def replay(url: str, deliveries: list[dict], secret: str = None) -> list[int]:
+    """
+    Post recorded webhook deliveries to a receiver, signed like Todoist does.
+    :return: response status of every delivery
+    """
+    statuses = []
+    for i, delivery in enumerate(deliveries):
+        body = json.dumps(delivery).encode()
+        headers = {'Content-Type': 'application/json', DELIVERY_ID_HEADER: f"replay-{i}"}
+        if secret:
+            headers[SIGNATURE_HEADER] = sign(body, secret)
+        request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request) as res:
+                statuses.append(res.status)
+        except urllib.error.HTTPError as e:
+            statuses.append(e.code)
+    return statuses
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded Todoist webhook deliveries")
+    parser.add_argument('file', help="JSON file with a list of webhook payloads")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{config.TODOIST_WEBHOOK_PORT}/")
+    args = parser.parse_args()
+    with open(args.file, encoding='utf-8') as f:
+        print(replay(args.url, json.load(f), config.TODOIST_WEBHOOK_SECRET))